@@ -0,0 +1,286 @@
+# async_main.py
+import asyncio
+import contextvars
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot import asyncio_helper, types, util
+from telebot.async_telebot import AsyncTeleBot
+
+# === Асинхронный режим: python async_main.py ===
+# Приём апдейтов (long polling) и таймеры пробежек живут в одном цикле
+# asyncio. Горячие разделы — /start, выбор языка и пола, меню, старт и стоп
+# пробежки, рейтинг — обрабатываются корутинами ниже: ответы — корутины
+# AsyncTeleBot, но через общий outbox (ведра чатов и бота, пауза после 429
+# общие с таймерами пробежек), а в поток (asyncio.to_thread) выносятся только
+# обращения к SQLite — подъём профиля и сессии, запись пробежки и монет,
+# чужие профили в рейтинге. Тексты и клавиатуры — общие с main.py.
+# Остальные апдейты выполняют синхронные хендлеры main.py в небольшом пуле
+# потоков. Апдейты одного пользователя обрабатываются строго по очереди,
+# разных — параллельно.
+os.environ["BOT_MODE"] = "async"
+
+import main  # noqa: E402 — хендлеры и состояние; при BOT_MODE=async main не запускает polling
+import logsetup  # noqa: E402
+import metrics  # noqa: E402
+from router import TextRouter  # noqa: E402
+from scheduler import LoopScheduler  # noqa: E402
+
+ASYNC_THREADS = int(os.getenv("ASYNC_THREADS", "8"))
+if main.TELEGRAM_API_URL:
+    asyncio_helper.API_URL = main.TELEGRAM_API_URL.rstrip("/") + "/bot{0}/{1}"
+    asyncio_helper.FILE_URL = main.TELEGRAM_API_URL.rstrip("/") + "/file/bot{0}/{1}"
+
+_UPDATE_KINDS = ("message", "edited_message", "callback_query", "inline_query", "chosen_inline_result",
+                 "shipping_query", "pre_checkout_query", "poll_answer", "my_chat_member", "chat_member")
+_current = contextvars.ContextVar("update", default=None)   # апдейт, который разбирает текущая задача
+
+
+def update_user(update):
+    for kind in _UPDATE_KINDS:
+        obj = getattr(update, kind, None)
+        if obj is not None:
+            who = getattr(obj, "from_user", None) or getattr(obj, "user", None) or getattr(obj, "chat", None)
+            return who.id if who else None
+    return None
+
+
+class AsyncRuntime(AsyncTeleBot):
+    def __init__(self, token, sync_bot, threads=ASYNC_THREADS):
+        super().__init__(token)
+        self.sync_bot = sync_bot
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix="sharkan-async")
+        self._tails = {}      # user_id -> последняя задача пользователя
+        self._background = set()
+        self.handled = 0
+
+    async def process_new_updates(self, updates):
+        for update in updates:
+            self.submit(update)
+
+    def submit(self, update) -> asyncio.Task:
+        key = update_user(update)
+        task = asyncio.create_task(self._handle(update, self._tails.get(key)))
+        self._tails[key] = task
+        task.add_done_callback(lambda t, k=key: self._tails.get(k) is t and self._tails.pop(k))
+        return task
+
+    async def _handle(self, update, prev):
+        if prev is not None:
+            await asyncio.wait([prev])
+        logsetup.tag_update(update)
+        try:
+            if update.message is not None or update.callback_query is not None:
+                # профиль поднимается из базы заранее: дальше язык и меню — из памяти
+                uid = update_user(update)
+                if uid is not None:
+                    await profile_ready(str(uid))
+                _current.set(update)
+                await super().process_new_updates([update])
+            else:
+                await self.run_sync(update)
+        except Exception as e:
+            logging.error(f"[ASYNC_HANDLER_ERROR] {e}")
+        self.handled += 1
+
+    async def run_sync(self, update):
+        # синхронные хендлеры main.py — в пуле потоков
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self.sync_bot.process_new_updates, [update])
+
+    def spawn(self, coro):
+        # фоновая задача без ожидания (удаление старого сообщения)
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    async def drain(self):
+        # дождаться всех принятых апдейтов
+        while self._tails or self._background:
+            await asyncio.wait(list(self._tails.values()) + list(self._background))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+bot = AsyncRuntime(main.BOT_TOKEN, main.bot)
+hot = TextRouter()   # кнопки, которые обрабатываются здесь; остальные — main.router
+
+
+async def profile_ready(user_id):
+    if not main.user_profiles.loaded(user_id):
+        await asyncio.to_thread(main.user_profiles.get, user_id)
+
+
+def send(chat_id, method, /, *args, **kwargs):
+    # запрос в чат через outbox: await send(chat_id, bot.send_message, chat_id, text)
+    return main.outbox.submit_async(asyncio.get_running_loop(), chat_id, method, *args, **kwargs)
+
+
+async def _still_loading(obj):
+    if isinstance(obj, types.CallbackQuery):
+        await bot.answer_callback_query(obj.id, main.STILL_LOADING)
+    else:
+        await send(obj.chat.id, bot.send_message, obj.chat.id, main.STILL_LOADING)
+
+
+def needs(*names):
+    return main.startup.needs_async(*names, on_timeout=_still_loading)
+
+
+async def _delete(chat_id, message_id):
+    try:
+        await send(chat_id, bot.delete_message, chat_id, message_id, coalesce_key=("delete", message_id))
+    except Exception:
+        pass   # ошибка уже в логе outbox ([OUTBOX_ERROR])
+
+
+async def send_clean(chat_id, user_id, text, reply_markup=None):
+    # как main.send_clean_message: старое сообщение удаляется, не задерживая ответ
+    if main.sessions.peek(user_id) is not None:
+        session = main.sessions.get(user_id)
+    else:
+        session = await asyncio.to_thread(main.sessions.get, user_id)
+    if session.last_msg_id:
+        bot.spawn(_delete(chat_id, session.last_msg_id))
+    msg = await send(chat_id, bot.send_message, chat_id, text, reply_markup=reply_markup)
+    session.last_msg_id = msg.message_id
+    return msg.message_id
+
+
+# === Старт, язык, пол ===
+@bot.message_handler(commands=["start"])
+async def start(message):
+    main.remember_user(message.from_user)
+    await send(message.chat.id, bot.send_message, message.chat.id, main.LANGUAGE_PROMPT,
+               reply_markup=main.keyboards.get("languages"))
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("lang_"))
+async def set_language(call):
+    text, markup = main.language_chosen(str(call.from_user.id), call.data.split("_", 1)[1])
+    await send(call.message.chat.id, bot.edit_message_text, chat_id=call.message.chat.id,
+               message_id=call.message.message_id, text=text, reply_markup=markup)
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("gender_"))
+async def handle_gender(call):
+    chat_id = call.message.chat.id
+    user_id = str(call.from_user.id)
+    confirm = main.gender_chosen(user_id, call.data.split("_", 1)[1])
+    await send(chat_id, bot.edit_message_reply_markup, chat_id=chat_id, message_id=call.message.message_id)
+    await send(chat_id, bot.send_message, chat_id, confirm)
+    text, markup = main.main_menu(user_id)
+    await send(chat_id, bot.send_message, chat_id, text, reply_markup=markup)
+
+
+# === Меню ===
+@hot.route(*main.MAIN_MENU_BUTTONS)
+async def back_to_main_menu(message):
+    text, markup = main.main_menu(str(message.from_user.id))
+    await send(message.chat.id, bot.send_message, message.chat.id, text, reply_markup=markup)
+
+
+@hot.route(*main.RUN_MENU_BUTTONS)
+async def run_menu(message):
+    user_id = str(message.from_user.id)
+    await send_clean(message.chat.id, user_id, *main.run_menu_reply(user_id))
+
+
+@hot.route(*main.SETTINGS_BUTTONS)
+async def settings_menu(message):
+    text, markup = main.settings_reply(str(message.from_user.id))
+    await send(message.chat.id, bot.send_message, message.chat.id, text, reply_markup=markup)
+
+
+# === Пробежка ===
+@hot.route(*main.START_RUN_BUTTONS)
+@needs("runs", "ledger")
+async def start_run(message):
+    user_id = str(message.from_user.id)
+    lang = main.get_lang(user_id)
+    await asyncio.to_thread(main.begin_run, message.chat.id, user_id, lang)   # журнал пробежки
+    await send_clean(message.chat.id, user_id, main.run_started_text(lang))
+
+
+@hot.route(*main.STOP_RUN_BUTTONS)
+@needs("runs", "ledger")
+async def stop_run(message):
+    user_id = str(message.from_user.id)
+    lang = main.get_lang(user_id)
+    finished = await asyncio.to_thread(main.finish_run, user_id)   # запись пробежки и монет
+    if finished is None:
+        await send_clean(message.chat.id, user_id, main.RUN_NOT_ACTIVE.get(lang, main.RUN_NOT_ACTIVE["ua"]))
+        return
+    await send_clean(message.chat.id, user_id, main.run_result_text(lang, *finished))
+
+
+# === Рейтинг ===
+@hot.route(*main.LEADERBOARD_BUTTONS)
+@needs("runs")
+async def leaderboard_handler(message):
+    text = await asyncio.to_thread(main.leaderboard_text, str(message.from_user.id))
+    await send(message.chat.id, bot.send_message, message.chat.id, text, reply_markup=main.keyboards.get("leaderboard"))
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("lb_"))
+@needs("runs")
+async def leaderboard_window(call):
+    window = call.data.split("_", 1)[1]
+    if window not in main.LEADERBOARD_TITLES:
+        await bot.answer_callback_query(call.id)
+        return
+    text = await asyncio.to_thread(main.leaderboard_text, str(call.from_user.id), window)
+    try:
+        await send(call.message.chat.id, bot.edit_message_text, chat_id=call.message.chat.id,
+                   message_id=call.message.message_id, text=text, reply_markup=main.keyboards.get("leaderboard"))
+    except Exception as e:
+        if "message is not modified" in str(e):
+            logging.debug(f"[LEADERBOARD_EDIT] {e}")
+        else:
+            logging.error(f"[LEADERBOARD_EDIT_ERROR] {e}")
+    await bot.answer_callback_query(call.id)
+
+
+# === Маршрутизатор и всё остальное ===
+# Кнопки горячих разделов — через hot; прочие тексты, команды, документы,
+# анкета и колбэки — синхронным хендлерам main.py. Регистрируются последними.
+@bot.message_handler(func=lambda message: hot.resolve(message) is not None)
+async def route_text(message):
+    await hot.resolve(message)(message)
+
+
+async def to_sync(obj):
+    await bot.run_sync(_current.get())
+
+
+bot.register_message_handler(to_sync, content_types=util.content_type_media + util.content_type_service,
+                             func=lambda message: True)
+bot.register_callback_query_handler(to_sync, func=lambda call: True)
+
+metrics.instrument_async_api()
+metrics.instrument_router(hot)
+metrics.instrument_bot(bot, skip=(route_text, to_sync))
+
+
+async def run():
+    # таймеры пробежек переезжают в цикл событий — без отдельного потока
+    previous = main.timer_scheduler
+    main.timer_scheduler = LoopScheduler(asyncio.get_running_loop())
+    for timer in list(main.running_timers.values()):
+        timer.rearm(previous)   # восстановленные из журнала пробежки
+    previous.stop()
+    main.bot.threaded = False
+    try:
+        await bot.infinity_polling(skip_pending=True)
+    finally:
+        await bot.drain()
+        await bot.close_session()
+        bot.shutdown()
+        main.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
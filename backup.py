@@ -0,0 +1,326 @@
+# backup.py
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+from datetime import datetime
+
+import requests
+
+# === Бэкапы: сжатые архивы с манифестом ===
+# Архив — tar.gz: profiles.jsonl, runs.jsonl, coins.jsonl, sessions.jsonl,
+# deleted.jsonl, файлы контента и manifest.json с sha256 и размерами. Данные
+# пишутся потоково (построчно из среза SQLite), так что память не растёт
+# вместе с базой. Инкрементальный бэкап содержит только профили с rev больше
+# прошлого, новые пробежки, новые операции с монетами и изменённые файлы
+# контента. Удаления видны по таблице deleted (её ведут триггеры): удалённые
+# профили уходят в deleted.jsonl, а если удаляли пробежки или операции с
+# монетами, таблица пишется целиком и при восстановлении заменяется (список
+# replace в манифесте). Сессии небольшие — всегда целиком. Восстановление
+# сначала проверяет весь архив, потом применяет базу одной транзакцией
+# и подменяет файлы через os.replace.
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "10"))
+ARCHIVE_SUFFIX = ".tar.gz"
+FORMAT = 1
+CHUNK = 64 * 1024
+STATE_KEY = "backup_state"
+
+
+class BackupError(Exception):
+    pass
+
+
+def _sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def download_to(url, path, timeout=60):
+    # потоковая загрузка файла (документ из Telegram) без чтения в память
+    with requests.get(url, stream=True, timeout=timeout) as r:
+        r.raise_for_status()
+        with open(path, "wb") as f:
+            for chunk in r.iter_content(CHUNK):
+                f.write(chunk)
+
+
+class BackupManager:
+    def __init__(self, storage, content_files, backup_dir=BACKUP_DIR, keep=BACKUP_KEEP):
+        self.storage = storage
+        self.content_files = content_files   # callable -> [(ключ в архиве, путь на диске)]
+        self.backup_dir = backup_dir
+        self.keep = keep
+
+    # --- состояние цепочки бэкапов ---
+    def state(self):
+        raw = self.storage.get_meta(STATE_KEY)
+        return json.loads(raw) if raw else None
+
+    def _save_state(self, state):
+        self.storage.set_meta(STATE_KEY, json.dumps(state))
+
+    def reset_state(self):
+        # после восстановления из старого JSON следующий бэкап будет полным
+        self.storage.set_meta(STATE_KEY, "")
+
+    # --- создание ---
+    def create(self, full=False) -> str:
+        os.makedirs(self.backup_dir, exist_ok=True)
+        state = None if full else self.state()
+        kind = "incremental" if state else "full"
+        backup_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        manifest = {
+            "format": FORMAT,
+            "id": backup_id,
+            "kind": kind,
+            "base": state["id"] if state else None,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "files": {}
+        }
+        work = tempfile.mkdtemp(prefix=".work_", dir=self.backup_dir)
+        try:
+            with self.storage.snapshot() as conn:
+                deleted_id, deleted = self._deleted_since(conn, state.get("deleted_id", 0) if state else None)
+                # удаляли пробежки / операции с монетами — такую таблицу пишем целиком
+                replace = sorted({"runs", "coins"} & deleted.keys())
+                profile_rev = self._dump_profiles(conn, os.path.join(work, "profiles.jsonl"),
+                                                  state["profile_rev"] if state else 0)
+                run_id = self._dump_runs(conn, os.path.join(work, "runs.jsonl"),
+                                         state["run_id"] if state and "runs" not in replace else 0)
+                coin_id = self._dump_coins(conn, os.path.join(work, "coins.jsonl"),
+                                           state.get("coin_id", 0) if state and "coins" not in replace else 0)
+                self._dump_sessions(conn, os.path.join(work, "sessions.jsonl"))
+                with open(os.path.join(work, "deleted.jsonl"), "w", encoding="utf-8") as out:
+                    for uid in deleted.get("profiles", ()):
+                        out.write(json.dumps({"table": "profiles", "key": uid}, ensure_ascii=False) + "\n")
+            manifest["profile_rev"], manifest["run_id"], manifest["coin_id"] = profile_rev, run_id, coin_id
+            manifest["replace"] = replace
+            members = [("profiles.jsonl", "profiles", None), ("runs.jsonl", "runs", None),
+                       ("coins.jsonl", "coins", None), ("sessions.jsonl", "sessions", None),
+                       ("deleted.jsonl", "deleted", None)]
+
+            content_hashes = dict(state["content"]) if state else {}
+            for key, path in self.content_files():
+                if not os.path.exists(path):
+                    continue
+                digest = _sha256_file(path)
+                if state and content_hashes.get(key) == digest:
+                    continue
+                shutil.copyfile(path, os.path.join(work, key))
+                content_hashes[key] = digest
+                members.append((key, "content", key))
+
+            for name, dataset, key in members:
+                path = os.path.join(work, name)
+                manifest["files"][name] = {
+                    "dataset": dataset, "key": key,
+                    "sha256": _sha256_file(path), "size": os.path.getsize(path)
+                }
+            with open(os.path.join(work, "manifest.json"), "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+            final = os.path.join(self.backup_dir, f"sharkan_{backup_id}_{kind}{ARCHIVE_SUFFIX}")
+            tmp = final + ".tmp"
+            with tarfile.open(tmp, "w:gz") as tar:
+                tar.add(os.path.join(work, "manifest.json"), arcname="manifest.json")
+                for name, _, _ in members:
+                    tar.add(os.path.join(work, name), arcname=name)
+            os.replace(tmp, final)
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+
+        self._save_state({"id": backup_id, "profile_rev": profile_rev, "run_id": run_id,
+                          "coin_id": coin_id, "deleted_id": deleted_id, "content": content_hashes})
+        # удаления до deleted_id уже в цепочке архивов
+        self.storage.prune_deleted(deleted_id)
+        self.rotate()
+        logging.info(f"[BACKUP] {kind} {final} ({os.path.getsize(final)} bytes)")
+        return final
+
+    @staticmethod
+    def _deleted_since(conn, since_id):
+        # -> (последний id, {набор данных: [ключи]}); since_id=None — полный бэкап, удаления не нужны
+        last = conn.execute("SELECT COALESCE(MAX(id), 0) FROM deleted").fetchone()[0]
+        deleted = {}
+        if since_id is not None:
+            names = {"profiles": "profiles", "runs": "runs", "coin_tx": "coins"}
+            for tbl, key in conn.execute("SELECT tbl, key FROM deleted WHERE id > ? ORDER BY id", (since_id,)):
+                deleted.setdefault(names.get(tbl, tbl), []).append(key)
+        return last, deleted
+
+    @staticmethod
+    def _dump_sessions(conn, path):
+        with open(path, "w", encoding="utf-8") as out:
+            for uid, title, page in conn.execute("SELECT user_id, book_title, page FROM sessions"):
+                out.write(json.dumps({"user_id": uid, "book_title": title, "page": page},
+                                     ensure_ascii=False) + "\n")
+
+    @staticmethod
+    def _dump_profiles(conn, path, since_rev):
+        last = since_rev
+        with open(path, "w", encoding="utf-8") as out:
+            rows = conn.execute("SELECT user_id, data, rev FROM profiles WHERE rev > ? ORDER BY rev", (since_rev,))
+            for uid, data, rev in rows:
+                # data уже JSON — вставляем как есть, без повторного разбора
+                out.write(f'{{"user_id": {json.dumps(uid)}, "data": {data}}}\n')
+                last = rev
+        return last
+
+    @staticmethod
+    def _dump_runs(conn, path, since_id):
+        last = since_id
+        with open(path, "w", encoding="utf-8") as out:
+            rows = conn.execute(
+                "SELECT id, user_id, date, duration_min, calories FROM runs WHERE id > ? ORDER BY id", (since_id,))
+            for rid, uid, d, m, c in rows:
+                out.write(json.dumps({"user_id": uid, "date": d, "duration_min": m, "calories": c},
+                                     ensure_ascii=False) + "\n")
+                last = rid
+        return last
+
+    @staticmethod
+    def _dump_coins(conn, path, since_id):
+        last = since_id
+        with open(path, "w", encoding="utf-8") as out:
+            rows = conn.execute(
+                "SELECT id, user_id, kind, amount, balance, reason, idem_key, created FROM coin_tx "
+                "WHERE id > ? ORDER BY id", (since_id,))
+            for tid, uid, kind, amount, balance, reason, key, created in rows:
+                out.write(json.dumps({"user_id": uid, "kind": kind, "amount": amount, "balance": balance,
+                                      "reason": reason, "key": key, "created": created},
+                                     ensure_ascii=False) + "\n")
+                last = tid
+        return last
+
+    def rotate(self):
+        # храним последние keep архивов и полный бэкап, от которого идёт
+        # самый старый из них, — иначе инкрементальные архивы бесполезны
+        archives = sorted(f for f in os.listdir(self.backup_dir)
+                          if f.startswith("sharkan_") and f.endswith(ARCHIVE_SUFFIX))
+        if self.keep <= 0 or len(archives) <= self.keep:
+            return
+        cut = len(archives) - self.keep
+        while cut > 0 and not archives[cut].endswith("_full" + ARCHIVE_SUFFIX):
+            cut -= 1
+        for name in archives[:cut]:
+            try:
+                os.remove(os.path.join(self.backup_dir, name))
+            except OSError as e:
+                logging.error(f"[BACKUP_ROTATE_ERROR] {name}: {e}")
+
+    # --- восстановление ---
+    def verify(self, archive_path) -> dict:
+        try:
+            with tarfile.open(archive_path, "r:gz") as tar:
+                manifest = json.load(tar.extractfile("manifest.json"))
+                if manifest.get("format") != FORMAT:
+                    raise BackupError(f"неизвестный формат архива: {manifest.get('format')}")
+                for name, meta in manifest["files"].items():
+                    h, size = hashlib.sha256(), 0
+                    src = tar.extractfile(name)
+                    for chunk in iter(lambda: src.read(CHUNK), b""):
+                        h.update(chunk)
+                        size += len(chunk)
+                    if h.hexdigest() != meta["sha256"] or size != meta["size"]:
+                        raise BackupError(f"контрольная сумма не совпала: {name}")
+        except (tarfile.TarError, KeyError, ValueError) as e:
+            raise BackupError(f"архив повреждён: {e}")
+        if manifest["kind"] == "incremental":
+            state = self.state()
+            if not state or state["id"] != manifest["base"]:
+                raise BackupError(f"инкрементальный архив требует базу {manifest['base']}")
+        return manifest
+
+    def restore(self, archive_path) -> dict:
+        manifest = self.verify(archive_path)
+        full = manifest["kind"] == "full"
+        targets = dict(self.content_files())
+        staged = []
+        try:
+            with tarfile.open(archive_path, "r:gz") as tar:
+                # файлы контента — во временные файлы рядом с целевыми
+                for name, meta in manifest["files"].items():
+                    if meta["dataset"] != "content" or meta["key"] not in targets:
+                        continue
+                    dest = targets[meta["key"]]
+                    tmp = dest + ".restore"
+                    with open(tmp, "wb") as out:
+                        shutil.copyfileobj(tar.extractfile(name), out, CHUNK)
+                    with open(tmp, "r", encoding="utf-8") as f:
+                        json.load(f)   # битый JSON не должен попасть на место рабочего файла
+                    staged.append((tmp, dest))
+
+                profiles = (
+                    (rec["user_id"], rec["data"]) for rec in _iter_jsonl(tar.extractfile("profiles.jsonl")))
+                runs = (
+                    (r["user_id"], r["date"], int(r["duration_min"]), int(r["calories"]))
+                    for r in _iter_jsonl(tar.extractfile("runs.jsonl")))
+                # архивы до журнала монет / сессий их не содержат — тогда не трогаем
+                has_coins = "coins.jsonl" in manifest["files"]
+                coins = (
+                    (c["user_id"], c["kind"], c["amount"], c["balance"], c["reason"], c["key"], c["created"])
+                    for c in _iter_jsonl(tar.extractfile("coins.jsonl"))) if has_coins else ()
+                has_sessions = "sessions.jsonl" in manifest["files"]
+                sessions = (
+                    (s["user_id"], s["book_title"], int(s["page"]))
+                    for s in _iter_jsonl(tar.extractfile("sessions.jsonl"))) if has_sessions else ()
+                deleted = [d["key"] for d in _iter_jsonl(tar.extractfile("deleted.jsonl"))
+                           if d["table"] == "profiles"] if "deleted.jsonl" in manifest["files"] else []
+                replace = set(manifest.get("replace", ()))
+                with self.storage.batch():
+                    if full:
+                        self.storage.replace_profiles(profiles)
+                        self.storage.replace_runs(runs)
+                        if has_coins:
+                            self.storage.replace_coin_txs(coins)
+                    else:
+                        # сначала удаления: профиль, созданный заново после удаления, придёт в profiles
+                        self.storage.delete_profiles(deleted)
+                        self.storage.upsert_profiles(profiles)
+                        if "runs" in replace:
+                            self.storage.replace_runs(runs)
+                        else:
+                            self.storage.insert_runs(runs)
+                        if "coins" in replace:
+                            self.storage.replace_coin_txs(coins)
+                        else:
+                            self.storage.insert_coin_txs(coins)
+                    if has_sessions:
+                        self.storage.replace_sessions(sessions)
+                    # удаления, сделанные самим восстановлением, в следующий бэкап не нужны
+                    self.storage.prune_deleted()
+        except BaseException:
+            for tmp, _ in staged:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+            raise
+        for tmp, dest in staged:
+            os.replace(tmp, dest)
+
+        # следующий инкрементальный бэкап считается от восстановленного состояния
+        with self.storage.snapshot() as conn:
+            profile_rev = conn.execute("SELECT COALESCE(MAX(rev), 0) FROM profiles").fetchone()[0]
+            run_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM runs").fetchone()[0]
+            coin_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM coin_tx").fetchone()[0]
+        prev = (self.state() or {}).get("content", {}) if not full else {}
+        content = dict(prev)
+        content.update({m["key"]: m["sha256"] for m in manifest["files"].values() if m["dataset"] == "content"})
+        self._save_state({"id": manifest["id"], "profile_rev": profile_rev, "run_id": run_id,
+                          "coin_id": coin_id, "deleted_id": 0, "content": content})
+        return manifest
+
+
+def _iter_jsonl(fileobj):
+    for line in fileobj:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
@@ -0,0 +1,152 @@
+# bench/fake_api.py
+import itertools
+import json
+import queue
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+# === Локальный заменитель Telegram Bot API ===
+# Отвечает на getUpdates / sendMessage / editMessageText / deleteMessage /
+# answerCallbackQuery / getFile / sendDocument и т.п. так, как это делает
+# Telegram, и записывает каждый исходящий вызов бота. Апдейты в очередь
+# кладёт нагрузочный сценарий (bench/loadtest.py); бот подключается через
+# TELEGRAM_API_URL=http://127.0.0.1:<port>.
+_PATH = re.compile(r"^/bot(?P<token>[^/]+)/(?P<method>\w+)$")
+_FILE_PATH = re.compile(r"^/file/bot[^/]+/(?P<path>.+)$")
+MESSAGE_METHODS = {"sendMessage", "editMessageText", "sendDocument", "sendPhoto", "sendAudio", "sendVoice"}
+
+
+class FakeBotAPI:
+    def __init__(self, host="127.0.0.1", port=0):
+        self._updates = queue.Queue()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1000)
+        self._lock = threading.Lock()
+        self._listeners = []
+        self.calls = {}                  # method -> число вызовов
+        self.files = {}                  # file_id -> bytes для getFile/скачивания
+        self.fail_next = {}              # method -> [(error_code, description, retry_after)]
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-bot-api", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # --- сторона сценария ---
+    def push(self, update: dict) -> int:
+        update = dict(update, update_id=next(self._update_ids))
+        self._updates.put(update)
+        return update["update_id"]
+
+    def on_call(self, fn):
+        # fn(method, params, monotonic_time) — для подсчёта задержек ответов
+        self._listeners.append(fn)
+        return fn
+
+    # --- сторона бота ---
+    def _next_updates(self, limit, timeout):
+        # выданный апдейт считается подтверждённым — повторной доставки нет
+        deadline = time.monotonic() + timeout
+        batch = []
+        while len(batch) < limit:
+            wait = deadline - time.monotonic() if not batch else 0
+            try:
+                batch.append(self._updates.get(timeout=max(0.0, wait)) if wait > 0 else self._updates.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _result(self, method, params):
+        if method == "getUpdates":
+            if int(params.get("offset", 0) or 0) < 0:
+                return []   # skip_pending при старте бота: очередь сценария не трогаем
+            return self._next_updates(int(params.get("limit", 100) or 100), float(params.get("timeout", 0) or 0))
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "SHARKAN", "username": "sharkan_bench_bot"}
+        if method == "getFile":
+            file_id = params.get("file_id", "")
+            return {"file_id": file_id, "file_unique_id": file_id, "file_path": f"documents/{file_id}",
+                    "file_size": len(self.files.get(file_id, b""))}
+        if method in MESSAGE_METHODS:
+            chat_id = int(params.get("chat_id", 0) or 0)
+            mid = int(params["message_id"]) if method == "editMessageText" else next(self._message_ids)
+            return {"message_id": mid, "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"}, "text": params.get("text", "")}
+        return True
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status, body: bytes, ctype="application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _api(self):
+                parts = urlsplit(self.path)
+                m = _FILE_PATH.match(parts.path)
+                if m:
+                    data = api.files.get(m.group("path").rsplit("/", 1)[-1])
+                    self._reply(200 if data is not None else 404, data or b"", "application/octet-stream")
+                    return
+                m = _PATH.match(parts.path)
+                if not m:
+                    self._reply(404, b'{"ok":false,"error_code":404,"description":"Not Found"}')
+                    return
+                method = m.group("method")
+                params = dict(parse_qsl(parts.query))
+                length = int(self.headers.get("Content-Length", 0) or 0)
+                body = self.rfile.read(length) if length else b""
+                if body and self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+                    params.update(parse_qsl(body.decode("utf-8")))
+                now = time.monotonic()
+                with api._lock:
+                    api.calls[method] = api.calls.get(method, 0) + 1
+                    failure = api.fail_next.get(method, [None]).pop(0) if api.fail_next.get(method) else None
+                if method != "getUpdates":
+                    for fn in api._listeners:
+                        fn(method, params, now)
+                if failure:
+                    code, description, retry_after = failure
+                    payload = {"ok": False, "error_code": code, "description": description}
+                    if retry_after:
+                        payload["parameters"] = {"retry_after": retry_after}
+                    self._reply(code, json.dumps(payload).encode())
+                    return
+                payload = {"ok": True, "result": api._result(method, params)}
+                self._reply(200, json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+
+            do_GET = do_POST = _api
+
+            def log_message(self, fmt, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    import sys
+    api = FakeBotAPI(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8081).start()
+    print(f"fake Bot API on {api.url}")
+    try:
+        api._thread.join()
+    except KeyboardInterrupt:
+        api.stop()
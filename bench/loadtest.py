@@ -0,0 +1,251 @@
+# bench/loadtest.py
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fake_api import FakeBotAPI  # noqa: E402
+from books import BookStore  # noqa: E402
+
+# === Нагрузочный прогон main.py против локального Bot API ===
+# Бот запускается отдельным процессом (как в проде), сценарные пользователи
+# пишут ему через FakeBotAPI и ждут ответа перед следующим шагом. В отчёте:
+# задержка ответа p50/p90/p99, пропускная способность, исходящие вызовы API
+# на апдейт и рост памяти процесса бота. Пример:
+#   python bench/loadtest.py --users 40 --mix menu,books,runs,shop
+#   python bench/loadtest.py --json out.json --check baseline.json
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONTENT_FILES = ("books_ua", "books_ua.json", "books_ru.json", "books_en.json",
+                 "motivations.json", "coaches_tips.json", "plans.json")
+REPLY_TIMEOUT = 10.0
+
+_START = [("text", "/start"), ("cb", "lang_ua"), ("cb", "gender_male")]
+
+
+def scenario(name, book_title=None):
+    if name == "menu":
+        return _START + [
+            ("text", "🧠 Мотивація"), ("text", "🎓 Поради від тренерів"), ("text", "📈 Статистика"),
+            ("text", "🏆 Рейтинг SHARKAN"), ("cb", "lb_week"), ("text", "🪙 SHRK COINS"),
+            ("text", "👤 Мій профіль"), ("text", "80"), ("text", "180"), ("text", "Схуднути"),
+            ("text", "⬅️ Головне меню"),
+        ]
+    if name == "books":
+        steps = _START + [("text", "📚 Книги SHARKAN")]
+        if book_title:
+            steps += [("text", f"📖 {book_title}")] + [("text", "➡️ Вперед")] * 5
+            steps += [("text", "🔢 Перейти до сторінки"), ("text", "2"), ("text", "⬅️ Назад")]
+        return steps + [("text", "⬅️ Головне меню")]
+    if name == "runs":
+        return _START + [
+            ("text", "⏱ Режим БІГ"), ("text", "🏁 Почати біг"), ("sleep", 2.5),
+            ("text", "⛔️ Завершити біг"), ("text", "📊 Мої результати"), ("text", "🏆 Рейтинг SHARKAN"),
+        ]
+    if name == "shop":
+        return _START + [
+            ("text", "🛍 Магазин"), ("cb", "buy_sound_pack"), ("cb", "buy_sound_pack"),
+            ("text", "🪙 SHRK COINS"),
+        ]
+    raise ValueError(f"неизвестный сценарий: {name}")
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def _rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+class SimUser:
+    def __init__(self, uid, steps, think):
+        self.uid = uid
+        self.steps = steps
+        self.think = think
+        self.sent_at = None
+        self.replied = threading.Event()
+        self.latencies = []
+        self.no_reply = 0
+
+
+class LoadTest:
+    def __init__(self, api, users):
+        self.api = api
+        self.users = {u.uid: u for u in users}
+        self._callbacks = {}       # callback_query id -> uid
+        self._lock = threading.Lock()
+        self.updates = 0
+        api.on_call(self._on_call)
+
+    def _on_call(self, method, params, now):
+        if method == "answerCallbackQuery":
+            uid = self._callbacks.get(params.get("callback_query_id"))
+        else:
+            try:
+                uid = int(params.get("chat_id", 0))
+            except ValueError:
+                return
+        user = self.users.get(uid)
+        if user is not None and user.sent_at is not None and not user.replied.is_set():
+            user.latencies.append(now - user.sent_at)
+            user.replied.set()
+
+    def _update(self, user, kind, payload):
+        who = {"id": user.uid, "is_bot": False, "first_name": f"Bench{user.uid}"}
+        chat = {"id": user.uid, "type": "private"}
+        with self._lock:
+            self.updates += 1
+            n = self.updates
+        if kind == "cb":
+            cq_id = f"{user.uid}-{n}"
+            self._callbacks[cq_id] = user.uid
+            return {"callback_query": {"id": cq_id, "chat_instance": "bench", "data": payload, "from": who,
+                                       "message": {"message_id": 1, "date": 0, "chat": chat, "text": "…"}}}
+        msg = {"message_id": n, "date": int(time.time()), "chat": chat, "from": who, "text": payload}
+        if payload.startswith("/"):
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(payload.split()[0])}]
+        return {"message": msg}
+
+    def _drive(self, user):
+        for kind, payload in user.steps:
+            if kind == "sleep":
+                time.sleep(payload)
+                continue
+            update = self._update(user, kind, payload)
+            user.replied.clear()
+            user.sent_at = time.monotonic()
+            self.api.push(update)
+            if not user.replied.wait(REPLY_TIMEOUT):
+                user.no_reply += 1
+            time.sleep(user.think)
+
+    def run(self):
+        threads = [threading.Thread(target=self._drive, args=(u,), daemon=True) for u in self.users.values()]
+        started = time.monotonic()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return time.monotonic() - started
+
+
+def run_bench(users=20, mix=("menu", "books", "runs", "shop"), think=0.2, keep_dir=False):
+    workdir = tempfile.mkdtemp(prefix="sharkan_bench_")
+    for name in CONTENT_FILES:
+        if os.path.exists(os.path.join(REPO, name)):
+            shutil.copy(os.path.join(REPO, name), workdir)
+    titles = BookStore(workdir).load().catalog("ua")
+
+    api = FakeBotAPI().start()
+    env = dict(os.environ, BOT_TOKEN="123456:bench", TELEGRAM_API_URL=api.url, BOT_MODE="polling",
+               RUN_TICK_SEC="1", METRICS_PORT="0", SHARKAN_DB=os.path.join(workdir, "sharkan.db"),
+               BACKUP_DIR=os.path.join(workdir, "backups"))
+    errlog = open(os.path.join(workdir, "stderr.log"), "w+b")
+    proc = subprocess.Popen([sys.executable, os.path.join(REPO, "main.py")], cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=errlog)
+    try:
+        # готовность: бот прошёл старт и ждёт апдейты (первый getUpdates — пропуск старых)
+        deadline = time.monotonic() + 60
+        while api.calls.get("getUpdates", 0) < 2 and proc.poll() is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+        if proc.poll() is not None:
+            errlog.seek(0)
+            raise RuntimeError(f"бот завершился при старте: {errlog.read().decode()[-2000:]}")
+        rss_start = _rss_kb(proc.pid)
+        api.calls.clear()
+
+        sims = [SimUser(10_000 + i, scenario(mix[i % len(mix)], titles[0] if titles else None), think)
+                for i in range(users)]
+        test = LoadTest(api, sims)
+        elapsed = test.run()
+        time.sleep(0.5)   # хвост фоновых вызовов (удаления, правки таймера)
+        rss_end = _rss_kb(proc.pid)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        api.stop()
+        errlog.close()
+        if not keep_dir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = [x for u in sims for x in u.latencies]
+    calls = {m: n for m, n in sorted(api.calls.items()) if m != "getUpdates"}
+    return {
+        "users": users,
+        "mix": list(mix),
+        "updates": test.updates,
+        "replies": len(latencies),
+        "no_reply": sum(u.no_reply for u in sims),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_ups": round(test.updates / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 0.50) * 1000, 2),
+            "p90": round(_percentile(latencies, 0.90) * 1000, 2),
+            "p99": round(_percentile(latencies, 0.99) * 1000, 2),
+            "max": round(max(latencies, default=0) * 1000, 2),
+        },
+        "api_calls_per_update": round(sum(calls.values()) / test.updates, 3) if test.updates else 0.0,
+        "api_calls": calls,
+        "rss_kb": {"start": rss_start, "end": rss_end, "growth": rss_end - rss_start},
+    }
+
+
+def check(report, baseline, tolerance):
+    # регрессия: p99 или вызовы API на апдейт выросли больше чем на tolerance
+    problems = []
+    for key, now, was in (
+        ("latency p99", report["latency_ms"]["p99"], baseline["latency_ms"]["p99"]),
+        ("api calls/update", report["api_calls_per_update"], baseline["api_calls_per_update"]),
+    ):
+        if was and now > was * (1 + tolerance):
+            problems.append(f"{key}: {was} -> {now}")
+    return problems
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Нагрузочный прогон SHARKAN BOT")
+    ap.add_argument("--users", type=int, default=20)
+    ap.add_argument("--mix", default="menu,books,runs,shop")
+    ap.add_argument("--think", type=float, default=0.2, help="пауза пользователя между шагами, с")
+    ap.add_argument("--json", help="сохранить отчёт в файл")
+    ap.add_argument("--check", help="сравнить с сохранённым отчётом")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    ap.add_argument("--keep", action="store_true", help="не удалять рабочий каталог")
+    args = ap.parse_args(argv)
+
+    report = run_bench(args.users, tuple(args.mix.split(",")), args.think, args.keep)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.check:
+        with open(args.check, "r", encoding="utf-8") as f:
+            problems = check(report, json.load(f), args.tolerance)
+        for p in problems:
+            print(f"REGRESSION {p}")
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
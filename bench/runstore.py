@@ -0,0 +1,182 @@
+# bench/runstore.py
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from bisect import bisect_left
+from collections import deque
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from leaderboard import WINDOWS, Leaderboard, _Board, period_key  # noqa: E402
+from run_stats import RunHistoryIndex  # noqa: E402
+
+# === Колоночный индекс пробежек против словарей ===
+# Сравнивает прежний путь (список словарей {"date", "duration_min",
+# "calories"} на пользователя, даты через strptime) с колоночным
+# RunHistoryIndex на синтетической истории: построение индекса и рейтинга,
+# память, статистика и серии по всем пользователям, снимок на диск. Пример:
+#   python bench/runstore.py --runs 1200000 --users 60000
+
+
+def make_rows(runs, users, days=365, seed=1):
+    rnd = random.Random(seed)
+    today = date.today()
+    dates = [(today - timedelta(days=d)).isoformat() for d in range(days)]
+    rows = []
+    for _ in range(runs):
+        rows.append((str(100_000 + rnd.randrange(users)), dates[int(rnd.triangular(0, days, 0))],
+                     rnd.randint(10, 60), rnd.randint(100, 700)))
+    rows.sort(key=lambda r: r[1])   # в базе пробежки идут по времени
+    return rows
+
+
+# --- прежний путь: словари и strptime ---
+class LegacyStats:
+    __slots__ = ("runs", "minutes", "calories", "last", "dates")
+
+    def __init__(self):
+        self.runs = self.minutes = self.calories = 0
+        self.last = deque(maxlen=3)
+        self.dates = []
+
+    def add(self, record):
+        self.runs += 1
+        self.minutes += int(record.get("duration_min", 0))
+        self.calories += int(record.get("calories", 0))
+        self.last.append(record)
+        d = datetime.strptime(record["date"], "%Y-%m-%d").date()
+        i = bisect_left(self.dates, d)
+        if i == len(self.dates) or self.dates[i] != d:
+            self.dates.insert(i, d)
+
+    def streak(self, today):
+        cur = today
+        i = bisect_left(self.dates, cur + timedelta(days=1)) - 1
+        streak = 0
+        while i >= 0 and self.dates[i] == cur:
+            streak += 1
+            cur -= timedelta(days=1)
+            i -= 1
+        return streak
+
+
+def legacy_build(rows, today):
+    history = {}
+    for uid, d, m, c in rows:
+        history.setdefault(uid, []).append({"date": d, "duration_min": m, "calories": c})
+    index = {}
+    for uid, recs in history.items():
+        stats = index[uid] = LegacyStats()
+        for r in recs:
+            stats.add(r)
+    periods = {w: period_key(w, today) for w in WINDOWS}
+    totals = {w: {} for w in WINDOWS}
+    for uid, recs in history.items():
+        for r in recs:
+            day = datetime.strptime(r["date"], "%Y-%m-%d").date()
+            for window, acc in totals.items():
+                if period_key(window, day) == periods[window]:
+                    acc[uid] = acc.get(uid, 0) + int(r["duration_min"])
+    boards = {}
+    for window in WINDOWS:
+        board = boards[window] = _Board(periods[window])
+        for uid, mins in totals[window].items():
+            board.add(uid, mins)
+    return history, index, boards
+
+
+def columnar_build(rows, today):
+    index = RunHistoryIndex()
+    index.extend(rows)
+    board = Leaderboard()
+    board.load(index, today)
+    return index, board
+
+
+def _timed(fn, *args):
+    gc.collect()
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, round((time.perf_counter() - started) * 1000, 1)
+
+
+def _memory(fn, *args):
+    gc.collect()
+    tracemalloc.start()
+    result = fn(*args)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, round(current / 1024 / 1024, 1)
+
+
+def run_bench(runs, users):
+    today = date.today()
+    rows = make_rows(runs, users)
+    uids = sorted({r[0] for r in rows})
+    report = {"runs": runs, "users": len(uids)}
+
+    (history, legacy, boards), legacy_ms = _timed(legacy_build, rows, today)
+    (index, board), columnar_ms = _timed(columnar_build, rows, today)
+    for window in WINDOWS:
+        assert [(u, -n) for n, u in boards[window].ranked.first(10)] == board.top(window, 10, today), window
+    report["build_ms"] = {"legacy": legacy_ms, "columnar": columnar_ms}
+
+    def legacy_stats():
+        return sum(s.runs + s.minutes + s.calories + s.streak(today) for s in legacy.values())
+
+    def columnar_stats():
+        return sum(s.runs + s.minutes + s.calories + s.streak(today) for s in map(index.get, uids))
+    a, legacy_ms = _timed(legacy_stats)
+    b, columnar_ms = _timed(columnar_stats)
+    assert a == b, (a, b)
+    report["stats_all_users_ms"] = {"legacy": legacy_ms, "columnar": columnar_ms}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "runs.bin")
+        _, save_ms = _timed(index.save_snapshot, path, len(rows), {"last": None})
+        snap, load_ms = _timed(index.read_snapshot, path)
+        json_path = os.path.join(tmp, "run_history.json")
+
+        def json_save():
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(history, f)
+
+        def json_load():
+            with open(json_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        _, json_save_ms = _timed(json_save)
+        _, json_load_ms = _timed(json_load)
+        report["snapshot"] = {
+            "columnar_bytes": os.path.getsize(path), "columnar_save_ms": save_ms, "columnar_load_ms": load_ms,
+            "json_bytes": os.path.getsize(json_path), "json_save_ms": json_save_ms, "json_load_ms": json_load_ms,
+        }
+    del history, legacy, boards, index, board, snap
+    _, legacy_mb = _memory(legacy_build, rows, today)
+    _, columnar_mb = _memory(columnar_build, rows, today)
+    report["memory_mb"] = {"legacy": legacy_mb, "columnar": columnar_mb}
+    return report
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Индекс пробежек: словари против колонок")
+    ap.add_argument("--runs", type=int, default=1_200_000)
+    ap.add_argument("--users", type=int, default=60_000)
+    ap.add_argument("--json", help="сохранить отчёт в файл")
+    args = ap.parse_args(argv)
+    report = run_bench(args.runs, args.users)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+# bench/startup.py
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fake_api import FakeBotAPI  # noqa: E402
+from bench.loadtest import CONTENT_FILES, REPO, _rss_kb  # noqa: E402
+from storage import Storage  # noqa: E402
+
+# === Холодный старт main.py в зависимости от объёма данных ===
+# Для каждого размера базы (пользователей) генерируется SQLite с профилями и
+# пробежками, бот запускается отдельным процессом, и сразу после запуска в
+# очередь кладётся /start. Время до первого ответа (TTFR) — от запуска
+# процесса до первого sendMessage; «gated» — до ответа на «📈 Статистика»,
+# которой нужна загруженная история пробежек. Пример:
+#   python bench/startup.py --sizes 0,10000,100000
+#   python bench/startup.py --modes lazy,eager --json startup.json
+BENCH_UID = 999_000_001
+REPLY_TIMEOUT = 120.0
+
+
+def build_db(path, users, runs_per_user, seed=1):
+    rnd = random.Random(seed)
+    storage = Storage(path)
+    langs = ("ua", "ru", "en")
+    today = date.today()
+    profiles, history = [], {}
+    for i in range(users):
+        uid = str(100_000 + i)
+        profiles.append((uid, {"first_name": f"User{i}", "language": langs[i % 3], "gender": "male",
+                               "weight": rnd.randint(55, 100), "height": rnd.randint(155, 195), "goal": "lose"}))
+        history[uid] = [{"date": (today - timedelta(days=rnd.randint(0, 60))).isoformat(),
+                         "duration_min": rnd.randint(10, 60), "calories": rnd.randint(100, 700)}
+                        for _ in range(runs_per_user)]
+    storage.upsert_profiles(profiles)
+    storage.replace_runs(history)
+    storage.close()
+
+
+def _update(text, n):
+    who = {"id": BENCH_UID, "is_bot": False, "first_name": "Bench"}
+    msg = {"message_id": n, "date": int(time.time()), "chat": {"id": BENCH_UID, "type": "private"},
+           "from": who, "text": text}
+    if text.startswith("/"):
+        msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+    return {"message": msg}
+
+
+def measure(workdir, db_path, lazy):
+    api = FakeBotAPI().start()
+    replies = []
+    got = threading.Event()
+
+    def on_call(method, params, now):
+        if method == "sendMessage" and str(params.get("chat_id")) == str(BENCH_UID):
+            replies.append(now)
+            got.set()
+    api.on_call(on_call)
+
+    env = dict(os.environ, BOT_TOKEN="123456:bench", TELEGRAM_API_URL=api.url, BOT_MODE="polling",
+               METRICS_PORT="0", SHARKAN_DB=db_path, BACKUP_DIR=os.path.join(workdir, "backups"),
+               LAZY_STARTUP="1" if lazy else "0", LOG_FILE=os.path.join(workdir, "bench.log"))
+    api.push(_update("/start", 1))
+    started = time.monotonic()
+    proc = subprocess.Popen([sys.executable, os.path.join(REPO, "main.py")], cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not got.wait(REPLY_TIMEOUT):
+            raise RuntimeError("нет ответа на /start")
+        ttfr = replies[0] - started
+        got.clear()
+        sent = time.monotonic()
+        api.push(_update("📈 Статистика", 2))
+        if not got.wait(REPLY_TIMEOUT):
+            raise RuntimeError("нет ответа на статистику")
+        gated = replies[-1] - started
+        gated_rtt = replies[-1] - sent
+        rss = _rss_kb(proc.pid)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        api.stop()
+    return {"ttfr_ms": round(ttfr * 1000, 1), "gated_ms": round(gated * 1000, 1),
+            "gated_rtt_ms": round(gated_rtt * 1000, 1), "rss_kb": rss, "ready": _ready_line(workdir)}
+
+
+def _ready_line(workdir):
+    # строка [STARTUP] из лога бота: время этапов
+    try:
+        with open(os.path.join(workdir, "bench.log"), encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f if '"STARTUP"' in line]
+    except (OSError, ValueError):
+        return None
+    return lines[-1]["msg"] if lines else None
+
+
+def run_bench(sizes, runs_per_user=5, modes=("lazy", "eager"), repeat=1):
+    results = []
+    for users in sizes:
+        workdir = tempfile.mkdtemp(prefix="sharkan_startup_")
+        try:
+            for name in CONTENT_FILES:
+                if os.path.exists(os.path.join(REPO, name)):
+                    shutil.copy(os.path.join(REPO, name), workdir)
+            db_path = os.path.join(workdir, "sharkan.db")
+            build_db(db_path, users, runs_per_user)
+            for mode in modes:
+                for _ in range(repeat):
+                    row = {"users": users, "runs": users * runs_per_user, "mode": mode}
+                    row.update(measure(workdir, db_path, mode == "lazy"))
+                    results.append(row)
+                    print(json.dumps(row, ensure_ascii=False), file=sys.stderr)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Холодный старт SHARKAN BOT")
+    ap.add_argument("--sizes", default="0,10000,50000", help="пользователей в базе, через запятую")
+    ap.add_argument("--runs", type=int, default=5, help="пробежек на пользователя")
+    ap.add_argument("--modes", default="lazy,eager")
+    ap.add_argument("--repeat", type=int, default=1)
+    ap.add_argument("--json", help="сохранить отчёт в файл")
+    args = ap.parse_args(argv)
+
+    report = run_bench([int(x) for x in args.sizes.split(",")], args.runs, tuple(args.modes.split(",")),
+                       args.repeat)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+# books.py
+import json
+import logging
+import mmap
+import os
+import threading
+from array import array
+
+# === Библиотека книг ===
+# Исходник — JSON-список книг {"title": ..., "pages": [...]}, по файлу на язык
+# (books_ua / books_ua.json, books_ru, ...). При первом запуске (и когда
+# исходник меняется) страницы один раз перекладываются в плоский файл
+# <исходник>.pages, а рядом пишется индекс со смещениями страниц. В памяти
+# остаются только названия и смещения; текст страницы читается из mmap.
+# close() освобождает файлы и mmap; идущее чтение закрывающийся том дочитает.
+BOOK_LANGS = ("ua", "ru", "en")
+
+
+class Book:
+    __slots__ = ("title", "lang", "offsets")
+
+    def __init__(self, title, lang, offsets):
+        self.title = title
+        self.lang = lang
+        self.offsets = offsets   # array('Q'): начало каждой страницы + конец последней
+
+    def __len__(self):
+        return max(0, len(self.offsets) - 1)
+
+
+class _Volume:
+    # один языковой файл: mmap страниц + книги из индекса
+    def __init__(self, source, pages_path, books):
+        self.source = source
+        self.books = books
+        self._file = open(pages_path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self._lock = threading.Lock()
+        self._readers = 0          # чтения, идущие прямо сейчас
+        self._closing = False
+        self.closed = False
+
+    def read(self, start, end) -> str:
+        with self._lock:
+            if self.closed:
+                raise ValueError(f"{self.source}: том уже закрыт")
+            self._readers += 1
+        try:
+            return self._mm[start:end].decode("utf-8")
+        finally:
+            with self._lock:
+                self._readers -= 1
+                if self._closing and not self._readers:
+                    self._release()
+
+    def close(self):
+        # идёт чтение — закроет последний читатель
+        with self._lock:
+            self._closing = True
+            if not self._readers:
+                self._release()
+
+    def _release(self):
+        if self.closed:
+            return
+        self.closed = True
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+
+def find_source(base_dir, lang):
+    for name in (f"books_{lang}.json", f"books_{lang}"):
+        path = os.path.join(base_dir, name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def _build_index(source, pages_path, index_path, lang):
+    with open(source, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    st = os.stat(source)
+    entries = []
+    pos = 0
+    # tmp-файлы свои у каждого процесса: шарды могут пересобирать индекс одновременно
+    tmp_pages = f"{pages_path}.{os.getpid()}.tmp"
+    with open(tmp_pages, "wb") as out:
+        for book in raw:
+            offsets = [pos]
+            for page in book.get("pages", []):
+                data = str(page).encode("utf-8")
+                out.write(data)
+                pos += len(data)
+                offsets.append(pos)
+            entries.append({
+                "title": book.get("title", "Без назви"),
+                "lang": book.get("lang", lang),
+                "offsets": offsets
+            })
+    index = {"source_mtime": st.st_mtime, "source_size": st.st_size, "books": entries}
+    tmp_index = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_index, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    # индекс публикуется последним: если упадём посередине, пересоберём заново
+    os.replace(tmp_pages, pages_path)
+    os.replace(tmp_index, index_path)
+    return index
+
+
+def _load_index(source, pages_path, index_path, lang):
+    st = os.stat(source)
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if (index.get("source_mtime") == st.st_mtime and index.get("source_size") == st.st_size
+                and os.path.exists(pages_path)):
+            return index
+    except (OSError, ValueError):
+        pass
+    return _build_index(source, pages_path, index_path, lang)
+
+
+class BookStore:
+    def __init__(self, base_dir=".", langs=BOOK_LANGS):
+        self.base_dir = base_dir
+        self.langs = langs
+        self._by_title = {}        # title -> (Book, _Volume)
+        self._catalogs = {}        # lang -> [title, ...]
+        self._sources = {}         # lang -> путь исходника
+        self._volumes = []
+
+    def load(self):
+        by_title, catalogs, sources, volumes = {}, {}, {}, []
+        for lang in self.langs:
+            source = find_source(self.base_dir, lang)
+            if not source:
+                continue
+            try:
+                pages_path = source + ".pages"
+                index = _load_index(source, pages_path, pages_path + ".idx", lang)
+                books = [Book(b["title"], b.get("lang", lang), array("Q", b["offsets"]))
+                         for b in index["books"]]
+                volume = _Volume(source, pages_path, books)
+            except Exception as e:
+                logging.error(f"[LOAD_BOOKS_ERROR] {source}: {e}")
+                continue
+            sources[lang] = source
+            volumes.append(volume)
+            for book in books:
+                by_title.setdefault(book.title, (book, volume))
+                catalogs.setdefault(book.lang, []).append(book.title)
+        self._by_title, self._catalogs, self._sources, self._volumes = by_title, catalogs, sources, volumes
+        return self
+
+    def close(self):
+        for volume in self._volumes:
+            volume.close()
+
+    def source_path(self, lang="ua"):
+        # путь для записи при восстановлении: существующий файл или books_<lang>.json
+        return self._sources.get(lang) or find_source(self.base_dir, lang) \
+            or os.path.join(self.base_dir, f"books_{lang}.json")
+
+    def catalog(self, lang="ua"):
+        return self._catalogs.get(lang) or self._catalogs.get("ua", [])
+
+    def get(self, title):
+        entry = self._by_title.get(title)
+        return entry[0] if entry else None
+
+    def page(self, title, n) -> str:
+        book, volume = self._by_title[title]
+        return volume.read(book.offsets[n], book.offsets[n + 1])
+
+    def __len__(self):
+        return len(self._by_title)
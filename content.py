@@ -0,0 +1,173 @@
+# content.py
+import json
+import logging
+import os
+import threading
+import time
+from types import MappingProxyType
+
+from books import BOOK_LANGS, BookStore
+from plans import PLANS_FILE, parse_templates
+
+# === Реестр контента: мотивации, советы тренеров, книги, шаблоны планов ===
+# Файлы читаются и проверяются в фоне, после чего новый неизменяемый снимок
+# публикуется одной заменой ссылки. Хендлер берёт content.current один раз и
+# до конца работы видит согласованный набор данных, даже если в это время
+# контент перезагружается. Книги прошлого снимка (файлы и mmap) закрываются
+# через RETIRE_SEC после замены — хендлер, успевший взять старый снимок,
+# спокойно дочитает страницу.
+MOTIVATIONS_FILE = "motivations.json"
+COACHES_FILE = "coaches_tips.json"
+POLL_SEC = 5.0
+RETIRE_SEC = 60.0
+
+
+class ContentSnapshot:
+    __slots__ = ("version", "motivations", "coaches", "books", "plans")
+
+    def __init__(self, version, motivations, coaches, books, plans=None):
+        self.version = version
+        self.motivations = motivations   # lang -> tuple[str | MappingProxy]
+        self.coaches = coaches           # lang -> tuple[MappingProxy]
+        self.books = books               # BookStore
+        self.plans = plans               # PlanTemplates или None
+
+    def __setattr__(self, name, value):
+        if hasattr(self, name):
+            raise AttributeError("ContentSnapshot is immutable")
+        object.__setattr__(self, name, value)
+
+
+def _read_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def parse_motivations(raw):
+    if not isinstance(raw, dict):
+        raise ValueError("motivations: ожидается объект {lang: [фразы]}")
+    out = {}
+    for lang, phrases in raw.items():
+        # фраза — строка или {"text", "weight", "goal", "gender"} для ротации (rotation.py)
+        if not isinstance(phrases, list) or not all(
+                isinstance(p, str) or (isinstance(p, dict) and isinstance(p.get("text"), str)) for p in phrases):
+            raise ValueError(f"motivations[{lang}]: ожидается список строк или объектов с text")
+        out[lang] = tuple(p if isinstance(p, str) else MappingProxyType(dict(p)) for p in phrases)
+    return MappingProxyType(out)
+
+
+def parse_coaches(raw):
+    if not isinstance(raw, dict):
+        raise ValueError("coaches: ожидается объект {lang: [тренеры]}")
+    out = {}
+    for lang, tips in raw.items():
+        if not isinstance(tips, list) or not all(isinstance(t, dict) for t in tips):
+            raise ValueError(f"coaches[{lang}]: ожидается список объектов")
+        out[lang] = tuple(MappingProxyType(dict(t)) for t in tips)
+    return MappingProxyType(out)
+
+
+class ContentRegistry:
+    def __init__(self, base_dir=".", poll_sec=POLL_SEC):
+        self.base_dir = base_dir
+        self.poll_sec = poll_sec
+        self._current = None
+        self._stamp = None
+        self._version = 0
+        self._lock = threading.Lock()       # одна перезагрузка за раз
+        self._listeners = []
+        self._retired = []                  # (когда заменён, BookStore) — ждут закрытия
+        self._thread = None
+
+    @property
+    def current(self) -> ContentSnapshot:
+        return self._current
+
+    def on_publish(self, fn):
+        # fn(snapshot) вызывается после публикации нового снимка
+        self._listeners.append(fn)
+        return fn
+
+    def watched_files(self):
+        files = [MOTIVATIONS_FILE, COACHES_FILE, PLANS_FILE]
+        for lang in BOOK_LANGS:
+            files += [f"books_{lang}.json", f"books_{lang}"]
+        return [os.path.join(self.base_dir, f) for f in files]
+
+    def _file_stamp(self):
+        stamp = []
+        for path in self.watched_files():
+            try:
+                st = os.stat(path)
+                stamp.append((path, st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                stamp.append((path, None, None))
+        return tuple(stamp)
+
+    def _build(self, previous):
+        motivations = coaches = plans = None
+        try:
+            motivations = parse_motivations(_read_json(os.path.join(self.base_dir, MOTIVATIONS_FILE)))
+        except Exception as e:
+            logging.error(f"[LOAD_MOTIVATION_ERROR] {e}")
+        try:
+            coaches = parse_coaches(_read_json(os.path.join(self.base_dir, COACHES_FILE)))
+        except Exception as e:
+            logging.error(f"[LOAD_COACHES_ERROR] {e}")
+        try:
+            plans = parse_templates(_read_json(os.path.join(self.base_dir, PLANS_FILE)))
+        except Exception as e:
+            logging.error(f"[LOAD_PLANS_ERROR] {e}")
+        books = BookStore(self.base_dir).load()
+        # битый файл не затирает рабочие данные: берём их из прошлого снимка
+        empty = MappingProxyType({"ua": (), "ru": (), "en": ()})
+        if motivations is None:
+            motivations = previous.motivations if previous else empty
+        if coaches is None:
+            coaches = previous.coaches if previous else empty
+        if plans is None and previous:
+            plans = previous.plans
+        if not len(books) and previous and len(previous.books):
+            books.close()
+            books = previous.books
+        self._version += 1
+        return ContentSnapshot(self._version, motivations, coaches, books, plans)
+
+    def reload(self, force=False) -> bool:
+        with self._lock:
+            self._close_retired(time.monotonic())
+            stamp = self._file_stamp()
+            if not force and stamp == self._stamp:
+                return False
+            previous = self._current
+            snapshot = self._build(previous)
+            self._current = snapshot   # атомарная замена ссылки
+            self._stamp = stamp
+            if previous is not None and previous.books is not snapshot.books:
+                self._retired.append((time.monotonic(), previous.books))
+        logging.info(f"[CONTENT] published snapshot v{snapshot.version}")
+        for fn in self._listeners:
+            try:
+                fn(snapshot)
+            except Exception as e:
+                logging.error(f"[CONTENT_LISTENER_ERROR] {e}")
+        return True
+
+    def _close_retired(self, now):
+        # под self._lock; reload() вызывается наблюдателем раз в poll_sec
+        while self._retired and now - self._retired[0][0] >= RETIRE_SEC:
+            _, books = self._retired.pop(0)
+            books.close()
+
+    def start_watching(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name="sharkan-content", daemon=True)
+            self._thread.start()
+
+    def _watch(self):
+        stop = threading.Event()
+        while not stop.wait(self.poll_sec):
+            try:
+                self.reload()
+            except Exception as e:
+                logging.error(f"[CONTENT_RELOAD_ERROR] {e}")
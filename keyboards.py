@@ -0,0 +1,46 @@
+# keyboards.py
+import threading
+
+# === Кэш клавиатур ===
+# Каждая клавиатура описывается функцией-строителем и набором вариантов
+# (язык, пол, ...). Разметка собирается и сериализуется в JSON один раз;
+# хендлеры передают готовую строку в reply_markup — telebot отправляет её
+# как есть. При перезагрузке контента нужные экраны сбрасываются.
+
+
+class KeyboardCache:
+    def __init__(self):
+        self._builders = {}
+        self._variants = {}
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def screen(self, name, variants=((),)):
+        def decorator(builder):
+            self._builders[name] = builder
+            self._variants[name] = [tuple(v) for v in variants]
+            return builder
+        return decorator
+
+    def get(self, name, *variant) -> str:
+        key = (name,) + variant
+        markup = self._cache.get(key)
+        if markup is None:
+            markup = self._builders[name](*variant).to_json()
+            with self._lock:
+                self._cache[key] = markup
+        return markup
+
+    def warm(self, *names):
+        # собрать заранее все известные варианты (при старте / после сброса)
+        for name in names or list(self._builders):
+            for variant in self._variants[name]:
+                self.get(name, *variant)
+
+    def invalidate(self, *names):
+        with self._lock:
+            if not names:
+                self._cache = {}
+            else:
+                self._cache = {k: v for k, v in self._cache.items() if k[0] not in names}
+        self.warm(*names)
@@ -0,0 +1,332 @@
+# leaderboard.py
+import logging
+import random
+import threading
+from datetime import date, datetime, timedelta
+
+from run_stats import RUNS_SNAPSHOT, day_of
+
+# === Рейтинг SHARKAN: инкрементальный индекс ===
+# Для каждого окна (неделя / месяц / всё время) держим суммы минут по
+# пользователям и упорядоченный skip list с ширинами рёбер: вставка, удаление
+# и поиск места — O(log N), топ-K — O(log N + K).
+WINDOWS = ("week", "month", "all")
+_MAX_LEVEL = 24
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, level):
+        self.key = key
+        self.next = [None] * level
+        self.width = [1] * level   # расстояние (в позициях) до next[i]
+
+
+class RankedSet:
+    # Упорядоченное множество с доступом по позиции (1-based).
+    def __init__(self):
+        self._head = _Node(None, _MAX_LEVEL)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @classmethod
+    def from_sorted(cls, keys):
+        # построение за O(N) из отсортированных ключей — для загрузки рейтинга
+        rs = cls()
+        last = [rs._head] * _MAX_LEVEL
+        last_pos = [0] * _MAX_LEVEL
+        pos = 0
+        for key in keys:
+            pos += 1
+            level = 1
+            while level < _MAX_LEVEL and random.random() < 0.5:
+                level += 1
+            node = _Node(key, level)
+            for i in range(level):
+                last[i].next[i] = node
+                last[i].width[i] = pos - last_pos[i]
+                last[i] = node
+                last_pos[i] = pos
+        for i in range(_MAX_LEVEL):
+            last[i].width[i] = pos + 1 - last_pos[i]   # хвост: расстояние до конца списка
+        rs._size = pos
+        return rs
+
+    def _path(self, key):
+        update = [None] * _MAX_LEVEL
+        ranks = [0] * _MAX_LEVEL
+        x, pos = self._head, 0
+        for i in reversed(range(_MAX_LEVEL)):
+            while x.next[i] is not None and x.next[i].key < key:
+                pos += x.width[i]
+                x = x.next[i]
+            update[i] = x
+            ranks[i] = pos
+        return update, ranks, pos
+
+    def add(self, key):
+        update, ranks, pos = self._path(key)
+        level = 1
+        while level < _MAX_LEVEL and random.random() < 0.5:
+            level += 1
+        node = _Node(key, level)
+        p = pos + 1
+        for i in range(level):
+            prev = update[i]
+            dist = prev.width[i]
+            node.next[i] = prev.next[i]
+            prev.next[i] = node
+            prev.width[i] = p - ranks[i]
+            node.width[i] = ranks[i] + dist + 1 - p
+        for i in range(level, _MAX_LEVEL):
+            update[i].width[i] += 1
+        self._size += 1
+
+    def remove(self, key):
+        update, _, _ = self._path(key)
+        node = update[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        for i in range(_MAX_LEVEL):
+            if update[i].next[i] is node:
+                update[i].width[i] += node.width[i] - 1
+                update[i].next[i] = node.next[i]
+            else:
+                update[i].width[i] -= 1
+        self._size -= 1
+
+    def rank(self, key):
+        update, _, pos = self._path(key)
+        node = update[0].next[0]
+        return pos + 1 if node is not None and node.key == key else None
+
+    def first(self, k):
+        out, x = [], self._head.next[0]
+        while x is not None and len(out) < k:
+            out.append(x.key)
+            x = x.next[0]
+        return out
+
+
+def period_key(window: str, day: date) -> str:
+    if window == "week":
+        y, w, _ = day.isocalendar()
+        return f"{y}-W{w:02d}"
+    if window == "month":
+        return f"{day.year}-{day.month:02d}"
+    return "all"
+
+
+def period_days(window: str, today: date):
+    # окно как полуинтервал номеров дней [start, end); None — всё время
+    if window == "week":
+        start = today - timedelta(days=today.weekday())
+        return day_of(start), day_of(start) + 7
+    if window == "month":
+        start = today.replace(day=1)
+        end = (start + timedelta(days=32)).replace(day=1)
+        return day_of(start), day_of(end)
+    return None
+
+
+class _Board:
+    __slots__ = ("period", "scores", "ranked")
+
+    def __init__(self, period, scores=None):
+        self.period = period
+        self.scores = dict(scores or {})          # user_id -> минуты
+        self.ranked = RankedSet.from_sorted(sorted((-m, uid) for uid, m in self.scores.items()))
+
+    def add(self, user_id, minutes):
+        old = self.scores.get(user_id)
+        if old is not None:
+            self.ranked.remove((-old, user_id))
+        new = (old or 0) + minutes
+        self.scores[user_id] = new
+        self.ranked.add((-new, user_id))
+
+
+class Leaderboard:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._boards = {}
+
+    def _board(self, window, today):
+        # по наступлении новой недели/месяца окно начинается с нуля
+        key = period_key(window, today)
+        board = self._boards.get(window)
+        if board is None or board.period != key:
+            board = self._boards[window] = _Board(key)
+        return board
+
+    def load(self, index, today: date = None):
+        # index — RunHistoryIndex: суммы окон считаются срезами колонок
+        today = today or datetime.now().date()
+        boards = {}
+        for window in WINDOWS:
+            bounds = period_days(window, today)
+            totals = index.totals() if bounds is None else index.minutes_between(*bounds)
+            boards[window] = _Board(period_key(window, today), totals)
+        with self._lock:
+            self._boards = boards
+
+    def add_run(self, user_id: str, minutes: int, day: date = None):
+        today = datetime.now().date()
+        day = day or today
+        with self._lock:
+            for window in WINDOWS:
+                board = self._board(window, today)
+                if board.period == period_key(window, day):
+                    board.add(user_id, minutes)
+
+    def top(self, window="all", k=10, today: date = None):
+        with self._lock:
+            board = self._board(window, today or datetime.now().date())
+            return [(uid, -neg) for neg, uid in board.ranked.first(k)]
+
+    def rank(self, user_id: str, window="all", today: date = None):
+        # (место, минуты) или None, если в этом окне пробежек нет
+        with self._lock:
+            board = self._board(window, today or datetime.now().date())
+            mins = board.scores.get(user_id)
+            if mins is None:
+                return None
+            return board.ranked.rank((-mins, user_id)), mins
+
+    def size(self, window="all", today: date = None):
+        with self._lock:
+            return len(self._board(window, today or datetime.now().date()).ranked)
+
+
+class RunFeed:
+    # Единственный писатель индекса пробежек и рейтинга. Рейтинг общий для
+    # всех процессов: каждый воркер дочитывает из таблицы runs пробежки,
+    # записанные другими (по возрастанию id), а свои добавляет сразу, без
+    # ожидания следующего опроса. Индекс стартует с бинарного снимка
+    # (run_stats.py), из базы читается только то, что новее него.
+    SNAPSHOT_MIN_NEW = 10_000    # столько новых пробежек при старте — переписать снимок
+    LOCAL_MAX = 1024             # своих id впереди курсора — пора дочитать хвост
+
+    def __init__(self, storage, board, index, poll_sec=2.0, snapshot_path=RUNS_SNAPSHOT):
+        self.storage = storage
+        self.board = board
+        self.index = index
+        self.poll_sec = poll_sec
+        self.snapshot_path = snapshot_path
+        self.cursor = 0
+        self._last = None            # (user_id, date, минуты) пробежки с id == cursor
+        self._local = set()          # id, уже учтённые этим процессом
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _restore(self, conn):
+        # снимок годится, если под его курсором в базе те же пробежки
+        snap = self.index.read_snapshot(self.snapshot_path) if self.snapshot_path else None
+        if snap is not None:
+            last_id, count, toc, users = snap
+            n = conn.execute("SELECT COUNT(*) FROM runs WHERE id <= ?", (last_id,)).fetchone()[0]
+            row = conn.execute("SELECT user_id, date, duration_min FROM runs WHERE id = ?", (last_id,)).fetchone()
+            if n == count and (list(row) if row else None) == toc.get("last"):
+                self.index.replace(users)
+                return last_id, row
+            logging.info(f"[RUNS_SNAPSHOT] {self.snapshot_path} устарел, индекс строится из базы")
+        self.index.clear()
+        return 0, None
+
+    def load(self):
+        # снимок, хвост и курсор из одного среза базы — без пропусков и двойного счёта
+        with self.storage.snapshot() as conn:
+            last, last_row = self._restore(conn)
+            rows = conn.execute("SELECT id, user_id, date, duration_min, calories FROM runs "
+                                "WHERE id > ? ORDER BY id", (last,)).fetchall()
+        self.index.extend(r[1:] for r in rows)
+        if rows:
+            last, last_row = rows[-1][0], rows[-1][1:4]
+        with self._lock:
+            self.board.load(self.index)
+            self.cursor = last
+            self._last = list(last_row) if last_row else None
+            self._local.clear()
+        if self.snapshot_path and len(rows) >= self.SNAPSHOT_MIN_NEW:
+            self.save()
+        return self.index
+
+    def add_local(self, run_id, user_id, minutes, calories=0, day=None):
+        day = day or datetime.now().date()
+        with self._lock:
+            if run_id <= self.cursor and run_id not in self._local:
+                return   # опрос уже успел её учесть
+            self.index.add_run(user_id, day_of(day), minutes, calories)
+            self.board.add_run(user_id, minutes, day)
+            if run_id == self.cursor + 1:
+                # непрочитанных id перед ней нет — сдвигаем курсор, запоминать id не нужно
+                self._local.discard(run_id)
+                self.cursor = run_id
+                self._last = [user_id, day.isoformat(), minutes]
+            else:
+                self._local.add(run_id)
+            # без фонового опроса (один процесс) хвост дочитываем сами, иначе _local растёт
+            behind = self._thread is None and len(self._local) > self.LOCAL_MAX
+        if behind:
+            with self._lock:
+                self._catch_up()
+
+    def poll(self) -> int:
+        rows = self.storage.runs_after(self.cursor)
+        with self._lock:
+            return self._apply(rows)
+
+    def _apply(self, rows) -> int:
+        applied = 0
+        for rid, uid, d, m, c in rows:
+            if rid <= self.cursor:
+                continue
+            self.cursor = rid
+            self._last = [uid, d, m]
+            if rid in self._local:
+                self._local.discard(rid)
+                continue
+            try:
+                day = date.fromisoformat(d)
+            except ValueError:
+                continue
+            self.index.add_run(uid, day_of(day), m, c)
+            self.board.add_run(uid, m, day)
+            applied += 1
+        return applied
+
+    def _catch_up(self):
+        # весь хвост таблицы до конца (под self._lock)
+        while True:
+            rows = self.storage.runs_after(self.cursor)
+            self._apply(rows)
+            if len(rows) < 1000:
+                break
+
+    def save(self):
+        # снимок пишется после дочитывания базы под блокировкой: все id <= cursor
+        # уже в индексе, а более новых там нет
+        with self._lock:
+            self._catch_up()
+            try:
+                n = self.index.save_snapshot(self.snapshot_path, self.cursor, {"last": self._last})
+            except OSError as e:
+                logging.error(f"[RUNS_SNAPSHOT_ERROR] {self.snapshot_path}: {e}")
+                return
+        logging.info(f"[RUNS_SNAPSHOT] {n} пробежек до id {self.cursor}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sharkan-runfeed", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        stop = threading.Event()
+        while not stop.wait(self.poll_sec):
+            try:
+                self.poll()
+            except Exception as e:
+                logging.error(f"[RUN_FEED_ERROR] {e}")
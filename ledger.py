@@ -0,0 +1,109 @@
+# ledger.py
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+# === SHRK COINS: журнал операций ===
+# Баланс — сумма записей журнала (earn / spend / refund / adjust), записи
+# только добавляются. Операции одного пользователя сериализуются его
+# «полосой» из набора блокировок, разные пользователи друг друга не ждут.
+# Ключ идемпотентности (id callback_query, id пробежки) гарантирует, что
+# повторно доставленное нажатие не спишет и не начислит монеты дважды.
+STRIPES = 64
+RECENT_KEYS = 10_000
+
+
+class InsufficientCoins(Exception):
+    def __init__(self, balance, amount):
+        super().__init__(f"недостаточно монет: {balance} < {amount}")
+        self.balance = balance
+        self.amount = amount
+
+
+class CoinLedger:
+    def __init__(self, storage, stripes=STRIPES):
+        self.storage = storage
+        self._locks = [threading.RLock() for _ in range(stripes)]
+        self._balances = {}                 # user_id -> кэш баланса из журнала
+        self._recent = OrderedDict()        # idem_key -> баланс после операции
+        self._recent_lock = threading.Lock()
+
+    def load(self):
+        self._balances = self.storage.coin_balances()
+        with self._recent_lock:
+            self._recent.clear()
+        return self
+
+    def seed(self, profiles, replace=False):
+        # перенос старого поля profile["coins"] в журнал; возвращает user_id,
+        # у которых поле было (его можно убрать из профиля)
+        moved = [uid for uid, p in profiles.items() if "coins" in p]
+        known = {} if replace else self.storage.coin_balances()
+        created = _now()
+        rows = [(uid, "adjust", int(profiles[uid]["coins"] or 0), int(profiles[uid]["coins"] or 0),
+                 "opening", None, created)
+                for uid in moved if uid not in known and int(profiles[uid]["coins"] or 0)]
+        if replace:
+            self.storage.replace_coin_txs(rows)
+        else:
+            self.storage.insert_coin_txs(rows)
+        self.load()
+        return moved
+
+    def locked(self, user_id):
+        # блокировка полосы пользователя: проверка + списание одним шагом
+        return self._locks[hash(user_id) % len(self._locks)]
+
+    def balance(self, user_id) -> int:
+        return self._balances.get(user_id, 0)
+
+    def history(self, user_id, limit=20) -> list:
+        return self.storage.coin_tx_for(user_id, limit)
+
+    def earn(self, user_id, amount, reason=None, key=None) -> int:
+        return self._apply(user_id, "earn", amount, reason, key)
+
+    def refund(self, user_id, amount, reason=None, key=None) -> int:
+        return self._apply(user_id, "refund", amount, reason, key)
+
+    def spend(self, user_id, amount, reason=None, key=None) -> int:
+        return self._apply(user_id, "spend", -amount, reason, key)
+
+    def set_balance(self, user_id, value, reason=None, key=None) -> int:
+        with self.locked(user_id):
+            return self._apply(user_id, "adjust", value - self.balance(user_id), reason, key)
+
+    def _apply(self, user_id, kind, delta, reason, key):
+        with self.locked(user_id):
+            replay = self._replay(key)
+            if replay is not None:
+                return replay
+            balance = self.balance(user_id)
+            if delta < 0 and balance + delta < 0 and kind == "spend":
+                raise InsufficientCoins(balance, -delta)
+            new_balance = balance + delta
+            try:
+                self.storage.add_coin_tx(user_id, kind, delta, new_balance, reason, key, _now())
+            except sqlite3.IntegrityError:
+                # ключ уже в базе (повтор после рестарта) — отдаём прежний результат
+                return self.storage.coin_tx_by_key(key)[3]
+            self._balances[user_id] = new_balance
+            if key is not None:
+                with self._recent_lock:
+                    self._recent[key] = new_balance
+                    if len(self._recent) > RECENT_KEYS:
+                        self._recent.popitem(last=False)
+            return new_balance
+
+    def _replay(self, key):
+        if key is None:
+            return None
+        with self._recent_lock:
+            if key in self._recent:
+                return self._recent[key]
+        return None
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
@@ -0,0 +1,210 @@
+# logsetup.py
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import time
+
+# === Логирование ===
+# Хендлеры только кладут запись в очередь (QueueHandler), на диск её пишет
+# отдельный поток QueueListener — медленный диск не задерживает ответы.
+# Формат — JSON-строки: к каждой записи добавляются user_id, имя хендлера,
+# update_id и длительность, если запись сделана внутри хендлера. Файл
+# ротируется по размеру (LOG_MAX_BYTES) или по времени (LOG_ROTATE_WHEN,
+# например "midnight"). Уровни по модулям: LOG_LEVELS="outbox=WARNING,TeleBot=ERROR".
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")              # json | text
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "5"))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "")        # пусто — ротация по размеру
+LOG_HANDLED = os.getenv("LOG_HANDLED", "1") not in ("", "0")   # строка на каждый обработанный апдейт
+
+_TAG = re.compile(r"^\[([A-Z0-9_]+)\]\s*")
+_context = contextvars.ContextVar("sharkan_log_context", default=None)
+_listener = None
+_base = {}          # постоянные поля процесса (номер шарда)
+access = logging.getLogger("sharkan.handled")
+
+
+def parse_levels(spec: str) -> dict:
+    # "outbox=WARNING, TeleBot=ERROR" -> {"outbox": 30, "TeleBot": 40}
+    levels = {}
+    for part in spec.split(","):
+        name, _, level = part.strip().partition("=")
+        if name and level:
+            levels[name.strip()] = logging.getLevelName(level.strip().upper())
+    return {k: v for k, v in levels.items() if isinstance(v, int)}
+
+
+class ContextFilter(logging.Filter):
+    # выполняется в потоке хендлера: поля контекста и уровни по модулям
+    # проверяются до того, как запись попадёт в очередь
+    def __init__(self, default_level, levels):
+        super().__init__()
+        self.default_level = default_level
+        self.levels = levels
+
+    def filter(self, record):
+        # модули бота пишут через корневой логгер, поэтому для них ключ —
+        # имя файла (record.module); у библиотек — имя логгера
+        key = record.module if record.name == "root" else record.name
+        level = self.levels.get(key, self.levels.get(record.name.split(".")[0], self.default_level))
+        if record.levelno < level:
+            return False
+        ctx = _context.get() or _base
+        if ctx:
+            for k, v in ctx.items():
+                if not hasattr(record, k):
+                    setattr(record, k, v)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    FIELDS = ("user_id", "handler", "update_id", "duration_ms", "shard")
+
+    def format(self, record):
+        msg = record.getMessage()
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "module": record.module if record.name == "root" else record.name,
+        }
+        m = _TAG.match(msg)
+        if m:
+            entry["event"] = m.group(1)
+            msg = msg[m.end():]
+        entry["msg"] = msg
+        for k in self.FIELDS:
+            v = getattr(record, k, None)
+            if v is not None:
+                entry[k] = v
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # форматирование — в потоке записи; здесь только снимаем то, что не
+        # переживёт передачу между потоками (аргументы и traceback)
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _file_handler(path):
+    if LOG_ROTATE_WHEN:
+        handler = logging.handlers.TimedRotatingFileHandler(path, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUPS,
+                                                            encoding="utf-8")
+    else:
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS,
+                                                       encoding="utf-8")
+    if LOG_FORMAT == "text":
+        handler.setFormatter(logging.Formatter("%(asctime)s — %(levelname)s — %(message)s"))
+    else:
+        handler.setFormatter(JsonFormatter())
+    return handler
+
+
+def per_process(path, suffix):
+    # bot.log -> bot.shard2.log: у каждого процесса свой файл, иначе ротация
+    # из нескольких процессов портит лог
+    root, ext = os.path.splitext(path)
+    return f"{root}.{suffix}{ext or '.log'}"
+
+
+def setup(path=LOG_FILE, level=LOG_LEVEL, levels=LOG_LEVELS, **fields):
+    # fields — постоянные поля всех записей процесса (например shard=2)
+    global _listener
+    if _listener is not None:
+        return _listener
+    default_level = logging.getLevelName(str(level).upper())
+    default_level = default_level if isinstance(default_level, int) else logging.INFO
+    per_module = parse_levels(levels) if isinstance(levels, str) else dict(levels)
+
+    q = queue.SimpleQueue()     # без ограничения: put никогда не ждёт
+    handler = _QueueHandler(q)
+    handler.addFilter(ContextFilter(default_level, per_module))
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(handler)
+    root.setLevel(min([default_level, *per_module.values()]))
+    _base.update(fields)
+
+    _listener = logging.handlers.QueueListener(q, _file_handler(path))
+    _listener.start()
+    atexit.register(stop)
+    return _listener
+
+
+def stop():
+    # дописать очередь на диск (shutdown / atexit)
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+# === Контекст хендлера ===
+def bind(**fields):
+    ctx = dict(_base)
+    ctx.update(_context.get() or {})
+    ctx.update({k: v for k, v in fields.items() if v is not None})
+    return _context.set(ctx)
+
+
+def unbind(token):
+    _context.reset(token)
+
+
+def event_fields(obj) -> dict:
+    # user_id и update_id из Message / CallbackQuery / InlineQuery
+    who = getattr(obj, "from_user", None)
+    return {"user_id": who.id if who else None, "update_id": getattr(obj, "update_id", None)}
+
+
+def handled(name, duration, error=None):
+    if not LOG_HANDLED:
+        return
+    extra = {"duration_ms": round(duration * 1000, 2)}
+    if error is not None:
+        access.error(f"[HANDLER_ERROR] {name}: {error}", extra=extra)
+    else:
+        access.info(f"[HANDLED] {name}", extra=extra)
+
+
+def tag_updates(bot):
+    # update_id прикрепляется к вложенному объекту апдейта: хендлер получает
+    # только message / callback_query, а в логе нужен номер апдейта
+    original = bot.process_new_updates
+    if getattr(original, "__tagged__", False):
+        return
+
+    def process_new_updates(updates):
+        for update in updates:
+            tag_update(update)
+        return original(updates)
+    process_new_updates.__tagged__ = True
+    bot.process_new_updates = process_new_updates
+
+
+def tag_update(update):
+    for obj in vars(update).values():
+        if obj is not None and hasattr(obj, "__dict__") and not isinstance(obj, type):
+            try:
+                obj.update_id = update.update_id
+            except AttributeError:
+                pass
@@ -2,293 +2,467 @@
 import os
 import json
 import logging
-import random
-import threading
 import time
-from datetime import datetime, timedelta
-from telebot import TeleBot, types
+import signal
+import atexit
+from datetime import datetime
+from telebot import TeleBot, types, apihelper
+from storage import Storage, DB_FILE
+from run_stats import RunHistoryIndex
+from leaderboard import Leaderboard, RunFeed
+from scheduler import TimerScheduler
+from outbox import Outbox, GLOBAL_RATE
+import webhook
+import shards
+from router import TextRouter
+from keyboards import KeyboardCache
+from content import ContentRegistry
+from backup import BackupManager, BackupError, ARCHIVE_SUFFIX, download_to
+from sessions import SessionStore
+from profile_writer import ProfileWriter
+from ledger import CoinLedger, InsufficientCoins
+from profiles import ProfileCache
+from startup import Startup
+from track import RunTrack, DEFAULT_MET, format_pace
+from plans import PlanEngine, PLAN_ACTIVE_DAYS
+from rotation import Rotation
+from runjournal import RunJournal, RUN_JOURNAL
+import metrics
+import logsetup
 
 # === Переменная окружения и инициализация бота ===
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
     raise ValueError("❌ Переменная BOT_TOKEN не задана. Установи её в окружении.")
+# polling (по умолчанию) или webhook — см. WEBHOOK_* в .env.example
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
+# локальный заменитель Bot API для нагрузочных прогонов (bench/fake_api.py)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+if TELEGRAM_API_URL:
+    apihelper.API_URL = TELEGRAM_API_URL.rstrip("/") + "/bot{0}/{1}"
+    apihelper.FILE_URL = TELEGRAM_API_URL.rstrip("/") + "/file/bot{0}/{1}"
 
 bot = TeleBot(BOT_TOKEN)
+metrics.instrument_api()   # счётчики и время всех вызовов Bot API
+router = TextRouter()   # кнопки → хендлеры, см. route_text в конце файла
+keyboards = KeyboardCache()   # готовый JSON клавиатур по (экран, язык, пол)
+# исходящие запросы с учётом лимитов Telegram; лимит бота делится между шардами
+outbox = Outbox(global_rate=GLOBAL_RATE / max(1, shards.SHARDS))
 VERSION = "SHARKAN BOT v1.3 — RUN + BOOKS + PROFILE + PLAN + STATS + COINS + SHOP + BACKUP + LEADERBOARD"
 
 # === Логирование ===
-logging.basicConfig(
-    level=logging.INFO,
-    filename="bot.log",
-    filemode="a",
-    format="%(asctime)s — %(levelname)s — %(message)s"
-)
+# JSON-строки через очередь в фоновый поток (logsetup.py); у воркеров шардов — свой файл
+if BOT_MODE == "worker":
+    logsetup.setup(logsetup.per_process(logsetup.LOG_FILE, f"shard{shards.SHARD_INDEX}"), shard=shards.SHARD_INDEX)
+else:
+    logsetup.setup()
 
 # === Профили пользователей ===
+# Старые JSON-файлы читаются только один раз — при миграции в SQLite.
 USER_PROFILE_FILE = "user_profiles.json"
-if os.path.exists(USER_PROFILE_FILE):
-    with open(USER_PROFILE_FILE, "r", encoding="utf-8") as f:
-        user_profiles = json.load(f)
-else:
-    user_profiles = {}
+RUN_HISTORY_FILE = "run_history.json"
+storage = Storage(DB_FILE)
+storage.migrate_from_json(USER_PROFILE_FILE, RUN_HISTORY_FILE)
 
-def save_profiles():
-    try:
-        with open(USER_PROFILE_FILE, "w", encoding="utf-8") as f:
-            json.dump(user_profiles, f, indent=4, ensure_ascii=False)
-    except Exception as e:
-        logging.error(f"[SAVE_PROFILE_ERROR] {e}")
+# большие наборы данных грузятся в фоне после старта приёма апдейтов (startup.py)
+startup = Startup()
+
+def load_own_profiles():
+    # профиль читается при первом обращении; в шардированном режиме — только свои пользователи;
+    # не записанные фоновым писателем профили не вытесняются
+    return ProfileCache(storage, shards.owns, pinned=lambda uid: profile_writer.dirty(uid))
+
+user_profiles = load_own_profiles()
+
+# история пробежек целиком читается один раз — дальше индекс и рейтинг обновляются инкрементально
+run_index = RunHistoryIndex()
+leaderboard = Leaderboard()
+# рейтинг общий: чужие пробежки дочитываются из базы; индекс стартует с бинарного снимка
+run_feed = RunFeed(storage, leaderboard, run_index)
+
+def load_runs():
+    run_feed.load()
+
+# короткоживущее состояние диалогов (книга, анкета, последнее сообщение) —
+# LRU с TTL; позиция чтения в фоне сохраняется в SQLite
+sessions = SessionStore(storage)
+
+# профили пишутся в фоне пачками: хендлер не ждёт диска
+profile_writer = ProfileWriter(storage, lambda: user_profiles)
+
+def save_profile(user_id: str):
+    profile_writer.mark(user_id)
+
+# SHRK COINS — журнал операций; старое поле profile["coins"] переносится в него
+ledger = CoinLedger(storage)
+
+def move_coins_to_ledger(replace=False):
+    legacy = {uid: p for uid, p in storage.load_profiles_with("coins").items() if shards.owns(uid)}
+    for uid in ledger.seed(legacy, replace=replace):
+        user_profiles[uid].pop("coins", None)
+        save_profile(uid)
 
 # === Языки ===
 LANGUAGES = {'ua': 'Українська', 'ru': 'Русский', 'en': 'English'}
-user_lang = {}
-for uid, profile in user_profiles.items():
-    if "language" in profile:
-        user_lang[uid] = profile["language"]
 
 def get_lang(user_id: str) -> str:
-    return user_lang.get(user_id, "ua")
+    return user_profiles.language(user_id)
 
-# === Книги ===
-user_states = {}         # состояние чтения книги
-page_jump_state = {}     # ожидание ввода номера страницы
+@keyboards.screen("languages")
+def _kb_languages():
+    markup = types.InlineKeyboardMarkup()
+    for code, name in LANGUAGES.items():
+        markup.add(types.InlineKeyboardButton(name, callback_data=f"lang_{code}"))
+    return markup
 
-try:
-    with open("books_ua.json", "r", encoding="utf-8") as f:
-        all_books = json.load(f)
-except Exception as e:
-    print(f"Помилка при завантаженні книг: {e}")
-    all_books = []
+# === Книги ===
+# Контент (книги, мотивации, советы) — неизменяемые снимки из реестра;
+# файлы отслеживаются в фоне, новая версия подменяет старую целиком.
+content = ContentRegistry()
 
 def clamp(val, lo, hi):
     return max(lo, min(hi, val))
 
 def show_book_page(chat_id, user_id):
-    state = user_states.get(user_id, {})
-    title = state.get("book_title")
-    page = state.get("page", 0)
-
-    for book in all_books:
-        if book.get("title") == title:
-            pages = book.get("pages", [])
-            if not pages:
-                bot.send_message(chat_id, "❌ Книга порожня.")
-                return
-            page = clamp(page, 0, len(pages) - 1)
-            user_states[user_id]["page"] = page
-
-            markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-            markup.row("⬅️ Назад", "➡️ Вперед")
-            markup.add("🔢 Перейти до сторінки", "⬅️ Головне меню")
-            bot.send_message(
-                chat_id,
-                f"📘 *{title}*\n\n📄 Сторінка {page + 1} з {len(pages)}:\n\n{pages[page]}",
-                parse_mode="Markdown",
-                reply_markup=markup
-            )
-            return
-    bot.send_message(chat_id, "❌ Книгу не знайдено.")
+    session = sessions.get(user_id)
+    title = session.book_title
 
-@bot.message_handler(func=lambda msg: msg.text == "📚 Книги SHARKAN")
-def show_book_list(message):
+    books = content.current.books
+    book = books.get(title)
+    if not book:
+        bot.send_message(chat_id, "❌ Книгу не знайдено.")
+        return
+    if not len(book):
+        bot.send_message(chat_id, "❌ Книга порожня.")
+        return
+    page = clamp(session.page, 0, len(book) - 1)
+    if page != session.page:
+        session.page = page
+        sessions.save_position(session)
+
+    bot.send_message(
+        chat_id,
+        f"📘 *{title}*\n\n📄 Сторінка {page + 1} з {len(book)}:\n\n{books.page(title, page)}",
+        parse_mode="Markdown",
+        reply_markup=keyboards.get("book_page")
+    )
+
+@keyboards.screen("book_page")
+def _kb_book_page():
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    for book in all_books:
-        markup.add(f"📖 {book.get('title','Без назви')}")
+    markup.row("⬅️ Назад", "➡️ Вперед")
+    markup.add("🔢 Перейти до сторінки", "⬅️ Головне меню")
+    return markup
+
+@keyboards.screen("book_list", variants=[(l,) for l in LANGUAGES])
+def _kb_book_list(lang):
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    for title in content.current.books.catalog(lang):
+        markup.add(f"📖 {title}")
     markup.add("⬅️ Головне меню")
-    bot.send_message(message.chat.id, "📚 Обери книгу:", reply_markup=markup)
+    return markup
+
+@router.route("📚 Книги SHARKAN", "📚 SHARKAN Books")
+@startup.needs("content")
+def show_book_list(message):
+    lang = get_lang(str(message.from_user.id))
+    bot.send_message(message.chat.id, "📚 Обери книгу:", reply_markup=keyboards.get("book_list", lang))
 
-@bot.message_handler(func=lambda msg: msg.text and msg.text.startswith("📖 "))
+@router.prefix("📖 ")
+@startup.needs("content")
 def handle_book_selection(message):
     user_id = str(message.from_user.id)
     title = message.text.replace("📖 ", "", 1).strip()
-    for book in all_books:
-        if book.get("title") == title:
-            user_states[user_id] = {"book_title": title, "page": 0}
-            show_book_page(message.chat.id, user_id)
-            return
-    bot.send_message(message.chat.id, "❌ Книгу не знайдено.")
+    if content.current.books.get(title) is None:
+        bot.send_message(message.chat.id, "❌ Книгу не знайдено.")
+        return
+    session = sessions.get(user_id)
+    session.book_title, session.page = title, 0
+    sessions.save_position(session)
+    show_book_page(message.chat.id, user_id)
 
-@bot.message_handler(func=lambda msg: msg.text in ["⬅️ Назад", "➡️ Вперед"])
+@router.route("⬅️ Назад", "➡️ Вперед")
+@startup.needs("content")
 def handle_book_page_nav(message):
     user_id = str(message.from_user.id)
-    if user_id not in user_states or "book_title" not in user_states[user_id]:
+    session = sessions.get(user_id, create=False)
+    if session is None or not session.book_title:
         return
     if message.text == "➡️ Вперед":
-        user_states[user_id]["page"] += 1
+        session.page += 1
     elif message.text == "⬅️ Назад":
-        user_states[user_id]["page"] -= 1
+        session.page -= 1
+    sessions.save_position(session)
     show_book_page(message.chat.id, user_id)
 
-@bot.message_handler(func=lambda m: m.text in ["🔢 Перейти до сторінки","🔢 Перейти к странице","🔢 Go to page"])
+@router.route("🔢 Перейти до сторінки", "🔢 Перейти к странице", "🔢 Go to page")
 def ask_page_num(message):
     uid = str(message.from_user.id)
-    st = user_states.get(uid, {})
-    if "book_title" not in st:
+    session = sessions.get(uid, create=False)
+    if session is None or not session.book_title:
         return
-    page_jump_state[uid] = st["book_title"]
+    session.jump_title = session.book_title
     bot.send_message(message.chat.id, "Введи номер сторінки / страницы / page (1..N).")
 
-@bot.message_handler(func=lambda m: str(m.from_user.id) in page_jump_state and (m.text or "").strip().isdigit())
+def _awaiting_page(message):
+    session = sessions.peek(str(message.from_user.id))
+    return session is not None and session.jump_title is not None and (message.text or "").strip().isdigit()
+
+@router.fallback(_awaiting_page)
+@startup.needs("content")
 def do_page_jump(message):
     uid = str(message.from_user.id)
-    title = page_jump_state.get(uid)
+    session = sessions.get(uid)
+    title, session.jump_title = session.jump_title, None
     if not title:
         return
     target = int(message.text.strip()) - 1
 
-    book = next((b for b in all_books if b.get("title") == title), None)
+    book = content.current.books.get(title)
     if not book:
         bot.send_message(message.chat.id, "❌ Книга не знайдена / не найдена.")
-        page_jump_state.pop(uid, None)
         return
 
-    pages = book.get("pages", [])
-    if not pages:
+    if not len(book):
         bot.send_message(message.chat.id, "❌ У цієї книги немає сторінок.")
-        page_jump_state.pop(uid, None)
         return
 
-    target = clamp(target, 0, len(pages) - 1)
-    user_states.setdefault(uid, {})["page"] = target
-    page_jump_state.pop(uid, None)
+    target = clamp(target, 0, len(book) - 1)
+    session.book_title, session.page = title, target
+    sessions.save_position(session)
     show_book_page(message.chat.id, uid)
 
 # === Мотивации и советы тренеров ===
-try:
-    with open("motivations.json", "r", encoding="utf-8") as f:
-        motivation_data = json.load(f)
-except Exception as e:
-    motivation_data = {"ua": [], "ru": [], "en": []}
-    logging.error(f"[LOAD_MOTIVATION_ERROR] {e}")
-
-try:
-    with open("coaches_tips.json", "r", encoding="utf-8") as f:
-        coaches_data = json.load(f)
-except Exception as e:
-    coaches_data = {"ua": [], "ru": [], "en": []}
-    logging.error(f"[LOAD_COACHES_ERROR] {e}")
+# Фразы идут по кругу без повторов; курсор — в profile["rotation"] (rotation.py)
+def _motivation_text(phrase, lang):
+    return phrase if isinstance(phrase, str) else phrase["text"]
+
+def _coach_text(coach, lang):
+    name = coach.get("name", "Без імені")
+    bio = coach.get(f"bio_{lang}", coach.get("bio", ""))
+    tip = coach.get(f"tip_{lang}", coach.get("tip", ""))
+    return f"👤 *{name}*\n\n🧬 _{bio}_\n\n{tip}"
+
+motivation_rotation = Rotation("motivation", lambda snap, lang: snap.motivations.get(lang, ()), _motivation_text)
+coach_rotation = Rotation("coach", lambda snap, lang: snap.coaches.get(lang, ()), _coach_text)
+
+def next_in_rotation(rotation, user_id):
+    profile = user_profiles.get(user_id)
+    if profile is None:
+        profile = {"language": get_lang(user_id)}   # без профиля курсор не сохраняется
+    text = rotation.next(content.current, profile)
+    if text is not None and user_id in user_profiles:
+        save_profile(user_id)
+    return text
+
+def send_motivation(message):
+    text = next_in_rotation(motivation_rotation, str(message.from_user.id))
+    bot.send_message(message.chat.id, text or "Немає мотивацій для твоєї мови.")
 
 @bot.message_handler(commands=['motivation'])
+@startup.needs("content")
 def cmd_motivation(message):
-    user_id = str(message.from_user.id)
-    lang = get_lang(user_id)
-    phrases = motivation_data.get(lang, [])
-    bot.send_message(message.chat.id, random.choice(phrases) if phrases else "Немає мотивацій для твоєї мови.")
+    send_motivation(message)
 
-@bot.message_handler(func=lambda m: m.text and m.text.lower() in [
-    "🧠 мотивація", "💖 натхнення", "🧠 мотивация", "💖 вдохновение",
-    "🧠 motivation", "💖 inspiration"
-])
+@router.route(
+    "🧠 Мотивація", "💖 Натхнення", "🧠 Мотивация", "💖 Вдохновение",
+    "🧠 Motivation", "💖 Inspiration"
+)
+@startup.needs("content")
 def motivation_handler(message):
-    user_id = str(message.from_user.id)
-    lang = get_lang(user_id)
-    phrases = motivation_data.get(lang, [])
-    bot.send_message(message.chat.id, random.choice(phrases) if phrases else "Немає мотивацій для твоєї мови.")
+    send_motivation(message)
 
-@bot.message_handler(func=lambda m: m.text and m.text.lower() in [
-    "🎓 поради від тренерів", "🎓 советы от тренеров", "🎓 pro trainer tips"
-])
+@router.route("🎓 Поради від тренерів", "🎓 Советы от тренеров", "🎓 Pro Trainer Tips")
+@startup.needs("content")
 def coach_tip_handler(message):
-    user_id = str(message.from_user.id)
-    lang = get_lang(user_id)
-    tips = coaches_data.get(lang, [])
-    if not tips:
+    text = next_in_rotation(coach_rotation, str(message.from_user.id))
+    if text is None:
         bot.send_message(message.chat.id, "❌ Немає порад для обраної мови.")
         return
-    coach = random.choice(tips)
-    name = coach.get("name", "Без імені")
-    bio = coach.get(f"bio_{lang}", coach.get("bio", ""))
-    tip = coach.get(f"tip_{lang}", coach.get("tip", ""))
-    text = f"👤 *{name}*\n\n🧬 _{bio}_\n\n{tip}"
     bot.send_message(message.chat.id, text, parse_mode="Markdown")
 
 # === SHARKAN RUN — таймер, стоп, история ===
 running_timers = {}
-last_bot_messages = {}
-
-def calculate_calories(weight_kg, duration_min):
-    MET = 9.8
-    return round((MET * 3.5 * weight_kg / 200) * duration_min)
-
-def save_run_result(user_id, duration_min, calories):
-    try:
-        with open("run_history.json", "r", encoding="utf-8") as f:
-            data = json.load(f)
-    except Exception:
-        data = {}
-    data.setdefault(user_id, []).append({
+timer_scheduler = TimerScheduler()   # один поток на все активные пробежки
+RUN_TICK_SEC = int(os.getenv("RUN_TICK_SEC", "60"))
+# активные пробежки переживают рестарт: журнал (runjournal.py), у шарда — свой файл
+_journal_root, _journal_ext = os.path.splitext(RUN_JOURNAL)
+run_journal = RunJournal(RUN_JOURNAL if shards.SHARDS == 1
+                         else f"{_journal_root}.shard{shards.SHARD_INDEX}{_journal_ext or '.journal'}")
+
+def calculate_calories(weight_kg, duration_min, met=DEFAULT_MET):
+    # met зависит от темпа, если пользователь делится live-локацией (track.py)
+    return round((met * 3.5 * weight_kg / 200) * duration_min)
+
+@metrics.timed(metrics.STORAGE_SECONDS, "save_run_result")
+def save_run_result(user_id, duration_min, calories, started=None):
+    # started — начало пробежки (isoformat): повтор после падения не запишет её дважды
+    record = {
         "date": datetime.now().strftime("%Y-%m-%d"),
         "duration_min": duration_min,
         "calories": calories
-    })
-    with open("run_history.json", "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
-    return data[user_id][-3:]
+    }
+    run_id = storage.add_run(user_id, record["date"], duration_min, calories, started=started)
+    if run_id is not None:
+        run_feed.add_local(run_id, user_id, duration_min, calories)
+    return run_index.get(user_id).last
+
+def run_reward(duration_min):
+    return max(1, duration_min // 10) * 5  # 5 монет за каждые 10 минут (минимум 5)
 
 def send_clean_message(chat_id, user_id, text, reply_markup=None):
-    mid = last_bot_messages.get(user_id)
+    # Ответ на нажатие должен оказаться под сообщением пользователя, поэтому
+    # здесь не правим старое сообщение, а удаляем его. Удаление не блокирует
+    # ответ: уходит в очередь, ошибки логируются в outbox.
+    session = sessions.get(user_id)
+    mid = session.last_msg_id
     if mid:
-        try:
-            bot.delete_message(chat_id, mid)
-        except Exception:
-            pass
-    msg = bot.send_message(chat_id, text, reply_markup=reply_markup)
-    last_bot_messages[user_id] = msg.message_id
+        outbox.submit(chat_id, bot.delete_message, chat_id, mid, coalesce_key=("delete", mid))
+    msg = outbox.call(chat_id, bot.send_message, chat_id, text, reply_markup=reply_markup)
+    session.last_msg_id = msg.message_id
     return msg.message_id
 
 class RunTimer:
-    def __init__(self, bot_obj, chat_id, user_id, weight_kg, lang):
+    def __init__(self, bot_obj, chat_id, user_id, weight_kg, lang, start_time=None, message_id=None):
+        # start_time задан — сессия восстановлена из журнала после рестарта
         self.bot = bot_obj
         self.chat_id = chat_id
         self.user_id = user_id
         self.weight_kg = weight_kg
         self.lang = lang
-        self.start_time = datetime.now()
         self.active = True
-        self.message_id = None
-        self.thread = threading.Thread(target=self.loop, daemon=True)
-        self.thread.start()
+        self.message_id = message_id
+        self.track = RunTrack()   # точки live-локации -> дистанция, темп, сплиты
+        if start_time is None:
+            self.start_time = datetime.now()
+            run_journal.start(user_id, chat_id, self.start_time, weight_kg, lang)
+        else:
+            self.start_time = start_time
+        self.timer = timer_scheduler.schedule(RUN_TICK_SEC, self.tick, first_delay=self._first_delay())
+
+    def _first_delay(self):
+        # новая пробежка — сразу; восстановленная — в прежней фазе тиков,
+        # чтобы тысячи таймеров после рестарта не сработали разом
+        if self.message_id is None:
+            return 0
+        elapsed = (datetime.now() - self.start_time).total_seconds()
+        return RUN_TICK_SEC - elapsed % RUN_TICK_SEC
+
+    def rearm(self, previous):
+        # перенос с previous на текущий timer_scheduler (async_main меняет его после импорта)
+        previous.cancel(self.timer)
+        self.timer = timer_scheduler.schedule(RUN_TICK_SEC, self.tick, first_delay=self._first_delay())
 
     def stop(self):
         self.active = False
+        timer_scheduler.cancel(self.timer)
         duration = max(1, round((datetime.now() - self.start_time).seconds / 60))
-        calories = calculate_calories(self.weight_kg, duration)
-        save_run_result(self.user_id, duration, calories)
+        calories = calculate_calories(self.weight_kg, duration, self.track.met())
+        # запись пробежки и монеты идемпотентны по началу пробежки, поэтому финиш
+        # в журнал пишется последним: упадём раньше — recover_runs() доведёт стоп
+        started = self.start_time.isoformat()
+        save_run_result(self.user_id, duration, calories, started=started)
         # === Начислим SHRK COINS ===
-        profile = user_profiles.setdefault(self.user_id, {})
-        coins = int(profile.get("coins", 0))
-        coins += max(1, duration // 10) * 5  # 5 монет за каждые 10 минут (минимум 5)
-        profile["coins"] = coins
-        save_profiles()
+        coins = ledger.earn(self.user_id, run_reward(duration), "run", key=f"run:{self.user_id}:{started}")
+        run_journal.stop(self.user_id, self.start_time)
         return duration, calories, coins
 
-    def loop(self):
-        while self.active:
-            minutes = (datetime.now() - self.start_time).seconds // 60
-            msg_text = {
-                "ua": f"🕒 Пройшло: {minutes} хв",
-                "ru": f"🕒 Прошло: {minutes} мин",
-                "en": f"🕒 Elapsed: {minutes} min"
-            }.get(self.lang, f"🕒 Пройшло: {minutes} хв")
-            try:
-                if self.message_id:
-                    self.bot.delete_message(self.chat_id, self.message_id)
-                msg = self.bot.send_message(self.chat_id, msg_text)
-                self.message_id = msg.message_id
-            except Exception:
-                pass
-            time.sleep(60)
-
-def text_contains_any(text: str, options: list[str]) -> bool:
-    return any(opt in text for opt in options)
-
-@bot.message_handler(func=lambda m: (m.text and text_contains_any(m.text, ["🏁 Почати біг", "🏁 Начать бег", "🏁 Start run"])) or
-                                  (m.text and m.text.lower() in ["почати біг", "начать бег", "start run"]))
+    def tick(self):
+        # вызывается общим планировщиком раз в RUN_TICK_SEC; ничего не ждёт —
+        # запросы уходят в outbox, а правки одного сообщения схлопываются
+        if not self.active:
+            return
+        minutes = (datetime.now() - self.start_time).seconds // 60
+        msg_text = {
+            "ua": f"🕒 Пройшло: {minutes} хв",
+            "ru": f"🕒 Прошло: {minutes} мин",
+            "en": f"🕒 Elapsed: {minutes} min"
+        }.get(self.lang, f"🕒 Пройшло: {minutes} хв")
+        line = track_line(self.track, self.lang)
+        if line:
+            msg_text += "\n" + line
+        if self.message_id:
+            outbox.submit(self.chat_id, self.bot.edit_message_text, msg_text,
+                          chat_id=self.chat_id, message_id=self.message_id,
+                          coalesce_key=("edit", self.message_id), on_done=self._on_edited)
+        else:
+            outbox.submit(self.chat_id, self.bot.send_message, self.chat_id, msg_text,
+                          coalesce_key=("timer", self.user_id), on_done=self._on_sent)
+
+    def _on_sent(self, fut):
+        if fut.exception() is None:
+            self.message_id = fut.result().message_id
+            run_journal.message(self.user_id, self.message_id)
+
+    def _on_edited(self, fut):
+        # сообщение удалили или оно слишком старое — в следующий тик пришлём новое
+        if fut.exception() is not None:
+            self.message_id = None
+            run_journal.message(self.user_id, 0)
+
+def track_line(track, lang):
+    # пачка GPS-точек сбрасывается здесь же: дистанция живая и совпадает с темпом
+    distance_m, pace = track.progress()
+    if not distance_m:
+        return ""
+    unit = {"ua": "км", "ru": "км", "en": "km"}.get(lang, "км")
+    return f"📍 {distance_m / 1000:.2f} {unit} · ⚡ {format_pace(pace)} /{unit}"
+
+def track_summary(track, lang):
+    line = track_line(track, lang)
+    if not line:
+        return ""
+    lines = [line]
+    if track.splits:
+        title = {"ua": "Спліти", "ru": "Сплиты", "en": "Splits"}.get(lang, "Спліти")
+        lines.append(f"🏁 {title}: " + ", ".join(format_pace(s) for s in track.splits[-10:]))
+    return "\n" + "\n".join(lines)
+
+@bot.message_handler(content_types=["location"])
+@bot.edited_message_handler(content_types=["location"])
+def on_run_location(message):
+    # live-локация во время пробежки: первая точка — сообщение, дальше — его правки
+    timer = running_timers.get(str(message.from_user.id))
+    if timer is None or not timer.active or message.location is None:
+        return
+    loc = message.location
+    timer.track.add(loc.latitude, loc.longitude, message.edit_date or message.date,
+                    getattr(loc, "horizontal_accuracy", None) or 0.0)
+
+# тексты кнопок горячих разделов — их же маршрутизирует async_main.py
+START_RUN_BUTTONS = ("🏁 Почати біг", "🏁 Начать бег", "🏁 Start run", "Почати біг", "Начать бег", "Start run")
+STOP_RUN_BUTTONS = ("⛔️ Завершити біг", "⛔️ Завершить бег", "⛔️ Stop run", "Завершити біг", "Завершить бег", "Stop run")
+RUN_MENU_BUTTONS = ("⏱ Режим БІГ", "⏱ Режим БЕГ", "⏱ Running Mode")
+MAIN_MENU_BUTTONS = ("⬅️ Головне меню", "⬅️ Главное меню", "⬅️ Main menu")
+LEADERBOARD_BUTTONS = ("🏆 Рейтинг SHARKAN", "🏆 SHARKAN Ranking")
+SETTINGS_BUTTONS = ("⚙️ Налаштування", "⚙️ Настройки", "⚙️ Settings")
+
+@router.route(*START_RUN_BUTTONS)
+@startup.needs("runs", "ledger")   # перезапуск останавливает прошлый таймер: запись пробежки и монеты
 def start_run(message):
     user_id = str(message.from_user.id)
-    chat_id = message.chat.id
     lang = get_lang(user_id)
-
+    begin_run(message.chat.id, user_id, lang)
+    send_clean_message(message.chat.id, user_id, run_started_text(lang))
+
+# Логика пробежки без отправки сообщений — общая для main.py и async_main.py:
+# begin_run / finish_run пишут в SQLite и журнал (в async-режиме — через to_thread).
+RUN_STARTED = {
+    "ua": "🏃‍♂️ Біжи! Я фіксую твій час...\n📍 Поділись геопозицією наживо — порахую дистанцію і темп.\n⛔️ Натисни «Завершити біг», коли завершиш.",
+    "ru": "🏃‍♂️ Беги! Я фиксирую твоё время...\n📍 Поделись геопозицией в реальном времени — посчитаю дистанцию и темп.\n⛔️ Нажми «Завершить бег», когда закончишь.",
+    "en": "🏃‍♂️ Run! I’m tracking your time...\n📍 Share your live location and I’ll track distance and pace.\n⛔️ Tap 'Stop run' when you’re done."
+}
+RUN_NOT_ACTIVE = {
+    "ua": "❌ Біг не активний.",
+    "ru": "❌ Бег не запущен.",
+    "en": "❌ Run not active."
+}
+
+def run_started_text(lang):
+    return RUN_STARTED.get(lang, RUN_STARTED["ua"])
+
+def begin_run(chat_id, user_id, lang):
     weight = 70
     try:
         weight = int(user_profiles.get(user_id, {}).get("weight", 70))
@@ -299,37 +473,22 @@ def start_run(message):
         # если уже шёл таймер — мягко перезапускаем
         try:
             running_timers[user_id].stop()
-        except Exception:
-            pass
+        except Exception as e:
+            metrics.ERRORS.inc("run_restart")
+            logging.error(f"[RUN_RESTART_ERROR] {e}")
 
     running_timers[user_id] = RunTimer(bot, chat_id, user_id, weight, lang)
 
-    texts = {
-        "ua": "🏃‍♂️ Біжи! Я фіксую твій час...\n⛔️ Натисни «Завершити біг», коли завершиш.",
-        "ru": "🏃‍♂️ Беги! Я фиксирую твоё время...\n⛔️ Нажми «Завершить бег», когда закончишь.",
-        "en": "🏃‍♂️ Run! I’m tracking your time...\n⛔️ Tap 'Stop run' when you’re done."
-    }
-    send_clean_message(chat_id, user_id, texts.get(lang, texts["ua"]))
-
-@bot.message_handler(func=lambda m: (m.text and text_contains_any(m.text, ["⛔️ Завершити біг", "⛔️ Завершить бег", "⛔️ Stop run"])) or
-                                  (m.text and m.text.lower() in ["завершити біг", "завершить бег", "stop run"]))
-def stop_run(message):
-    user_id = str(message.from_user.id)
-    chat_id = message.chat.id
-    lang = get_lang(user_id)
-
-    if user_id not in running_timers:
-        texts = {
-            "ua": "❌ Біг не активний.",
-            "ru": "❌ Бег не запущен.",
-            "en": "❌ Run not active."
-        }
-        send_clean_message(chat_id, user_id, texts.get(lang, texts["ua"]))
-        return
-
-    duration, calories, coins = running_timers[user_id].stop()
-    del running_timers[user_id]
+def finish_run(user_id):
+    # -> (таймер, минуты, калории, монеты) или None, если бег не шёл
+    timer = running_timers.get(user_id)
+    if timer is None:
+        return None
+    duration, calories, coins = timer.stop()
+    running_timers.pop(user_id, None)
+    return timer, duration, calories, coins
 
+def run_result_text(lang, timer, duration, calories, coins):
     unit = {"ua": "хв", "ru": "мин", "en": "min"}[lang if lang in ["ua","ru","en"] else "ua"]
     reward = max(5, (duration // 10) * 5)
     result_text = {
@@ -337,40 +496,57 @@ def stop_run(message):
         "ru": f"✅ Готово!\n⏱ Длительность: {duration} {unit}\n🔥 Калории: {calories} ккал\n🪙 Монеты: +{reward} (всего: {coins})",
         "en": f"✅ Done!\n⏱ Duration: {duration} {unit}\n🔥 Calories: {calories} kcal\n🪙 Coins: +{reward} (total: {coins})"
     }
-    send_clean_message(chat_id, user_id, result_text.get(lang, result_text["ua"]))
+    return result_text.get(lang, result_text["ua"]) + track_summary(timer.track, lang)
 
-@bot.message_handler(func=lambda m: m.text and m.text.lower() in ["⏱ режим біг", "⏱ режим бег", "⏱ running mode"])
-def run_menu(message):
+@router.route(*STOP_RUN_BUTTONS)
+@startup.needs("runs", "ledger")
+def stop_run(message):
     user_id = str(message.from_user.id)
     lang = get_lang(user_id)
+    finished = finish_run(user_id)
+    if finished is None:
+        send_clean_message(message.chat.id, user_id, RUN_NOT_ACTIVE.get(lang, RUN_NOT_ACTIVE["ua"]))
+        return
+    send_clean_message(message.chat.id, user_id, run_result_text(lang, *finished))
 
+@keyboards.screen("run", variants=[(l,) for l in LANGUAGES])
+def _kb_run(lang):
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
     if lang == "ru":
         markup.add("🏁 Начать бег", "⛔️ Завершить бег")
         markup.add("📊 Мои результаты", "⬅️ Главное меню")
-        text = "🏃‍♂️ Выбери действие для SHARKAN RUN:"
     elif lang == "en":
         markup.add("🏁 Start run", "⛔️ Stop run")
         markup.add("📊 My results", "⬅️ Main menu")
-        text = "🏃‍♂️ Choose an action for SHARKAN RUN:"
     else:
         markup.add("🏁 Почати біг", "⛔️ Завершити біг")
         markup.add("📊 Мої результати", "⬅️ Головне меню")
-        text = "🏃‍♂️ Обери дію для SHARKAN RUN:"
+    return markup
 
-    send_clean_message(message.chat.id, user_id, text, reply_markup=markup)
+@router.route(*RUN_MENU_BUTTONS)
+def run_menu(message):
+    user_id = str(message.from_user.id)
+    send_clean_message(message.chat.id, user_id, *run_menu_reply(user_id))
 
-@bot.message_handler(func=lambda m: m.text and any(s in m.text.lower() for s in ["результат", "results"]))
+def run_menu_reply(user_id):
+    lang = get_lang(user_id)
+    text = {
+        "ru": "🏃‍♂️ Выбери действие для SHARKAN RUN:",
+        "en": "🏃‍♂️ Choose an action for SHARKAN RUN:",
+    }.get(lang, "🏃‍♂️ Обери дію для SHARKAN RUN:")
+    return text, keyboards.get("run", lang)
+
+@router.route(
+    "📊 Мої результати", "📊 Мои результаты", "📊 My Results",
+    "📊 Мій прогрес", "📊 Мой прогресс", "📊 My Progress"
+)
+@startup.needs("runs")
 def show_run_results(message):
     user_id = str(message.from_user.id)
     chat_id = message.chat.id
     lang = get_lang(user_id)
-    try:
-        with open("run_history.json", "r", encoding="utf-8") as f:
-            run_history = json.load(f)
-        records = run_history.get(user_id, [])
-    except Exception:
-        records = []
+    stats = run_index.get(user_id)
+    records = list(stats.last) if stats else []
 
     if not records:
         no_data = {
@@ -389,71 +565,73 @@ def show_run_results(message):
     unit = {"ua": "хв", "ru": "мин", "en": "min"}[lang if lang in ["ua","ru","en"] else "ua"]
 
     result = [titles.get(lang, titles["ua"])]
-    for run in reversed(records[-3:]):
+    for run in reversed(records):
         result.append(f"📅 {run['date']} — {run['duration_min']} {unit} — {run['calories']} ккал")
     send_clean_message(chat_id, user_id, "\n".join(result))
 
 # === /start, выбор языка/гендера, сохранение имени ===
 @bot.message_handler(commands=["start"])
 def start(message):
-    user_id = str(message.from_user.id)
+    remember_user(message.from_user)
+    bot.send_message(message.chat.id, LANGUAGE_PROMPT, reply_markup=keyboards.get("languages"))
+
+LANGUAGE_PROMPT = "👋 Обери мову / Choose your language / Выберите язык:"
 
+def remember_user(user):
     # сохраняем имя/ник для рейтинга/подписей
+    user_id = str(user.id)
     profile = user_profiles.setdefault(user_id, {})
-    profile["first_name"] = message.from_user.first_name or profile.get("first_name")
-    profile["last_name"] = message.from_user.last_name or profile.get("last_name")
-    profile["username"] = message.from_user.username or profile.get("username")
-    save_profiles()
-
-    markup = types.InlineKeyboardMarkup()
-    for code, name in LANGUAGES.items():
-        markup.add(types.InlineKeyboardButton(name, callback_data=f"lang_{code}"))
-    bot.send_message(message.chat.id, "👋 Обери мову / Choose your language / Выберите язык:", reply_markup=markup)
+    profile["first_name"] = user.first_name or profile.get("first_name")
+    profile["last_name"] = user.last_name or profile.get("last_name")
+    profile["username"] = user.username or profile.get("username")
+    save_profile(user_id)
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("lang_"))
 def set_language(call):
-    chat_id = call.message.chat.id
-    user_id = str(call.from_user.id)
-    lang = call.data.split("_", 1)[1]
+    text, markup = language_chosen(str(call.from_user.id), call.data.split("_", 1)[1])
+    bot.edit_message_text(chat_id=call.message.chat.id, message_id=call.message.message_id, text=text,
+                          reply_markup=markup)
 
+def language_chosen(user_id, lang):
     profile = user_profiles.setdefault(user_id, {})
     profile["language"] = lang
-    user_lang[user_id] = lang
-    save_profiles()
+    save_profile(user_id)
 
     if lang == "ua":
         text = "✅ Твоя мова — українська. Вітаємо в SHARKAN BOT!\n\n👤 Обери свою стать:"
-        markup = types.InlineKeyboardMarkup()
-        markup.add(
-            types.InlineKeyboardButton("Я — чоловік", callback_data="gender_male"),
-            types.InlineKeyboardButton("Я — жінка", callback_data="gender_female")
-        )
     elif lang == "ru":
         text = "✅ Ваш язык — русский. Добро пожаловать в SHARKAN BOT!\n\n👤 Выбери свой пол:"
-        markup = types.InlineKeyboardMarkup()
-        markup.add(
-            types.InlineKeyboardButton("Я — мужчина", callback_data="gender_male"),
-            types.InlineKeyboardButton("Я — женщина", callback_data="gender_female")
-        )
     else:
         text = "✅ Your language is English. Welcome to SHARKAN BOT!\n\n👤 Select your gender:"
-        markup = types.InlineKeyboardMarkup()
-        markup.add(
-            types.InlineKeyboardButton("I am a man", callback_data="gender_male"),
-            types.InlineKeyboardButton("I am a woman", callback_data="gender_female")
-        )
-
-    bot.edit_message_text(chat_id=chat_id, message_id=call.message.message_id, text=text, reply_markup=markup)
+    return text, keyboards.get("gender", lang)
+
+@keyboards.screen("gender", variants=[(l,) for l in LANGUAGES])
+def _kb_gender(lang):
+    labels = {
+        "ua": ("Я — чоловік", "Я — жінка"),
+        "ru": ("Я — мужчина", "Я — женщина"),
+    }.get(lang, ("I am a man", "I am a woman"))
+    markup = types.InlineKeyboardMarkup()
+    markup.add(
+        types.InlineKeyboardButton(labels[0], callback_data="gender_male"),
+        types.InlineKeyboardButton(labels[1], callback_data="gender_female")
+    )
+    return markup
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("gender_"))
 def handle_gender(call):
     chat_id = call.message.chat.id
     user_id = str(call.from_user.id)
-    gender = call.data.split("_", 1)[1]  # male / female
+    confirm = gender_chosen(user_id, call.data.split("_", 1)[1])
+    bot.edit_message_reply_markup(chat_id=chat_id, message_id=call.message.message_id)
+    bot.send_message(chat_id, confirm)
+    menu_from_id(chat_id, user_id)
 
+def gender_chosen(user_id, gender):
+    # gender: male / female
     profile = user_profiles.setdefault(user_id, {})
     profile["gender"] = gender
-    save_profiles()
+    save_profile(user_id)
 
     lang = get_lang(user_id)
     confirm = {
@@ -461,115 +639,116 @@ def handle_gender(call):
         "ru": "✅ Пол сохранён.",
         "en": "✅ Gender saved."
     }
-    bot.edit_message_reply_markup(chat_id=chat_id, message_id=call.message.message_id)
-    bot.send_message(chat_id, confirm.get(lang, "✅ Done."))
-    menu_from_id(chat_id, user_id)
+    return confirm.get(lang, "✅ Done.")
 
 # === Главное меню и обработчики кнопок ===
-def menu_from_id(chat_id, user_id):
-    lang = get_lang(user_id)
-    gender = user_profiles.get(user_id, {}).get("gender", "male")
+# (мужской вариант, женский вариант) — если вариант один, он общий
+MAIN_MENU = {
+    "ua": [
+        ("🔥 План на сьогодні", "🔥 Мій план"),
+        ("🏋️ Тренування",),
+        ("🧠 Мотивація", "💖 Натхнення"),
+        ("⏱ Режим БІГ",),
+        ("🥷 Бій з Тінню",),
+        ("📚 Книги SHARKAN",),
+        ("🎓 Поради від тренерів",),
+        ("🤖 AI SHARKAN",),
+        ("🥇 Виклик", "🌟 Виклик"),
+        ("🪙 SHRK COINS", "💎 SHRK COINS"),
+        ("📊 Мої результати", "📊 Мій прогрес"),
+        ("📈 Статистика", "📈 Прогрес / Ранги"),
+        ("🏆 Рейтинг SHARKAN",),
+        ("🎵 Музика",),
+        ("👤 Мій профіль", "👑 Мій шлях"),
+        ("🛍 Магазин",),
+        ("💬 Чат SHARKAN",),
+        ("📢 Канал SHARKAN",),
+        ("🧘 Відновлення", "🧘‍♀️ Відновлення"),
+        ("🔒 Темна Зона",),
+        ("⚙️ Налаштування",),
+        ("❓ Допомога / FAQ", "❓ FAQ / Підтримка"),
+        ("📨 Співпраця",),
+    ],
+    "ru": [
+        ("🔥 План на сегодня", "🔥 Мой план"),
+        ("🏋️ Тренировка",),
+        ("🧠 Мотивация", "💖 Вдохновение"),
+        ("⏱ Режим БЕГ",),
+        ("🥷 Бой с Тенью",),
+        ("📚 Книги SHARKAN",),
+        ("🎓 Советы от тренеров",),
+        ("🤖 AI SHARKAN",),
+        ("🥇 Вызов", "🌟 Вызов"),
+        ("🪙 SHRK COINS", "💎 SHRK COINS"),
+        ("📊 Мои результаты", "📊 Мой прогресс"),
+        ("📈 Статистика", "📈 Прогресс / Ранги"),
+        ("🏆 Рейтинг SHARKAN",),
+        ("🎵 Музыка",),
+        ("👤 Мой профиль", "👑 Мой путь"),
+        ("🛍 Магазин",),
+        ("💬 Чат SHARKAN",),
+        ("📢 Канал SHARKAN",),
+        ("🧘 Восстановление", "🧘‍♀️ Восстановление"),
+        ("🔒 Тёмная Зона",),
+        ("⚙️ Настройки",),
+        ("❓ Помощь / FAQ", "❓ FAQ / Поддержка"),
+        ("📨 Сотрудничество",),
+    ],
+    "en": [
+        ("🔥 Today's Plan", "🔥 My Plan"),
+        ("🏋️ Workout",),
+        ("🧠 Motivation", "💖 Inspiration"),
+        ("⏱ Running Mode",),
+        ("🥷 Shadow Fight",),
+        ("📚 SHARKAN Books",),
+        ("🎓 Pro Trainer Tips",),
+        ("🤖 AI SHARKAN",),
+        ("🥇 Challenge", "🌟 Challenge"),
+        ("🪙 SHRK COINS", "💎 SHRK COINS"),
+        ("📊 My Results", "📊 My Progress"),
+        ("📈 Statistics", "📈 Progress / Ranks"),
+        ("🏆 SHARKAN Ranking",),
+        ("🎵 Music",),
+        ("👤 My Profile", "👑 My Path"),
+        ("🛍 Shop",),
+        ("💬 SHARKAN Chat",),
+        ("📢 SHARKAN Channel",),
+        ("🧘 Recovery", "🧘‍♀️ Recovery"),
+        ("🔒 Dark Zone",),
+        ("⚙️ Settings",),
+        ("❓ Help / FAQ",),
+        ("📨 Contact Us",),
+    ],
+}
+
+@keyboards.screen("main", variants=[(l, g) for l in MAIN_MENU for g in ("male", "female")])
+def _kb_main(lang, gender):
+    buttons = [b[-1] if gender == "female" else b[0] for b in MAIN_MENU[lang]]
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-
-    if lang == "ua":
-        buttons = [
-            "🔥 Мій план" if gender == "female" else "🔥 План на сьогодні",
-            "🏋️ Тренування",
-            "💖 Натхнення" if gender == "female" else "🧠 Мотивація",
-            "⏱ Режим БІГ",
-            "🥷 Бій з Тінню",
-            "📚 Книги SHARKAN",
-            "🎓 Поради від тренерів",
-            "🤖 AI SHARKAN",
-            "🌟 Виклик" if gender == "female" else "🥇 Виклик",
-            "💎 SHRK COINS" if gender == "female" else "🪙 SHRK COINS",
-            "📊 Мій прогрес" if gender == "female" else "📊 Мої результати",
-            "📈 Прогрес / Ранги" if gender == "female" else "📈 Статистика",
-            "🏆 Рейтинг SHARKAN",
-            "🎵 Музика",
-            "👑 Мій шлях" if gender == "female" else "👤 Мій профіль",
-            "🛍 Магазин",
-            "💬 Чат SHARKAN",
-            "📢 Канал SHARKAN",
-            "🧘‍♀️ Відновлення" if gender == "female" else "🧘 Відновлення",
-            "🔒 Темна Зона",
-            "⚙️ Налаштування",
-            "❓ FAQ / Підтримка" if gender == "female" else "❓ Допомога / FAQ",
-            "📨 Співпраця"
-        ]
-    elif lang == "ru":
-        buttons = [
-            "🔥 Мой план" if gender == "female" else "🔥 План на сегодня",
-            "🏋️ Тренировка",
-            "💖 Вдохновение" if gender == "female" else "🧠 Мотивация",
-            "⏱ Режим БЕГ",
-            "🥷 Бой с Тенью",
-            "📚 Книги SHARKAN",
-            "🎓 Советы от тренеров",
-            "🤖 AI SHARKAN",
-            "🌟 Вызов" if gender == "female" else "🥇 Вызов",
-            "💎 SHRK COINS" if gender == "female" else "🪙 SHRK COINS",
-            "📊 Мой прогресс" if gender == "female" else "📊 Мои результаты",
-            "📈 Прогресс / Ранги" if gender == "female" else "📈 Статистика",
-            "🏆 Рейтинг SHARKAN",
-            "🎵 Музыка",
-            "👑 Мой путь" if gender == "female" else "👤 Мой профиль",
-            "🛍 Магазин",
-            "💬 Чат SHARKAN",
-            "📢 Канал SHARKAN",
-            "🧘‍♀️ Восстановление" if gender == "female" else "🧘 Восстановление",
-            "🔒 Тёмная Зона",
-            "⚙️ Настройки",
-            "❓ FAQ / Поддержка" if gender == "female" else "❓ Помощь / FAQ",
-            "📨 Сотрудничество"
-        ]
-    else:
-        buttons = [
-            "🔥 My Plan" if gender == "female" else "🔥 Today's Plan",
-            "🏋️ Workout",
-            "💖 Inspiration" if gender == "female" else "🧠 Motivation",
-            "⏱ Running Mode",
-            "🥷 Shadow Fight",
-            "📚 SHARKAN Books",
-            "🎓 Pro Trainer Tips",
-            "🤖 AI SHARKAN",
-            "🌟 Challenge" if gender == "female" else "🥇 Challenge",
-            "💎 SHRK COINS" if gender == "female" else "🪙 SHRK COINS",
-            "📊 My Progress" if gender == "female" else "📊 My Results",
-            "📈 Progress / Ranks" if gender == "female" else "📈 Statistics",
-            "🏆 SHARKAN Ranking",
-            "🎵 Music",
-            "👑 My Path" if gender == "female" else "👤 My Profile",
-            "🛍 Shop",
-            "💬 SHARKAN Chat",
-            "📢 SHARKAN Channel",
-            "🧘‍♀️ Recovery" if gender == "female" else "🧘 Recovery",
-            "🔒 Dark Zone",
-            "⚙️ Settings",
-            "❓ Help / FAQ",
-            "📨 Contact Us"
-        ]
-
     for i in range(0, len(buttons), 2):
         markup.add(*buttons[i:i+2])
+    return markup
 
-    bot.send_message(
-        chat_id,
-        "🧠 Обери розділ:" if lang == "ua" else "🧠 Выберите раздел:" if lang == "ru" else "🧠 Choose a section:",
-        reply_markup=markup
-    )
+def menu_from_id(chat_id, user_id):
+    text, markup = main_menu(user_id)
+    bot.send_message(chat_id, text, reply_markup=markup)
 
-@bot.message_handler(func=lambda msg: msg.text and msg.text.lower() in ["⬅️ головне меню", "⬅️ главное меню", "⬅️ main menu"])
+def main_menu(user_id):
+    lang = get_lang(user_id)
+    gender = user_profiles.get(user_id, {}).get("gender", "male")
+    markup = keyboards.get("main", lang if lang in MAIN_MENU else "en", "female" if gender == "female" else "male")
+    text = "🧠 Обери розділ:" if lang == "ua" else "🧠 Выберите раздел:" if lang == "ru" else "🧠 Choose a section:"
+    return text, markup
+
+@router.route(*MAIN_MENU_BUTTONS)
 def back_to_main_menu(message):
     user_id = str(message.from_user.id)
     menu_from_id(message.chat.id, user_id)
 
 # === Профиль: вес/рост/цель ===
-profile_wizard = {}  # user_id -> {"step": ..., "tmp": {...}}
-
 def start_profile(chat_id, user_id):
     lang = get_lang(user_id)
-    profile_wizard[user_id] = {"step": "weight", "tmp": {}}
+    sessions.get(user_id).wizard = {"step": "weight", "tmp": {}}
     prompt = {
         "ua": "⚖️ Вкажи свою вагу (кг), напр.: 75",
         "ru": "⚖️ Укажи свой вес (кг), напр.: 75",
@@ -577,9 +756,8 @@ def start_profile(chat_id, user_id):
     }
     bot.send_message(chat_id, prompt.get(lang, prompt["ua"]))
 
-@bot.message_handler(func=lambda m: m.text and m.text in [
-    "👤 Мій профіль","👤 Мой профиль","👤 My Profile","👑 Мій шлях","👑 Мой путь","👑 My Path"
-])
+@router.route("👤 Мій профіль", "👤 Мой профиль", "👤 My Profile", "👑 Мій шлях", "👑 Мой путь", "👑 My Path")
+@startup.needs("ledger")
 def on_profile_button(message):
     user_id = str(message.from_user.id)
     profile = user_profiles.get(user_id, {})
@@ -589,17 +767,40 @@ def on_profile_button(message):
         return
 
     txt = {
-        "ua": f"👤 Профіль:\nВага: {profile.get('weight','?')} кг\nЗріст: {profile.get('height','?')} см\nЦіль: {profile.get('goal','?')}\nМонети: {profile.get('coins',0)}",
-        "ru": f"👤 Профиль:\nВес: {profile.get('weight','?')} кг\nРост: {profile.get('height','?')} см\nЦель: {profile.get('goal','?')}\nМонеты: {profile.get('coins',0)}",
-        "en": f"👤 Profile:\nWeight: {profile.get('weight','?')} kg\nHeight: {profile.get('height','?')} cm\nGoal: {profile.get('goal','?')}\nCoins: {profile.get('coins',0)}",
+        "ua": f"👤 Профіль:\nВага: {profile.get('weight','?')} кг\nЗріст: {profile.get('height','?')} см\nЦіль: {profile.get('goal','?')}\nМонети: {ledger.balance(user_id)}",
+        "ru": f"👤 Профиль:\nВес: {profile.get('weight','?')} кг\nРост: {profile.get('height','?')} см\nЦель: {profile.get('goal','?')}\nМонеты: {ledger.balance(user_id)}",
+        "en": f"👤 Profile:\nWeight: {profile.get('weight','?')} kg\nHeight: {profile.get('height','?')} cm\nGoal: {profile.get('goal','?')}\nCoins: {ledger.balance(user_id)}",
     }
     bot.send_message(message.chat.id, txt.get(lang, txt["ua"]))
 
-@bot.message_handler(func=lambda m: str(m.from_user.id) in profile_wizard)
+@keyboards.screen("goal", variants=[(l,) for l in LANGUAGES])
+def _kb_goal(lang):
+    kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    if lang == "ru":
+        kb.add("Похудеть","Набрать массу")
+        kb.add("Поддерживать форму")
+    elif lang == "en":
+        kb.add("Lose weight","Gain muscle")
+        kb.add("Maintain")
+    else:
+        kb.add("Схуднути","Набрати масу")
+        kb.add("Підтримувати форму")
+    return kb
+
+@keyboards.screen("remove")
+def _kb_remove():
+    return types.ReplyKeyboardRemove()
+
+def _in_wizard(message):
+    session = sessions.peek(str(message.from_user.id))
+    return session is not None and session.wizard is not None
+
+@router.fallback(_in_wizard)
 def profile_flow(message):
     user_id = str(message.from_user.id)
     lang = get_lang(user_id)
-    data = profile_wizard[user_id]
+    session = sessions.get(user_id)
+    data = session.wizard
     step = data["step"]
     value = (message.text or "").strip()
 
@@ -614,16 +815,7 @@ def profile_flow(message):
 
     def ask_goal():
         data["step"] = "goal"
-        kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        if lang == "ru":
-            kb.add("Похудеть","Набрать массу")
-            kb.add("Поддерживать форму")
-        elif lang == "en":
-            kb.add("Lose weight","Gain muscle")
-            kb.add("Maintain")
-        else:
-            kb.add("Схуднути","Набрати масу")
-            kb.add("Підтримувати форму")
+        kb = keyboards.get("goal", lang)
         bot.send_message(message.chat.id, {
             "ua":"🎯 Обери ціль:",
             "ru":"🎯 Выбери цель:",
@@ -665,118 +857,36 @@ def profile_flow(message):
         prof = user_profiles.setdefault(user_id, {})
         prof.update(data["tmp"])
         prof["goal"] = goal_code
-        prof.setdefault("coins", 0)
-        save_profiles()
-        profile_wizard.pop(user_id, None)
+        save_profile(user_id)
+        session.wizard = None
 
         done = {"ua":"✅ Профіль збережено.","ru":"✅ Профиль сохранён.","en":"✅ Profile saved."}[lang]
-        bot.send_message(message.chat.id, done, reply_markup=types.ReplyKeyboardRemove())
+        bot.send_message(message.chat.id, done, reply_markup=keyboards.get("remove"))
         menu_from_id(message.chat.id, user_id)
         return
 
 # === План на сьогодні / План на сегодня ===
-@bot.message_handler(func=lambda m: m.text and m.text in [
-    "🔥 План на сьогодні","🔥 План на сегодня","🔥 Today's Plan","🔥 Мій план","🔥 Мой план","🔥 My Plan"
-])
+# Шаблоны — plans.json (через реестр контента), рендер и кэш — plans.py
+plan_engine = PlanEngine(user_profiles, run_index, lambda: content.current)
+
+@router.route("🔥 План на сьогодні", "🔥 План на сегодня", "🔥 Today's Plan", "🔥 Мій план", "🔥 Мой план", "🔥 My Plan")
+@startup.needs("content", "runs")
 def plan_today(message):
     user_id = str(message.from_user.id)
-    lang = get_lang(user_id)
-    prof = user_profiles.get(user_id, {})
-    weight = int(prof.get("weight", 70))
-    goal = prof.get("goal", "maintain")
-
-    # Простая логика генерации плана
-    if goal == "lose":
-        workout = [
-            "1) Берпі — 3×12 (відпочинок 60с)",
-            "2) Присідання з вагою тіла — 4×15 (45с)",
-            "3) Планка — 3×45с (30с)",
-            "4) Випади — 3×12/нога (60с)",
-            "5) Скакалка/кардіо — 10 хв помірно"
-        ]
-        kcal_target = max(500, 6 * weight)
-        meals = [
-            "Сніданок: йогурт + ягоди + жменя горіхів",
-            "Обід: куряче філе на парі + овочі",
-            "Вечеря: риба/тунець + салат",
-            "Перекус: яблуко/морква"
-        ]
-    elif goal == "gain":
-        workout = [
-            "1) Віджимання — 5×10-15 (90с)",
-            "2) Присідання — 5×12 (90с)",
-            "3) Тяга в нахилі (еластик/гантелі) — 4×12 (90с)",
-            "4) Жим над головою (гантелі/еластик) — 4×10 (90с)",
-            "5) Прес: скручування — 3×15 (60с)"
-        ]
-        kcal_target = max(2600, 30 * weight)
-        meals = [
-            "Сніданок: вівсянка + банан + арахісова паста",
-            "Обід: рис + курка/яловичина + овочі",
-            "Перекус: творог/йогурт + горіхи",
-            "Вечеря: паста/картопля + риба/м'ясо + салат"
-        ]
-    else:
-        workout = [
-            "1) Легка пробіжка — 20 хв",
-            "2) Віджимання — 3×12 (60с)",
-            "3) Присідання — 3×15 (60с)",
-            "4) Планка — 3×40с (30с)",
-            "5) Розтяжка — 10 хв"
-        ]
-        kcal_target = max(2000, 22 * weight)
-        meals = [
-            "Сніданок: омлет + овочі",
-            "Обід: гречка + індичка/курка + салат",
-            "Перекус: фрукти/горіхи",
-            "Вечеря: риба/овочі/салат"
-        ]
-
-    water = f"Вода: {round(weight*0.03,1)} л/день"
-    supps = "Добавки: вітамін D, омега-3, електроліти (за потреби)."
-
-    text_map = {
-        "ua": f"🗓 <b>План на сьогодні</b>\n\n<b>Тренування</b>:\n" + "\n".join(workout) +
-              f"\n\n<b>Харчування</b>:\n- " + "\n- ".join(meals) +
-              f"\n\n<b>Калорії (орієнтир)</b>: ~{kcal_target} ккал\n{water}\n{supps}",
-        "ru": f"🗓 <b>План на сегодня</b>\n\n<b>Тренировка</b>:\n" + "\n".join(workout) +
-              f"\n\n<b>Питание</b>:\n- " + "\n- ".join(meals) +
-              f"\n\n<b>Калории (ориентир)</b>: ~{kcal_target} ккал\nВода: {round(weight*0.03,1)} л/день\nДобавки: витамин D, омега-3, электролиты.",
-        "en": f"🗓 <b>Plan for today</b>\n\n<b>Workout</b>:\n" + "\n".join(workout) +
-              f"\n\n<b>Nutrition</b>:\n- " + "\n- ".join(meals) +
-              f"\n\n<b>Calories (target)</b>: ~{kcal_target} kcal\nWater: {round(weight*0.03,1)} L/day\nSupplements: vitamin D, omega-3, electrolytes."
-    }
-    bot.send_message(message.chat.id, text_map.get(lang, text_map["ua"]), parse_mode="HTML")
+    bot.send_message(message.chat.id, plan_engine.today(user_id), parse_mode="HTML")
 
 # === Статистика / Progress ===
-def compute_streak(records):
-    if not records:
-        return 0
-    dates = sorted({r["date"] for r in records}, reverse=True)
-    today = datetime.now().date()
-    streak = 0
-    cur = today
-    dates_set = set(datetime.strptime(d, "%Y-%m-%d").date() for d in dates)
-    while cur in dates_set:
-        streak += 1
-        cur = cur - timedelta(days=1)
-    return streak
-
-@bot.message_handler(func=lambda m: m.text and m.text in ["📈 Статистика","📈 Прогрес / Ранги","📈 Statistics","📈 Progress / Ranks"])
+@router.route("📈 Статистика", "📈 Прогрес / Ранги", "📈 Прогресс / Ранги", "📈 Statistics", "📈 Progress / Ranks")
+@startup.needs("runs")
 def show_stats(message):
     user_id = str(message.from_user.id)
     lang = get_lang(user_id)
-    try:
-        with open("run_history.json","r",encoding="utf-8") as f:
-            data = json.load(f)
-        recs = data.get(user_id, [])
-    except Exception:
-        recs = []
-
-    total_runs = len(recs)
-    total_min = sum(r.get("duration_min",0) for r in recs)
-    total_kcal = sum(r.get("calories",0) for r in recs)
-    streak = compute_streak(recs)
+    stats = run_index.get(user_id)
+    if stats:
+        total_runs, total_min, total_kcal = stats.runs, stats.minutes, stats.calories
+        streak = stats.streak()
+    else:
+        total_runs = total_min = total_kcal = streak = 0
 
     txt = {
         "ua": f"📈 <b>Статистика</b>\nПробіжок: {total_runs}\nХвилин: {total_min}\nКалорій: {total_kcal}\nСтрік: {streak} дн.",
@@ -786,11 +896,12 @@ def show_stats(message):
     bot.send_message(message.chat.id, txt.get(lang, txt["ua"]), parse_mode="HTML")
 
 # === SHRK COINS ===
-@bot.message_handler(func=lambda m: m.text and m.text in ["🪙 SHRK COINS","💎 SHRK COINS"])
+@router.route("🪙 SHRK COINS", "💎 SHRK COINS")
+@startup.needs("ledger")
 def coins_handler(message):
     user_id = str(message.from_user.id)
     lang = get_lang(user_id)
-    coins = int(user_profiles.get(user_id, {}).get("coins", 0))
+    coins = ledger.balance(user_id)
     txt = {
         "ua": f"🪙 Твій баланс SHRK COINS: <b>{coins}</b>",
         "ru": f"🪙 Твой баланс SHRK COINS: <b>{coins}</b>",
@@ -808,17 +919,21 @@ SHOP_ITEMS = [
 def get_inventory(uid: str):
     return user_profiles.setdefault(uid, {}).setdefault("inventory", [])
 
-@bot.message_handler(func=lambda m: m.text and m.text in ["🛍 Магазин","🛍 Shop"])
-def shop_handler(message):
-    uid = str(message.from_user.id)
-    coins = int(user_profiles.setdefault(uid, {}).get("coins", 0))
-
+@keyboards.screen("shop")
+def _kb_shop():
     markup = types.InlineKeyboardMarkup()
     for item in SHOP_ITEMS:
         markup.add(types.InlineKeyboardButton(
             f"{item['title']} — {item['price']} 🪙",
             callback_data=f"buy_{item['id']}"
         ))
+    return markup
+
+@router.route("🛍 Магазин", "🛍 Shop")
+@startup.needs("ledger")
+def shop_handler(message):
+    uid = str(message.from_user.id)
+    coins = ledger.balance(uid)
 
     lang = get_lang(uid)
     caption = {
@@ -827,164 +942,269 @@ def shop_handler(message):
         "en": f"🛍 Your balance: {coins} 🪙\nPick an item:"
     }[lang if lang in ["ua","ru","en"] else "ua"]
 
-    bot.send_message(message.chat.id, caption, reply_markup=markup)
+    bot.send_message(message.chat.id, caption, reply_markup=keyboards.get("shop"))
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("buy_"))
+@startup.needs("ledger")
 def buy_item(call):
     uid = str(call.from_user.id)
     item_id = call.data.replace("buy_", "", 1)
-    profile = user_profiles.setdefault(uid, {})
-    coins = int(profile.get("coins", 0))
-
     item = next((x for x in SHOP_ITEMS if x["id"] == item_id), None)
     if not item:
         bot.answer_callback_query(call.id, "❌ Товар не найден.")
         return
 
-    if coins < item["price"]:
-        bot.answer_callback_query(call.id, "💸 Недостаточно монет.")
+    # проверка инвентаря и списание — под блокировкой пользователя, ключ —
+    # id нажатия: двойной тап и повторная доставка не спишут монеты дважды.
+    # Ответ в Telegram — уже после блокировки: сеть не держит страйп.
+    refusal = None
+    with ledger.locked(uid):
+        inv = get_inventory(uid)
+        if item_id in inv:
+            refusal = "✅ Уже куплено."
+        else:
+            try:
+                coins = ledger.spend(uid, item["price"], f"buy:{item_id}", key=call.id)
+                inv.append(item_id)
+            except InsufficientCoins:
+                refusal = "💸 Недостаточно монет."
+    if refusal:
+        bot.answer_callback_query(call.id, refusal)
         return
-
-    # списываем монеты, кладём в инвентарь
-    profile["coins"] = coins - item["price"]
-    inv = get_inventory(uid)
-    if item_id not in inv:
-        inv.append(item_id)
-    save_profiles()
+    save_profile(uid)
 
     bot.answer_callback_query(call.id, "✅ Покупка успешна!")
-    bot.send_message(call.message.chat.id, f"✅ Куплено: {item['title']}\n💰 Остаток: {profile['coins']} 🪙")
-
-# === Лидерборд (топ-10 по минутам) ===
-@bot.message_handler(func=lambda m: m.text and m.text in ["🏆 Рейтинг SHARKAN","🏆 SHARKAN Ranking"])
-def leaderboard_handler(message):
-    # читаем историю пробежек
-    try:
-        with open("run_history.json", "r", encoding="utf-8") as f:
-            rh = json.load(f)
-    except Exception:
-        rh = {}
+    bot.send_message(call.message.chat.id, f"✅ Куплено: {item['title']}\n💰 Остаток: {coins} 🪙")
 
-    # собираем сумму минут по каждому пользователю
-    totals = []
-    for uid, recs in rh.items():
-        total_min = sum(r.get("duration_min", 0) for r in recs)
-        totals.append((uid, total_min))
+# === Лидерборд (топ-10 по минутам: неделя / месяц / всё время) ===
+LEADERBOARD_TITLES = {
+    "week": "🏆 Топ-10 за минутами бега (неделя):",
+    "month": "🏆 Топ-10 за минутами бега (месяц):",
+    "all": "🏆 Топ-10 за минутами бега:",
+}
 
-    totals.sort(key=lambda x: x[1], reverse=True)
-    top = totals[:10]
+@keyboards.screen("leaderboard")
+def _kb_leaderboard():
+    markup = types.InlineKeyboardMarkup()
+    markup.row(
+        types.InlineKeyboardButton("📅 Неделя", callback_data="lb_week"),
+        types.InlineKeyboardButton("🗓 Месяц", callback_data="lb_month"),
+        types.InlineKeyboardButton("♾ Всё время", callback_data="lb_all")
+    )
+    return markup
 
-    lines = ["🏆 Топ-10 за минутами бега:"]
+def leaderboard_text(user_id, window="all"):
+    top = leaderboard.top(window, 10)
+    lines = [LEADERBOARD_TITLES[window]]
     if not top:
         lines.append("Пока пусто. Беги первым! 🏃")
     else:
         for idx, (uid, mins) in enumerate(top, 1):
-            p = user_profiles.get(uid, {})
+            p = user_profiles.get(uid) or (not shards.owns(uid) and storage.load_profile(uid)) or {}
             name = p.get("first_name") or p.get("username") or f"ID {uid}"
             lines.append(f"{idx}. {name} — {mins} мин")
 
-    bot.send_message(message.chat.id, "\n".join(lines))
+    mine = leaderboard.rank(user_id, window)
+    if mine:
+        place, mins = mine
+        lines.append(f"\n📍 Твоё место: {place} из {leaderboard.size(window)} — {mins} мин")
+    return "\n".join(lines)
+
+@router.route(*LEADERBOARD_BUTTONS)
+@startup.needs("runs")
+def leaderboard_handler(message):
+    user_id = str(message.from_user.id)
+    bot.send_message(message.chat.id, leaderboard_text(user_id), reply_markup=keyboards.get("leaderboard"))
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("lb_"))
+@startup.needs("runs")
+def leaderboard_window(call):
+    window = call.data.split("_", 1)[1]
+    if window not in LEADERBOARD_TITLES:
+        bot.answer_callback_query(call.id)
+        return
+    text = leaderboard_text(str(call.from_user.id), window)
+    try:
+        bot.edit_message_text(chat_id=call.message.chat.id, message_id=call.message.message_id,
+                              text=text, reply_markup=keyboards.get("leaderboard"))
+    except Exception as e:
+        # "message is not modified" — обычное дело при повторном нажатии; ошибка учтена в sharkan_api_errors_total
+        if "message is not modified" in str(e):
+            logging.debug(f"[LEADERBOARD_EDIT] {e}")
+        else:
+            logging.error(f"[LEADERBOARD_EDIT_ERROR] {e}")
+    bot.answer_callback_query(call.id)
 
 # === Настройки ===
-@bot.message_handler(func=lambda m: m.text and m.text in ["⚙️ Налаштування","⚙️ Настройки","⚙️ Settings"])
+@router.route(*SETTINGS_BUTTONS)
 def settings_menu(message):
-    user_id = str(message.from_user.id)
+    text, markup = settings_reply(str(message.from_user.id))
+    bot.send_message(message.chat.id, text, reply_markup=markup)
+
+def settings_reply(user_id):
     lang = get_lang(user_id)
+    txt = {"ru": "⚙️ Настройки", "en": "⚙️ Settings"}.get(lang, "⚙️ Налаштування")
+    return txt, keyboards.get("settings", lang)
+
+@keyboards.screen("settings", variants=[(l,) for l in LANGUAGES])
+def _kb_settings(lang):
     kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
     if lang == "ru":
         kb.add("🌐 Сменить язык","🧹 Сбросить профиль")
         kb.add("⬅️ Главное меню")
-        txt = "⚙️ Настройки"
     elif lang == "en":
         kb.add("🌐 Change language","🧹 Reset profile")
         kb.add("⬅️ Main menu")
-        txt = "⚙️ Settings"
     else:
         kb.add("🌐 Змінити мову","🧹 Скинути профіль")
         kb.add("⬅️ Головне меню")
-        txt = "⚙️ Налаштування"
-    bot.send_message(message.chat.id, txt, reply_markup=kb)
+    return kb
 
-@bot.message_handler(func=lambda m: m.text and m.text in ["🌐 Сменить язык","🌐 Change language","🌐 Змінити мову"])
+@router.route("🌐 Сменить язык", "🌐 Change language", "🌐 Змінити мову")
 def settings_change_lang(message):
-    markup = types.InlineKeyboardMarkup()
-    for code, name in LANGUAGES.items():
-        markup.add(types.InlineKeyboardButton(name, callback_data=f"lang_{code}"))
-    bot.send_message(message.chat.id, "🌐 Обери мову / Choose language / Выберите язык:", reply_markup=markup)
+    bot.send_message(message.chat.id, "🌐 Обери мову / Choose language / Выберите язык:",
+                     reply_markup=keyboards.get("languages"))
 
-@bot.message_handler(func=lambda m: m.text and m.text in ["🧹 Сбросить профиль","🧹 Reset profile","🧹 Скинути профіль"])
+@router.route("🧹 Сбросить профиль", "🧹 Reset profile", "🧹 Скинути профіль")
+@startup.needs("ledger")
 def reset_profile(message):
     user_id = str(message.from_user.id)
     lang = get_lang(user_id)
     # сохраняем язык, остальное сбрасываем
-    user_profiles[user_id] = {"language": lang, "coins": 0}
-    save_profiles()
+    user_profiles[user_id] = {"language": lang}
+    ledger.set_balance(user_id, 0, "reset")
+    save_profile(user_id)
     bot.send_message(message.chat.id, {"ua":"✅ Профіль скинуто.","ru":"✅ Профиль сброшен.","en":"✅ Profile reset."}[lang])
     menu_from_id(message.chat.id, user_id)
 
 # === Бэкап / Восстановление ===
+def content_files():
+    # ключ в бэкапе -> файл на диске (книги лежат в books_ua или books_ua.json)
+    return [
+        ("books_ua.json", content.current.books.source_path("ua")),
+        ("motivations.json", "motivations.json"),
+        ("coaches_tips.json", "coaches_tips.json"),
+        ("plans.json", "plans.json"),
+    ]
+
+backups = BackupManager(storage, content_files)
+
+def reload_runtime_state():
+    # после восстановления: профили, индекс пробежек, рейтинг и контент
+    global user_profiles
+    user_profiles = load_own_profiles()
+    plan_engine.profiles = user_profiles
+    ledger.load()
+    load_runs()
+    content.reload(force=True)
+
 @bot.message_handler(commands=["backup"])
+@startup.needs()
 def backup_cmd(message):
-    payload = {}
-    for fn in ["user_profiles.json", "run_history.json", "books_ua.json", "motivations.json", "coaches_tips.json"]:
-        try:
-            with open(fn, "r", encoding="utf-8") as f:
-                payload[fn] = json.load(f)
-        except Exception:
-            payload[fn] = {}
-    fname = f"backup_{int(time.time())}.json"
-    with open(fname, "w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False, indent=2)
-    bot.send_document(message.chat.id, open(fname, "rb"), caption="💾 Бэкап готов.")
+    # /backup — инкрементальный (если есть предыдущий), /backup full — полный
+    full = "full" in (message.text or "").split()[1:]
+    try:
+        profile_writer.flush()   # в архив — всё, что уже изменено в памяти
+        path = backups.create(full=full)
+    except Exception as e:
+        logging.error(f"[BACKUP_ERROR] {e}")
+        bot.send_message(message.chat.id, f"❌ Помилка/Ошибка: {e}")
+        return
+    with open(path, "rb") as f:
+        bot.send_document(message.chat.id, f, caption=f"💾 Бэкап готов: {os.path.basename(path)}")
+
+RESTORE_SHARDED = {
+    "ua": "⛔ Відновлення недоступне в шардованому режимі: інші воркери не перечитають дані. "
+          "Зупини сервіс і віднови з SHARKAN_SHARDS=1.",
+    "ru": "⛔ Восстановление недоступно в шардированном режиме: другие воркеры не перечитают данные. "
+          "Останови сервис и восстанови с SHARKAN_SHARDS=1.",
+    "en": "⛔ Restore is unavailable in sharded mode: other workers would not reload the data. "
+          "Stop the service and restore with SHARKAN_SHARDS=1."
+}
+
+def restore_refused(message) -> bool:
+    # воркер перезагружает только свою память — в шардах восстановление запрещено
+    if shards.SHARDS <= 1:
+        return False
+    lang = get_lang(str(message.from_user.id))
+    bot.send_message(message.chat.id, RESTORE_SHARDED.get(lang, RESTORE_SHARDED["ua"]))
+    return True
 
 @bot.message_handler(commands=["restore"])
+@startup.needs()
 def restore_cmd(message):
+    if restore_refused(message):
+        return
     lang = get_lang(str(message.from_user.id))
     txt = {
-        "ua": "📥 Надішли JSON-файл бекапу (який я створював /backup). Я його відновлю.",
-        "ru": "📥 Пришли JSON-файл бэкапа (который я создавал /backup). Я восстановлюсь из него.",
-        "en": "📥 Send the JSON backup file (made by /backup). I will restore from it."
+        "ua": "📥 Надішли архів бекапу (*.tar.gz, який я створював /backup). Я його відновлю.",
+        "ru": "📥 Пришли архив бэкапа (*.tar.gz, который я создавал /backup). Я восстановлюсь из него.",
+        "en": "📥 Send the backup archive (*.tar.gz made by /backup). I will restore from it."
     }[lang if lang in ["ua","ru","en"] else "ua"]
     bot.send_message(message.chat.id, txt)
 
 @bot.message_handler(content_types=["document"])
+@startup.needs()
 def restore_on_doc(message):
     doc = message.document
-    if not doc or not doc.file_name.endswith(".json"):
+    if not doc or not doc.file_name:
         return
+    if doc.file_name.endswith((ARCHIVE_SUFFIX, ".json")) and restore_refused(message):
+        return
+    if doc.file_name.endswith(ARCHIVE_SUFFIX):
+        restore_archive(message)
+    elif doc.file_name.endswith(".json"):
+        restore_legacy_json(message)
+
+def restore_archive(message):
+    os.makedirs(backups.backup_dir, exist_ok=True)
+    tmp = os.path.join(backups.backup_dir, f".incoming_{message.message_id}{ARCHIVE_SUFFIX}")
+    try:
+        download_to(bot.get_file_url(message.document.file_id), tmp)
+        profile_writer.flush()   # отложенные записи не должны лечь поверх восстановленных
+        manifest = backups.restore(tmp)
+        reload_runtime_state()
+        # старые архивы хранят монеты в профилях
+        move_coins_to_ledger(replace=manifest["kind"] == "full" and "coins.jsonl" not in manifest["files"])
+        bot.send_message(message.chat.id, f"✅ Відновлено / Восстановлено ({manifest['kind']}, {manifest['id']}).")
+    except BackupError as e:
+        bot.send_message(message.chat.id, f"❌ Архів відхилено / Архив отклонён: {e}")
+    except Exception as e:
+        logging.error(f"[RESTORE_ERROR] {e}")
+        bot.send_message(message.chat.id, f"❌ Помилка/Ошибка: {e}")
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def restore_legacy_json(message):
+    # старый формат бэкапа (один JSON) — читается целиком, оставлен для совместимости
     try:
-        fi = bot.get_file(doc.file_id)
+        fi = bot.get_file(message.document.file_id)
         data = bot.download_file(fi.file_path)
         payload = json.loads(data.decode("utf-8"))
 
-        for fn in ["user_profiles.json", "run_history.json", "books_ua.json", "motivations.json", "coaches_tips.json"]:
-            if fn in payload:
+        # профили и история восстанавливаются одной транзакцией
+        profile_writer.flush()
+        with storage.batch():
+            if USER_PROFILE_FILE in payload:
+                storage.replace_profiles(payload[USER_PROFILE_FILE])
+            if RUN_HISTORY_FILE in payload:
+                storage.replace_runs(payload[RUN_HISTORY_FILE])
+
+        for key, fn in content_files():
+            if key in payload:
                 with open(fn, "w", encoding="utf-8") as f:
-                    json.dump(payload[fn], f, ensure_ascii=False, indent=2)
-
-        # перезагружаем в память только то, что используется в рантайме
-        global user_profiles, all_books, motivation_data, coaches_data, user_lang
-        with open("user_profiles.json", "r", encoding="utf-8") as f:
-            user_profiles = json.load(f)
-        with open("books_ua.json", "r", encoding="utf-8") as f:
-            all_books = json.load(f)
-        with open("motivations.json", "r", encoding="utf-8") as f:
-            motivation_data = json.load(f)
-        with open("coaches_tips.json", "r", encoding="utf-8") as f:
-            coaches_data = json.load(f)
-
-        # восстановим user_lang из профилей
-        user_lang = {}
-        for uid, profile in user_profiles.items():
-            if "language" in profile:
-                user_lang[uid] = profile["language"]
+                    json.dump(payload[key], f, ensure_ascii=False, indent=2)
 
+        backups.reset_state()
+        reload_runtime_state()
+        move_coins_to_ledger(replace=USER_PROFILE_FILE in payload)
         bot.send_message(message.chat.id, "✅ Відновлено / Восстановлено.")
     except Exception as e:
         bot.send_message(message.chat.id, f"❌ Помилка/Ошибка: {e}")
 
 # === Заглушки для ещё не реализованных разделов ===
-@bot.message_handler(func=lambda m: m.text and m.text in ["🥷 Бій з Тінню","🥷 Бой с Тенью","🥷 Shadow Fight"])
+@router.route("🥷 Бій з Тінню", "🥷 Бой с Тенью", "🥷 Shadow Fight")
 def shadow_fight(message):
     lang = get_lang(str(message.from_user.id))
     txt = {
@@ -994,7 +1214,7 @@ def shadow_fight(message):
     }
     bot.send_message(message.chat.id, txt.get(lang, txt["ua"]))
 
-@bot.message_handler(func=lambda m: m.text and m.text in ["🎵 Музика","🎵 Музыка","🎵 Music"])
+@router.route("🎵 Музика", "🎵 Музыка", "🎵 Music")
 def music_section(message):
     lang = get_lang(str(message.from_user.id))
     txt = {
@@ -1004,6 +1224,143 @@ def music_section(message):
     }
     bot.send_message(message.chat.id, txt.get(lang, txt["ua"]))
 
+# === Маршрутизатор текстовых сообщений ===
+# Регистрируется последним: команды (/start, /backup, ...) и документы
+# обрабатываются своими хендлерами выше.
+@bot.message_handler(content_types=["text"])
+def route_text(message):
+    router.dispatch(message)
+
 # === Старт ===
+@content.on_publish
+def _on_content_published(snapshot):
+    keyboards.invalidate("book_list")
+
+@startup.stage("content")
+def _load_content():
+    content.reload(force=True)
+    if not len(content.current.books):
+        print("Помилка при завантаженні книг: бібліотека порожня.")
+    keyboards.warm()
+    content.start_watching()
+
+@startup.stage("ledger")
+def _load_ledger():
+    ledger.load()
+    move_coins_to_ledger()
+
+@startup.stage("runs")
+def _load_runs():
+    load_runs()
+    if shards.SHARDS > 1:
+        run_feed.start()
+    finish_stops()
+
+@startup.stage("plans")
+def _start_plans():
+    # ночью — планы на завтра для тех, кто открывал план или бегал за PLAN_ACTIVE_DAYS
+    plan_engine.start_nightly(lambda day: [uid for uid in run_index.minutes_between(day - PLAN_ACTIVE_DAYS, day + 1)
+                                           if shards.owns(uid)])
+
+STILL_LOADING = "⏳ Бот ще завантажується, спробуй за хвилину."
+
+def _still_loading(obj):
+    text = STILL_LOADING
+    if isinstance(obj, types.CallbackQuery):
+        bot.answer_callback_query(obj.id, text)
+    else:
+        bot.send_message(obj.chat.id, text)
+
+startup.on_timeout = _still_loading
+
+_unfinished_stops = []   # (user_id, начало, минуты): пробежка записана, а финиша в журнале нет
+
+def recover_runs():
+    # таймеры из журнала: «Завершити біг» работает и после рестарта / деплоя
+    started = time.perf_counter()
+    sessions_ = run_journal.recover()
+    for s in sessions_:
+        saved = storage.find_run(s.user_id, s.start_time.isoformat())
+        if saved is not None:
+            # упали посреди стопа — таймер не поднимаем, стоп доводит finish_stops()
+            _unfinished_stops.append((s.user_id, s.start_time, saved[1]))
+            continue
+        running_timers[s.user_id] = RunTimer(bot, s.chat_id, s.user_id, s.weight, s.lang,
+                                             start_time=s.start_time, message_id=s.message_id or None)
+    if sessions_:
+        logging.info(f"[RUN_RECOVERED] {len(sessions_)} пробежек за {(time.perf_counter() - started) * 1000:.1f}ms")
+
+def finish_stops():
+    # после загрузки монет: повтор начисления по тому же ключу не удвоит их
+    while _unfinished_stops:
+        user_id, start_time, duration = _unfinished_stops.pop()
+        try:
+            ledger.earn(user_id, run_reward(duration), "run", key=f"run:{user_id}:{start_time.isoformat()}")
+            run_journal.stop(user_id, start_time)
+        except Exception as e:
+            metrics.ERRORS.inc("run_stop_replay")
+            logging.error(f"[RUN_STOP_REPLAY_ERROR] {user_id}: {e}")
+
+def shutdown(*_):
+    # SIGTERM / выход: дописать отложенные профили и позиции чтения
+    profile_writer.stop()
+    sessions.flush()
+    if startup.ready("runs"):
+        run_feed.save()
+    run_journal.close()
+    logsetup.stop()
+
+def _on_sigterm(signum, frame):
+    shutdown()
+    raise SystemExit(0)
+
+# === Метрики: /metrics на METRICS_PORT (у шардов — METRICS_PORT + номер шарда) ===
+metrics.instrument_router(router)
+metrics.instrument_bot(bot, skip=(route_text,))
+logsetup.tag_updates(bot)
+sessions.flush = metrics.timed(metrics.STORAGE_SECONDS, "sessions_flush")(sessions.flush)
+profile_writer.flush = metrics.timed(metrics.STORAGE_SECONDS, "profile_flush")(profile_writer.flush)
+metrics.REGISTRY.gauge("sharkan_active_timers", "Активные таймеры пробежек",
+                       lambda: timer_scheduler.active_count())
+metrics.REGISTRY.gauge("sharkan_state_size", "Размеры состояний в памяти", lambda: {
+    "user_profiles": len(user_profiles),
+    "running_timers": len(running_timers), "sessions": len(sessions),
+    "profiles_dirty": profile_writer.pending(), "outbox_pending": outbox.pending(),
+}, labels=("state",))
+metrics.REGISTRY.gauge("sharkan_outbox", "Счётчики исходящей очереди", lambda: dict(outbox.stats),
+                       labels=("event",))
+metrics.REGISTRY.gauge("sharkan_profile_writer", "Сброс профилей: пачки и задержки",
+                       lambda: dict(profile_writer.stats), labels=("stat",))
+metrics.REGISTRY.gauge("sharkan_leaderboard_size", "Участников в рейтинге",
+                       lambda: {w: leaderboard.size(w) for w in LEADERBOARD_TITLES}, labels=("window",))
+metrics.REGISTRY.gauge("sharkan_plan_cache", "Кэш планов: попадания, промахи, рендеры",
+                       lambda: dict(plan_engine.stats, size=len(plan_engine)), labels=("stat",))
+metrics.REGISTRY.gauge("sharkan_content_version", "Версия опубликованного контента",
+                       lambda: content.current.version if content.current else 0)
+if metrics.METRICS_PORT:
+    metrics.serve(port=metrics.METRICS_PORT + shards.SHARD_INDEX)
+
+sessions.start_flusher()
+profile_writer.start()
+atexit.register(shutdown)
+signal.signal(signal.SIGTERM, _on_sigterm)
+recover_runs()
+startup.start()
 print(f"{VERSION} запущено.")
-bot.infinity_polling(skip_pending=True)
+if BOT_MODE == "async":
+    pass   # цикл событий запускает async_main.py
+elif BOT_MODE == "worker":
+    # воркер шардированного режима: апдейты приходят от shards.py
+    shards.serve_worker(bot, on_stop=shutdown)
+elif BOT_MODE == "webhook":
+    webhook.serve(
+        bot,
+        host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+        port=int(os.getenv("WEBHOOK_PORT", "8443")),
+        path=os.getenv("WEBHOOK_PATH", "/webhook"),
+        secret=os.getenv("WEBHOOK_SECRET"),
+        public_url=os.getenv("WEBHOOK_URL"),
+        workers=int(os.getenv("WEBHOOK_WORKERS", "8"))
+    )
+else:
+    bot.infinity_polling(skip_pending=True)
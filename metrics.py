@@ -0,0 +1,371 @@
+# metrics.py
+import functools
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import logsetup
+
+# === Метрики и профилировщик ===
+# Счётчики, гистограммы и «снимаемые» значения (размеры словарей, число
+# таймеров) в формате Prometheus на http://METRICS_HOST:METRICS_PORT/metrics.
+# Хендлеры, маршруты кнопок и вызовы Bot API оборачиваются один раз при
+# старте, поэтому в коде хендлеров ничего не меняется. SHARKAN_PROFILE=1
+# включает сэмплирующий профилировщик: стеки потоков раз в
+# PROFILE_INTERVAL_MS, сводка — на /debug/profile (формат folded stacks).
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))    # 0 — не поднимать сервер
+PROFILE = os.getenv("SHARKAN_PROFILE", "") not in ("", "0")
+PROFILE_INTERVAL_MS = int(os.getenv("PROFILE_INTERVAL_MS", "10"))
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _fmt_labels(names, values, extra=""):
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, n=1):
+        labels = tuple(map(str, labels))
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + n
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_fmt_labels(self.labels, labels)} {value}"
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}   # labels -> [counts по бакетам..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        labels = tuple(map(str, labels))
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+                    break
+            row[-2] += value
+            row[-1] += 1
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for labels, row in items:
+            acc = 0
+            for bound, n in zip(self.buckets, row):
+                acc += n
+                le = 'le="%s"' % bound
+                yield f"{self.name}_bucket{_fmt_labels(self.labels, labels, le)} {acc}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_fmt_labels(self.labels, labels, le)} {row[-1]}"
+            yield f"{self.name}_sum{_fmt_labels(self.labels, labels)} {row[-2]:.6f}"
+            yield f"{self.name}_count{_fmt_labels(self.labels, labels)} {row[-1]}"
+
+
+class _Timer:
+    __slots__ = ("hist", "labels", "started")
+
+    def __init__(self, hist, labels):
+        self.hist, self.labels = hist, labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class Gauge:
+    # значение снимается в момент запроса /metrics: fn() -> число или {labels: число}
+    def __init__(self, name, help, fn, labels=()):
+        self.name, self.help, self.fn, self.labels = name, help, fn, tuple(labels)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        try:
+            value = self.fn()
+        except Exception as e:
+            logging.error(f"[METRICS_GAUGE_ERROR] {self.name}: {e}")
+            return
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for labels, v in items:
+            labels = labels if isinstance(labels, tuple) else (labels,)
+            yield f"{self.name}{_fmt_labels(self.labels, labels)} {v}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, fn, labels=()):
+        return self._add(Gauge(name, help, fn, labels))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+HANDLER_SECONDS = REGISTRY.histogram("sharkan_handler_seconds", "Время работы хендлера", ("handler",))
+HANDLER_ERRORS = REGISTRY.counter("sharkan_handler_errors_total", "Исключения в хендлерах", ("handler",))
+API_SECONDS = REGISTRY.histogram("sharkan_api_seconds", "Время вызова Bot API", ("method",))
+API_CALLS = REGISTRY.counter("sharkan_api_calls_total", "Вызовы Bot API", ("method",))
+API_ERRORS = REGISTRY.counter("sharkan_api_errors_total", "Ошибки Bot API", ("method", "code"))
+STORAGE_SECONDS = REGISTRY.histogram("sharkan_storage_seconds", "Время операций с хранилищем", ("op",))
+ERRORS = REGISTRY.counter("sharkan_errors_total", "Перехваченные ошибки вне хендлеров", ("where",))
+
+
+def timed(hist, *labels):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with hist.time(*labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _wrap_handler(fn, name):
+    if inspect.iscoroutinefunction(fn):
+        return _wrap_coroutine(fn, name)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        # записи лога внутри хендлера получают user_id / handler / update_id
+        token = logsetup.bind(handler=name, **(logsetup.event_fields(args[0]) if args else {}))
+        started = time.perf_counter()
+        error = None
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            HANDLER_ERRORS.inc(name)
+            error = e
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            HANDLER_SECONDS.observe(duration, name)
+            logsetup.handled(name, duration, error)
+            logsetup.unbind(token)
+    wrapper.__instrumented__ = True
+    return wrapper
+
+
+def _wrap_coroutine(fn, name):
+    # async-хендлеры AsyncTeleBot: те же метрики и поля лога
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        token = logsetup.bind(handler=name, **(logsetup.event_fields(args[0]) if args else {}))
+        started = time.perf_counter()
+        error = None
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as e:
+            HANDLER_ERRORS.inc(name)
+            error = e
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            HANDLER_SECONDS.observe(duration, name)
+            logsetup.handled(name, duration, error)
+            logsetup.unbind(token)
+    wrapper.__instrumented__ = True
+    return wrapper
+
+
+def instrument_bot(bot, skip=()):
+    # все зарегистрированные хендлеры TeleBot; skip — диспетчеры, у которых
+    # время считается по маршрутам (route_text)
+    for attr, handlers in vars(bot).items():
+        if not attr.endswith("_handlers") or not isinstance(handlers, list):
+            continue
+        for h in handlers:
+            fn = h.get("function") if isinstance(h, dict) else None
+            if fn is None or fn in skip or getattr(fn, "__instrumented__", False):
+                continue
+            h["function"] = _wrap_handler(fn, fn.__name__)
+
+
+def instrument_router(router):
+    router.wrap(_wrap_once)
+
+
+_wrapped = {}
+
+
+def _wrap_once(fn):
+    # одна обёртка на функцию: у кнопки на трёх языках — одна метрика
+    if getattr(fn, "__instrumented__", False):
+        return fn
+    if fn not in _wrapped:
+        _wrapped[fn] = _wrap_handler(fn, fn.__name__)
+    return _wrapped[fn]
+
+
+def instrument_api():
+    # все запросы TeleBot проходят через apihelper._make_request
+    from telebot import apihelper
+    original = apihelper._make_request
+    if getattr(original, "__instrumented__", False):
+        return
+
+    @functools.wraps(original)
+    def make_request(token, method_name, *args, **kwargs):
+        API_CALLS.inc(method_name)
+        started = time.perf_counter()
+        try:
+            return original(token, method_name, *args, **kwargs)
+        except apihelper.ApiTelegramException as e:
+            API_ERRORS.inc(method_name, e.error_code)
+            raise
+        except Exception:
+            API_ERRORS.inc(method_name, "network")
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, method_name)
+    make_request.__instrumented__ = True
+    apihelper._make_request = make_request
+
+
+def instrument_async_api():
+    # AsyncTeleBot ходит в API через asyncio_helper._process_request
+    from telebot import asyncio_helper
+    original = asyncio_helper._process_request
+    if getattr(original, "__instrumented__", False):
+        return
+
+    @functools.wraps(original)
+    async def process_request(token, method_name, *args, **kwargs):
+        API_CALLS.inc(method_name)
+        started = time.perf_counter()
+        try:
+            return await original(token, method_name, *args, **kwargs)
+        except asyncio_helper.ApiTelegramException as e:
+            API_ERRORS.inc(method_name, e.error_code)
+            raise
+        except Exception:
+            API_ERRORS.inc(method_name, "network")
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, method_name)
+    process_request.__instrumented__ = True
+    asyncio_helper._process_request = process_request
+
+
+# === Сэмплирующий профилировщик ===
+class SamplingProfiler:
+    def __init__(self, interval_ms=PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.samples = _Tally()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sharkan-profiler", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                with self._lock:
+                    self.samples[";".join(reversed(stack))] += 1
+
+    def folded(self, reset=False) -> str:
+        with self._lock:
+            items = self.samples.most_common()
+            if reset:
+                self.samples = _Tally()
+        return "".join(f"{stack} {n}\n" for stack, n in items)
+
+
+profiler = SamplingProfiler() if PROFILE else None
+
+
+def serve(host=METRICS_HOST, port=METRICS_PORT):
+    # фоновый HTTP-сервер /metrics (и /debug/profile при SHARKAN_PROFILE=1)
+    if not port:
+        return None
+    if profiler is not None:
+        profiler.start()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, ctype = REGISTRY.render().encode(), "text/plain; version=0.0.4"
+            elif self.path.startswith("/debug/profile") and profiler is not None:
+                body, ctype = profiler.folded(reset="reset" in self.path).encode(), "text/plain"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer((host, port), Handler)
+    except OSError as e:
+        logging.error(f"[METRICS_SERVER_ERROR] {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="sharkan-metrics", daemon=True).start()
+    logging.info(f"[METRICS] http://{host}:{server.server_address[1]}/metrics")
+    return server
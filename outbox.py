@@ -0,0 +1,238 @@
+# outbox.py
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from telebot.apihelper import ApiTelegramException
+from telebot.asyncio_helper import ApiTelegramException as AsyncApiTelegramException
+
+# === Очередь исходящих запросов к Telegram ===
+# Лимиты Bot API: ~30 сообщений/с на бота и ~1 сообщение/с в один чат.
+# Запросы раскладываются по очередям чатов; воркеры берут чат, у которого
+# раньше всех освобождается токен, так что один «шумный» чат не тормозит
+# остальные. Повторяющиеся запросы (правка одного и того же сообщения)
+# схлопываются, 429 повторяется через retry_after от сервера — и на это
+# время встаёт вся отправка: Telegram ограничивает бота целиком.
+# Корутины AsyncTeleBot (async_main.py) идут через submit_async — в те же
+# очереди и ведра; воркер выполняет их в цикле событий и ждёт результата.
+GLOBAL_RATE = 30.0
+CHAT_RATE = 1.0
+CHAT_BURST = 3
+MAX_RETRIES = 3
+PRUNE_EVERY_SEC = 60
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "stamp")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.stamp = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def delay(self, now) -> float:
+        # сколько секунд ждать до свободного токена
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ("fn", "args", "kwargs", "key", "future", "attempts", "callbacks")
+
+    def __init__(self, fn, args, kwargs, key):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.future = Future()
+        self.attempts = 0
+        self.callbacks = []     # on_done, уже повешенные на future
+
+    def on_done(self, fn):
+        # схлопнутые submit отдают один future: один и тот же колбэк вешаем один раз
+        if fn is not None and fn not in self.callbacks:
+            self.callbacks.append(fn)
+            self.future.add_done_callback(fn)
+
+
+class _Chat:
+    __slots__ = ("jobs", "keys", "bucket", "busy", "queued", "hold_until")
+
+    def __init__(self, rate, burst):
+        self.jobs = deque()
+        self.keys = {}          # coalesce_key -> ожидающий _Job
+        self.bucket = TokenBucket(rate, burst)
+        self.busy = False       # чат сейчас обрабатывает воркер
+        self.queued = False     # чат лежит в куче готовности
+        self.hold_until = 0.0   # пауза после 429
+
+
+def _on_loop(loop, coro_fn):
+    # вызов корутины из потока воркера: выполняется в loop, воркер ждёт её, как обычный запрос
+    @functools.wraps(coro_fn)
+    def call(*args, **kwargs):
+        return asyncio.run_coroutine_threadsafe(coro_fn(*args, **kwargs), loop).result()
+    return call
+
+
+class Outbox:
+    def __init__(self, workers=4, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE,
+                 chat_burst=CHAT_BURST, max_retries=MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._global_hold = 0.0   # пауза всей отправки после 429
+        self._chats = {}
+        self._ready = []        # (время готовности, seq, chat_id)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._last_prune = time.monotonic()
+        self.stats = {"sent": 0, "failed": 0, "retried": 0, "coalesced": 0}
+        self._workers = [
+            threading.Thread(target=self._run, name=f"sharkan-outbox-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for t in self._workers:
+            t.start()
+
+    # --- публичный API ---
+    def submit(self, chat_id, fn, /, *args, coalesce_key=None, on_done=None, **kwargs) -> Future:
+        # on_done(future) — как add_done_callback, но без дублей при схлопывании
+        with self._cond:
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                chat = self._chats[chat_id] = _Chat(self.chat_rate, self.chat_burst)
+            if coalesce_key is not None:
+                pending = chat.keys.get(coalesce_key)
+                if pending is not None:
+                    # ещё не отправлено — просто подменяем аргументы на свежие
+                    pending.args, pending.kwargs = args, kwargs
+                    self.stats["coalesced"] += 1
+                    pending.on_done(on_done)
+                    return pending.future
+            job = _Job(fn, args, kwargs, coalesce_key)
+            job.on_done(on_done)
+            chat.jobs.append(job)
+            if coalesce_key is not None:
+                chat.keys[coalesce_key] = job
+            self._schedule(chat_id, chat, time.monotonic())
+        return job.future
+
+    def call(self, chat_id, fn, /, *args, **kwargs):
+        # синхронный вариант для хендлеров, которым нужен результат (message_id)
+        return self.submit(chat_id, fn, *args, **kwargs).result()
+
+    def submit_async(self, loop, chat_id, coro_fn, /, *args, **kwargs) -> asyncio.Future:
+        # coro_fn — метод AsyncTeleBot; ждать результата: await outbox.submit_async(...)
+        future = self.submit(chat_id, _on_loop(loop, coro_fn), *args, **kwargs)
+        return asyncio.wrap_future(future, loop=loop)
+
+    def pending(self) -> int:
+        with self._cond:
+            return sum(len(c.jobs) for c in self._chats.values())
+
+    # --- внутреннее ---
+    def _schedule(self, chat_id, chat, now):
+        if chat.busy or chat.queued or not chat.jobs:
+            return
+        ready_at = max(now + chat.bucket.delay(now), chat.hold_until)
+        heapq.heappush(self._ready, (ready_at, next(self._seq), chat_id))
+        chat.queued = True
+        self._cond.notify()
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if not self._ready:
+                    self._cond.wait()
+                    continue
+                wait = max(self._ready[0][0] - now, self._global.delay(now), self._global_hold - now)
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                _, _, chat_id = heapq.heappop(self._ready)
+                chat = self._chats[chat_id]
+                chat.queued = False
+                job = chat.jobs.popleft()
+                if job.key is not None:
+                    chat.keys.pop(job.key, None)
+                chat.busy = True
+                self._global.take(now)
+                chat.bucket.take(now)
+                return chat_id, chat, job
+
+    def _run(self):
+        while True:
+            chat_id, chat, job = self._next_job()
+            retry_after = None
+            try:
+                result = job.fn(*job.args, **job.kwargs)
+            except (ApiTelegramException, AsyncApiTelegramException) as e:
+                if e.error_code == 429 and job.attempts < self.max_retries:
+                    params = (e.result_json or {}).get("parameters") or {}
+                    retry_after = float(params.get("retry_after", 1))
+                elif e.error_code == 400 and "message is not modified" in str(e):
+                    self._done(job, None)
+                else:
+                    self._fail(job, e)
+            except Exception as e:
+                self._fail(job, e)
+            else:
+                self._done(job, result)
+
+            with self._cond:
+                now = time.monotonic()
+                chat.busy = False
+                if retry_after is not None:
+                    job.attempts += 1
+                    self.stats["retried"] += 1
+                    chat.hold_until = now + retry_after
+                    if now + retry_after > self._global_hold:
+                        self._global_hold = now + retry_after
+                        logging.warning(f"[OUTBOX_429] пауза отправки на {retry_after:.1f}s")
+                    chat.jobs.appendleft(job)
+                    if job.key is not None:
+                        chat.keys.setdefault(job.key, job)
+                self._schedule(chat_id, chat, now)
+                if retry_after is not None:
+                    self._cond.notify_all()   # ждущие воркеры пересчитают паузу
+                if now - self._last_prune > PRUNE_EVERY_SEC:
+                    self._prune(now)
+
+    def _done(self, job, result):
+        self.stats["sent"] += 1
+        job.future.set_result(result)
+
+    def _fail(self, job, exc):
+        self.stats["failed"] += 1
+        logging.warning(f"[OUTBOX_ERROR] {getattr(job.fn, '__name__', job.fn)}: {exc}")
+        job.future.set_exception(exc)
+
+    def _prune(self, now):
+        # забываем чаты без очереди, у которых ведро уже снова полное
+        self._last_prune = now
+        idle = [cid for cid, c in self._chats.items()
+                if not c.jobs and not c.busy and c.bucket.full(now) and c.hold_until <= now]
+        for cid in idle:
+            del self._chats[cid]
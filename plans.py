@@ -0,0 +1,233 @@
+# plans.py
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+from types import MappingProxyType
+
+from run_stats import day_of
+
+# === План на день ===
+# Шаблоны (plans.json): цель × уровень × язык × пол — упражнения, питание,
+# калории. Уровень берётся из минут бега за последние 4 недели, неделя
+# 4-недельного цикла (база, наращивание, пик, разгрузка) — от первой пробежки.
+# Текст плана зависит только от (язык, цель, пол, вес, уровень, неделя),
+# поэтому рендерится один раз на такой набор и делится между пользователями;
+# у пользователя план на день кэшируется по версии профиля. Ночью планы
+# активных пользователей на завтра рендерятся заранее.
+PLANS_FILE = "plans.json"
+PLAN_PRERENDER_AT = os.getenv("PLAN_PRERENDER_AT", "23:30")   # пусто — без ночного прогона
+PLAN_ACTIVE_DAYS = int(os.getenv("PLAN_ACTIVE_DAYS", "14"))
+LEVEL_WINDOW = 28
+DEFAULT_GOAL = "maintain"
+DEFAULT_WEIGHT = 70
+UNAVAILABLE = {"ua": "План тимчасово недоступний.", "ru": "План временно недоступен.",
+               "en": "The plan is temporarily unavailable."}
+
+
+class PlanTemplates:
+    __slots__ = ("labels", "levels", "phases", "exercises", "goals")
+
+    def __init__(self, labels, levels, phases, exercises, goals):
+        self.labels = labels          # lang -> подписи
+        self.levels = levels          # ((уровень, max_minutes, {lang: имя}), ...) по возрастанию
+        self.phases = phases          # недели цикла: ({"load": .., lang: имя}, ...)
+        self.exercises = exercises    # код -> {lang: название}
+        self.goals = goals            # цель -> {"kcal", "workouts": {уровень: [...]}, "meals": {lang: [...]}}
+
+    def level_for(self, minutes: int) -> str:
+        for name, limit, _ in self.levels:
+            if limit is None or minutes < limit:
+                return name
+        return self.levels[-1][0]
+
+    def render(self, lang, goal, gender, weight, level, week) -> str:
+        labels = self.labels.get(lang) or self.labels["ua"]
+        plan = self.goals.get(goal) or self.goals.get(DEFAULT_GOAL) or next(iter(self.goals.values()))
+        phase = self.phases[week % len(self.phases)]
+        workout, n = [], 0
+        for item in plan["workouts"].get(level, ()):
+            if item.get("gender") not in (None, gender):
+                continue
+            n += 1
+            workout.append(f"{n}) {self._exercise(item, lang, labels, phase['load'])}")
+        meals = plan["meals"].get(lang) or plan["meals"].get("ua", ())
+        kcal = max(plan["kcal"]["min"], plan["kcal"]["per_kg"] * weight)
+        level_name = next(names for name, _, names in self.levels if name == level)
+        week_line = labels["week"].format(week=week % len(self.phases) + 1, weeks=len(self.phases),
+                                          phase=phase.get(lang, phase.get("ua", "")),
+                                          level=level_name.get(lang, level_name.get("ua", level)))
+        return (f"{labels['title']}\n<i>{week_line}</i>\n\n<b>{labels['workout']}</b>:\n" + "\n".join(workout) +
+                f"\n\n<b>{labels['meals']}</b>:\n- " + "\n- ".join(meals) +
+                f"\n\n<b>{labels['kcal']}</b>: ~{kcal} {labels['kcal_unit']}\n"
+                f"{labels['water'].format(liters=round(weight * 0.03, 1))}\n{labels['supps']}")
+
+    def _exercise(self, item, lang, labels, load):
+        names = self.exercises[item["ex"]]
+        sets = f"{item['sets']}×" if item.get("sets") else ""
+        if "reps" in item:
+            amount = f"{sets}{max(1, round(item['reps'] * load))}" + (labels["per_leg"] if item.get("per_leg") else "")
+        elif "sec" in item:
+            amount = f"{sets}{max(5, round(item['sec'] * load / 5) * 5)}{labels['sec']}"
+        else:
+            amount = f"{max(1, round(item['min'] * load))} {labels['min']}"
+        rest = f" ({item['rest']}{labels['sec']})" if item.get("rest") else ""
+        note = f" {labels[item['note']]}" if item.get("note") else ""
+        return f"{names.get(lang) or names['ua']} — {amount}{rest}{note}"
+
+
+def parse_templates(raw) -> PlanTemplates:
+    if not isinstance(raw, dict):
+        raise ValueError("plans: ожидается объект")
+    labels, exercises, goals = raw.get("labels"), raw.get("exercises"), raw.get("goals")
+    if not isinstance(labels, dict) or "ua" not in labels:
+        raise ValueError("plans.labels: нужны подписи хотя бы для ua")
+    if not isinstance(exercises, dict) or not isinstance(goals, dict) or not goals:
+        raise ValueError("plans: нужны exercises и goals")
+    levels = tuple((name, spec.get("max_minutes"), MappingProxyType(spec))
+                   for name, spec in (raw.get("levels") or {}).items())
+    phases = tuple(MappingProxyType(p) for p in raw.get("periodization") or ())
+    if not levels or not phases:
+        raise ValueError("plans: нужны levels и periodization")
+    for goal, plan in goals.items():
+        for level, _, _ in levels:
+            for item in plan.get("workouts", {}).get(level, ()):
+                if item.get("ex") not in exercises:
+                    raise ValueError(f"plans.goals[{goal}][{level}]: неизвестное упражнение {item.get('ex')}")
+                if not any(k in item for k in ("reps", "sec", "min")):
+                    raise ValueError(f"plans.goals[{goal}][{level}]: {item['ex']} без объёма")
+        if not isinstance(plan.get("kcal"), dict) or not isinstance(plan.get("meals"), dict):
+            raise ValueError(f"plans.goals[{goal}]: нужны kcal и meals")
+    return PlanTemplates(MappingProxyType(labels), levels, phases, MappingProxyType(exercises),
+                         MappingProxyType(goals))
+
+
+def _weight(profile) -> int:
+    try:
+        return int(profile.get("weight") or DEFAULT_WEIGHT)
+    except (TypeError, ValueError):
+        return DEFAULT_WEIGHT
+
+
+class PlanEngine:
+    def __init__(self, profiles, index, source):
+        self.profiles = profiles      # uid -> профиль (ProfileCache)
+        self.index = index            # RunHistoryIndex
+        self.source = source          # () -> ContentSnapshot с .version и .plans
+        self._plans = {}              # (uid, день) -> (версия, текст)
+        self._texts = {}              # сигнатура -> текст, общий для одинаковых профилей
+        self._texts_version = None
+        self._seen = {}               # uid -> день последнего запроса плана
+        self._day = None              # последний день, который видел today()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stats = {"hit": 0, "miss": 0, "rendered": 0, "prerendered": 0}
+
+    def version(self, uid, day, snapshot):
+        # всё, от чего зависит план на день: контент, поля профиля, пробежки до этого дня
+        prof = self.profiles.get(uid) or {}
+        stats = self.index.get(uid)
+        runs = bisect_left(stats.days, day) if stats is not None else 0
+        return (snapshot.version, prof.get("language", "ua"), prof.get("goal") or DEFAULT_GOAL,
+                prof.get("gender") or "male", _weight(prof), runs)
+
+    def today(self, uid, when: date = None) -> str:
+        day = day_of(when or date.today())
+        if self._day is None or day > self._day:
+            # наступил новый день: без ночного прогона (PLAN_PRERENDER_AT="") чистим здесь
+            if self._day is not None:
+                self.forget_before(day)
+            self._day = day
+        self._seen[uid] = day
+        return self._plan(uid, day)
+
+    def _plan(self, uid, day) -> str:
+        snapshot = self.source()
+        if snapshot is None or snapshot.plans is None:
+            lang = (self.profiles.get(uid) or {}).get("language", "ua")
+            return UNAVAILABLE.get(lang, UNAVAILABLE["ua"])
+        version = self.version(uid, day, snapshot)
+        cached = self._plans.get((uid, day))
+        if cached is not None and cached[0] == version:
+            self.stats["hit"] += 1
+            return cached[1]
+        self.stats["miss"] += 1
+        text = self._render(snapshot, version, uid, day)
+        self._plans[(uid, day)] = (version, text)
+        return text
+
+    def _render(self, snapshot, version, uid, day) -> str:
+        templates = snapshot.plans
+        _, lang, goal, gender, weight, _ = version
+        stats = self.index.get(uid)
+        minutes, week = 0, 0
+        if stats is not None and stats.days and stats.days[0] < day:
+            minutes = stats.minutes_between(day - LEVEL_WINDOW, day)
+            week = (day - stats.days[0]) // 7 % len(templates.phases)
+        signature = (lang, goal, gender, weight, templates.level_for(minutes), week)
+        with self._lock:
+            if self._texts_version != snapshot.version:
+                self._texts, self._texts_version = {}, snapshot.version
+            text = self._texts.get(signature)
+            if text is None:
+                text = self._texts[signature] = templates.render(*signature)
+                self.stats["rendered"] += 1
+        return text
+
+    def __len__(self):
+        return len(self._plans)
+
+    # --- ночной прогон ---
+    def prerender(self, uids, when: date) -> int:
+        day = day_of(when)
+        done = 0
+        for uid in uids:
+            if self.profiles.get(uid) is None:
+                continue
+            self._plan(uid, day)
+            done += 1
+        self.stats["prerendered"] += done
+        return done
+
+    def forget_before(self, day: int):
+        # планы прошлых дней и давно не заходившие пользователи
+        for key in [k for k in list(self._plans) if k[1] < day]:
+            self._plans.pop(key, None)
+        for uid, seen in list(self._seen.items()):
+            if seen < day - PLAN_ACTIVE_DAYS:
+                self._seen.pop(uid, None)
+
+    def nightly(self, extra_users=lambda day: ()):
+        # extra_users(day) — кого ещё считать активным (например, бегавших недавно)
+        today = date.today()
+        tomorrow = today + timedelta(days=1)
+        started = time.perf_counter()
+        self.forget_before(day_of(today))
+        users = set(self._seen)
+        users.update(extra_users(day_of(today)))
+        done = self.prerender(users, tomorrow)
+        logging.info(f"[PLAN_PRERENDER] {done} планов на {tomorrow} за {(time.perf_counter() - started) * 1000:.0f}ms")
+        return done
+
+    def start_nightly(self, extra_users=lambda day: (), at=PLAN_PRERENDER_AT):
+        if not at or self._thread is not None:
+            return
+        hour, minute = (int(x) for x in at.split(":"))
+        self._thread = threading.Thread(target=self._nightly_loop, args=(extra_users, hour, minute),
+                                        name="sharkan-plans", daemon=True)
+        self._thread.start()
+
+    def _nightly_loop(self, extra_users, hour, minute):
+        stop = threading.Event()
+        while True:
+            now = datetime.now()
+            due = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if due <= now:
+                due += timedelta(days=1)
+            stop.wait((due - now).total_seconds())
+            try:
+                self.nightly(extra_users)
+            except Exception as e:
+                logging.error(f"[PLAN_PRERENDER_ERROR] {e}")
@@ -0,0 +1,104 @@
+# profile_writer.py
+import json
+import logging
+import os
+import threading
+import time
+
+# === Отложенная запись профилей (write-behind) ===
+# Хендлер только помечает профиль изменённым и сразу отвечает пользователю.
+# Фоновый поток собирает изменения и пишет их одной транзакцией — раз в
+# FLUSH_MS миллисекунд или сразу, как накопилось FLUSH_MAX профилей.
+# При остановке (SIGTERM / выход) остаток сбрасывается синхронно.
+FLUSH_MS = int(os.getenv("PROFILE_FLUSH_MS", "500"))
+FLUSH_MAX = int(os.getenv("PROFILE_FLUSH_MAX", "200"))
+
+
+class ProfileWriter:
+    def __init__(self, storage, profiles, flush_ms=FLUSH_MS, flush_max=FLUSH_MAX):
+        self.storage = storage
+        self.profiles = profiles          # callable -> актуальный dict {user_id: profile}
+        self.flush_ms = flush_ms
+        self.flush_max = flush_max
+        self._dirty = set()
+        self._writing = set()             # пачка, которая сейчас пишется
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()   # один сброс за раз
+        self._thread = None
+        self._stopped = False
+        self.stats = {
+            "marked": 0, "flushes": 0, "written": 0, "errors": 0,
+            "last_batch": 0, "max_batch": 0,
+            "last_ms": 0.0, "max_ms": 0.0, "total_ms": 0.0
+        }
+
+    def mark(self, user_id: str):
+        with self._cond:
+            self._dirty.add(user_id)
+            self.stats["marked"] += 1
+            if len(self._dirty) >= self.flush_max:
+                self._cond.notify()
+
+    def pending(self) -> int:
+        return len(self._dirty)
+
+    def dirty(self, user_id) -> bool:
+        # изменения профиля ещё не в базе (ProfileCache не вытесняет такие)
+        return user_id in self._dirty or user_id in self._writing
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._cond:
+                batch, self._dirty = self._dirty, set()
+                self._writing = batch
+            if not batch:
+                return 0
+            started = time.perf_counter()
+            try:
+                profiles = self.profiles()
+                # копия под json: хендлеры могут менять профиль во время записи
+                rows = [(uid, json.loads(json.dumps(profiles.get(uid, {}), ensure_ascii=False)))
+                        for uid in batch]
+                self.storage.upsert_profiles(rows)
+            except Exception as e:
+                with self._cond:
+                    self._dirty |= batch      # повторим при следующем сбросе
+                self.stats["errors"] += 1
+                logging.error(f"[PROFILE_FLUSH_ERROR] {len(batch)} profiles: {e}")
+                return 0
+            finally:
+                with self._cond:
+                    self._writing = set()
+            ms = (time.perf_counter() - started) * 1000
+            st = self.stats
+            st["flushes"] += 1
+            st["written"] += len(batch)
+            st["last_batch"] = len(batch)
+            st["max_batch"] = max(st["max_batch"], len(batch))
+            st["last_ms"] = ms
+            st["max_ms"] = max(st["max_ms"], ms)
+            st["total_ms"] += ms
+            return len(batch)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sharkan-profiles", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        # финальный сброс; после него mark() всё ещё работает, но пишет только flush()
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopped and len(self._dirty) < self.flush_max:
+                    self._cond.wait(self.flush_ms / 1000)
+                if self._stopped:
+                    return
+            self.flush()
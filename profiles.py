@@ -0,0 +1,117 @@
+# profiles.py
+import threading
+import time
+from collections import OrderedDict
+
+# === Ленивый кэш профилей ===
+# Раньше при старте в память читались все профили (и по ним строился
+# user_lang) — время старта росло с базой. Теперь профиль читается из SQLite
+# при первом обращении пользователя и дальше живёт в памяти; язык берётся
+# из профиля. Снаружи это обычный dict: get / setdefault / [] / in.
+# Загруженные профили — LRU с TTL, как сессии: давно не трогавшие и лишние
+# сверх PROFILE_MAX вытесняются, кроме ещё не записанных (pinned — их держит
+# фоновый писатель). Промахи (профиля нет в базе) помнятся в маленьком LRU с TTL.
+PROFILE_MAX = 100_000
+PROFILE_TTL_SEC = 24 * 3600
+ABSENT_MAX = 50_000
+ABSENT_TTL_SEC = 600
+
+
+class ProfileCache(dict):
+    def __init__(self, storage, owns=lambda uid: True, pinned=lambda uid: False,
+                 max_size=PROFILE_MAX, ttl=PROFILE_TTL_SEC):
+        super().__init__()
+        self.storage = storage
+        self.owns = owns          # в шардированном режиме — только свои пользователи
+        self.pinned = pinned      # uid -> профиль ждёт записи, вытеснять нельзя
+        self.max_size = max_size
+        self.ttl = ttl
+        self._touched = OrderedDict()  # uid -> последнее обращение; от старых к свежим
+        self._absent = OrderedDict()   # uid -> когда не нашли в базе; от старых к свежим
+        self._lock = threading.Lock()
+
+    def _touch(self, uid):
+        if dict.__contains__(self, uid):
+            with self._lock:
+                self._touched[uid] = time.monotonic()
+                self._touched.move_to_end(uid)
+
+    def _evict(self, now):
+        # под self._lock; проверяем не больше, чем есть записей
+        limit = now - self.ttl
+        for _ in range(len(self._touched)):
+            uid, touched = next(iter(self._touched.items()))
+            if len(self._touched) <= self.max_size and touched >= limit:
+                break
+            if self.pinned(uid):
+                # не записан — остаётся до следующего прохода
+                self._touched[uid] = now
+                self._touched.move_to_end(uid)
+                continue
+            del self._touched[uid]
+            dict.pop(self, uid, None)
+
+    def _known_absent(self, uid) -> bool:
+        missed = self._absent.get(uid)
+        if missed is None:
+            return False
+        if time.monotonic() - missed < ABSENT_TTL_SEC:
+            return True
+        with self._lock:
+            self._absent.pop(uid, None)
+        return False
+
+    def _fetch(self, uid):
+        if self.loaded(uid):
+            return
+        profile = self.storage.load_profile(uid)
+        with self._lock:
+            now = time.monotonic()
+            self._evict(now)
+            if profile is not None:
+                dict.setdefault(self, uid, profile)   # не затираем профиль, созданный параллельно
+                self._touched[uid] = now
+                self._touched.move_to_end(uid)
+            elif not dict.__contains__(self, uid):
+                self._absent[uid] = time.monotonic()
+                self._absent.move_to_end(uid)
+                while len(self._absent) > ABSENT_MAX:
+                    self._absent.popitem(last=False)
+
+    def __missing__(self, uid):
+        self._fetch(uid)
+        if dict.__contains__(self, uid):
+            return dict.__getitem__(self, uid)
+        raise KeyError(uid)
+
+    def __contains__(self, uid):
+        self._fetch(uid)
+        self._touch(uid)
+        return dict.__contains__(self, uid)
+
+    def get(self, uid, default=None):
+        self._fetch(uid)
+        self._touch(uid)
+        return dict.get(self, uid, default)
+
+    def setdefault(self, uid, default=None):
+        self._fetch(uid)
+        with self._lock:
+            self._absent.pop(uid, None)
+            self._touched[uid] = time.monotonic()
+            self._touched.move_to_end(uid)
+            return dict.setdefault(self, uid, default)
+
+    def __setitem__(self, uid, profile):
+        with self._lock:
+            self._absent.pop(uid, None)
+            self._touched[uid] = time.monotonic()
+            self._touched.move_to_end(uid)
+            dict.__setitem__(self, uid, profile)
+
+    def loaded(self, uid) -> bool:
+        # ответ известен без базы: профиль в памяти, отмеченный промах или чужой шард
+        return dict.__contains__(self, uid) or self._known_absent(uid) or not self.owns(uid)
+
+    def language(self, uid, default="ua"):
+        return (self.get(uid) or {}).get("language", default)
@@ -0,0 +1,127 @@
+# rotation.py
+import random
+import threading
+from array import array
+
+# === Ротация фраз без повторов ===
+# У пользователя своя перетасованная «колода»: пока не показаны все фразы,
+# ни одна не повторяется. Сама колода не хранится — позиция в перестановке
+# вычисляется сетью Фейстеля по (seed, номер), поэтому курсор в профиле —
+# три числа [seed, номер, размер колоды] при любом числе фраз, а выбор —
+# O(1). Вес фразы — сколько мест она занимает в колоде (0 — не показывать),
+# теги goal / gender отбирают фразы под профиль. Тексты сообщений рендерятся
+# один раз на снимок контента и язык.
+_MASK64 = (1 << 64) - 1
+_ROUNDS = 4
+MAX_WEIGHT = 100
+
+
+def _mix(x: int) -> int:
+    # splitmix64
+    x = (x + 0x9E3779B97F4A7C15) & _MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return x ^ (x >> 31)
+
+
+def permute(i: int, n: int, seed: int) -> int:
+    # биекция [0, n) -> [0, n): Фейстель на 2^k >= n, лишние значения проходим дальше
+    if n <= 1:
+        return 0
+    bits = max(2, (n - 1).bit_length())
+    bits += bits & 1
+    half = bits // 2
+    mask = (1 << half) - 1
+    keys = [_mix(seed ^ (r << 56)) for r in range(_ROUNDS)]
+    x = i
+    while True:
+        left, right = x >> half, x & mask
+        for k in keys:
+            left, right = right, left ^ ((((right ^ k) * 0x9E3779B97F4A7C15) & _MASK64) >> 40 & mask)
+        x = (left << half) | right
+        if x < n:
+            return x
+
+
+def _matches(entry, goal, gender) -> bool:
+    if isinstance(entry, str):
+        return True
+    for key, value in (("goal", goal), ("gender", gender)):
+        want = entry.get(key)
+        if want is not None and value not in (want if isinstance(want, (list, tuple)) else (want,)):
+            return False
+    return True
+
+
+def _weight(entry) -> int:
+    if isinstance(entry, str):
+        return 1
+    try:
+        return max(0, min(MAX_WEIGHT, int(entry.get("weight", 1))))
+    except (TypeError, ValueError):
+        return 1
+
+
+class Deck:
+    __slots__ = ("texts", "slots")
+
+    def __init__(self, texts, weights):
+        self.texts = tuple(texts)
+        self.slots = array("I")           # место в колоде -> номер текста
+        for i, w in enumerate(weights):
+            self.slots.extend([i] * w)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def at(self, pos: int, seed: int) -> int:
+        return self.slots[permute(pos, len(self.slots), seed)]
+
+
+class Rotation:
+    def __init__(self, name, entries, render):
+        self.name = name          # ключ курсора в profile["rotation"]
+        self.entries = entries    # (snapshot, lang) -> фразы / тренеры
+        self.render = render      # (entry, lang) -> текст сообщения
+        self._decks = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def deck(self, snapshot, lang, goal, gender) -> Deck:
+        key = (lang, goal, gender)
+        with self._lock:
+            if self._version != snapshot.version:
+                self._decks, self._version = {}, snapshot.version
+            deck = self._decks.get(key)
+            if deck is None:
+                entries = self.entries(snapshot, lang)
+                picked = [e for e in entries if _matches(e, goal, gender)] or list(entries)
+                texts = {}                # одинаковые тексты — одна фраза, а не повтор в колоде
+                for e in picked:
+                    text = self.render(e, lang)
+                    texts[text] = max(texts.get(text, 0), _weight(e))
+                texts = {t: w for t, w in texts.items() if w}
+                deck = self._decks[key] = Deck(texts, texts.values())
+        return deck
+
+    def next(self, snapshot, profile: dict):
+        # следующая фраза для профиля; курсор обновляется в profile["rotation"]
+        deck = self.deck(snapshot, profile.get("language", "ua"), profile.get("goal"), profile.get("gender"))
+        n = len(deck)
+        if not n:
+            return None
+        cursors = profile.setdefault("rotation", {})
+        seed, pos, size = cursors.get(self.name) or (0, 0, 0)
+        if size != n:
+            seed, pos = random.getrandbits(63), 0          # контент изменился — новая колода
+        elif pos >= n:
+            # следующий круг: новая перестановка, и не с той фразы, что была последней
+            last = deck.at(n - 1, seed)
+            seed = _mix(seed) >> 1
+            for _ in range(16):
+                if n == 1 or deck.at(0, seed) != last:
+                    break
+                seed = _mix(seed) >> 1
+            pos = 0
+        cursors[self.name] = [seed, pos + 1, n]
+        return deck.texts[deck.at(pos, seed)]
@@ -0,0 +1,66 @@
+# router.py
+
+# === Маршрутизация текстовых сообщений ===
+# Вместо цепочки lambda-фильтров (каждый апдейт проверялся всеми по очереди)
+# тексты кнопок нормализуются один раз при регистрации и лежат в словаре:
+# поиск хендлера — O(1) независимо от числа разделов. Если текст не кнопка,
+# пробуем префиксные маршруты и затем «состояния» (ввод страницы, анкета).
+
+
+def normalize(text: str) -> str:
+    return text.strip().lower()
+
+
+class TextRouter:
+    def __init__(self):
+        self._exact = {}
+        self._prefixes = []    # (префикс, хендлер) — их единицы, порядок важен
+        self._fallbacks = []   # (предикат, хендлер) — проверяются по порядку
+
+    def route(self, *texts):
+        def decorator(fn):
+            for text in texts:
+                key = normalize(text)
+                if key in self._exact and self._exact[key] is not fn:
+                    raise ValueError(f"Кнопка {text!r} уже привязана к {self._exact[key].__name__}")
+                self._exact[key] = fn
+            return fn
+        return decorator
+
+    def prefix(self, prefix):
+        def decorator(fn):
+            self._prefixes.append((prefix, fn))
+            return fn
+        return decorator
+
+    def fallback(self, predicate):
+        def decorator(fn):
+            self._fallbacks.append((predicate, fn))
+            return fn
+        return decorator
+
+    def resolve(self, message):
+        text = message.text or ""
+        handler = self._exact.get(normalize(text))
+        if handler:
+            return handler
+        for prefix, fn in self._prefixes:
+            if text.startswith(prefix):
+                return fn
+        for predicate, fn in self._fallbacks:
+            if predicate(message):
+                return fn
+        return None
+
+    def wrap(self, wrapper):
+        # обернуть все хендлеры (метрики); wrapper(fn) -> fn
+        self._exact = {k: wrapper(fn) for k, fn in self._exact.items()}
+        self._prefixes = [(p, wrapper(fn)) for p, fn in self._prefixes]
+        self._fallbacks = [(pred, wrapper(fn)) for pred, fn in self._fallbacks]
+
+    def dispatch(self, message) -> bool:
+        handler = self.resolve(message)
+        if handler is None:
+            return False
+        handler(message)
+        return True
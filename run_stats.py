@@ -0,0 +1,220 @@
+# run_stats.py
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+from functools import lru_cache
+
+from storage import DB_FILE
+
+# === Индекс истории пробежек в памяти ===
+# Колоночное хранение: у пользователя три массива — день (число дней от
+# 1970-01-01), минуты и калории, упорядоченные по дню. Это 12 байт на
+# пробежку вместо словаря со строкой даты, а суммы, серии и окна рейтинга
+# считаются срезами массивов и bisect без разбора дат. Снимок индекса
+# хранится в бинарном файле (RUNS_SNAPSHOT): колонки лежат в нём подряд и
+# читаются через mmap, из базы при старте дочитываются только новые пробежки.
+LAST_RUNS = 3
+RUNS_SNAPSHOT = os.getenv("RUNS_SNAPSHOT", DB_FILE + ".runs")
+_EPOCH = date(1970, 1, 1).toordinal()
+_TYPE = "I" if array("I").itemsize == 4 else "L"
+_MAGIC = b"SHRKRUN1"
+_HEADER = struct.Struct("<8sqqI")      # magic, last_id, count, длина JSON-оглавления
+
+
+@lru_cache(maxsize=4096)
+def to_day(value: str) -> int:
+    # "YYYY-MM-DD" -> номер дня; дат в истории немного, поэтому кэш
+    try:
+        return date.fromisoformat(value).toordinal() - _EPOCH
+    except (TypeError, ValueError):
+        return 0
+
+
+def from_day(day: int) -> str:
+    return date.fromordinal(day + _EPOCH).isoformat()
+
+
+def day_of(d: date) -> int:
+    return d.toordinal() - _EPOCH
+
+
+class UserRunStats:
+    __slots__ = ("days", "durations", "kcal", "minutes", "calories")
+
+    def __init__(self, days=None, durations=None, kcal=None):
+        self.days = days if days is not None else array(_TYPE)
+        self.durations = durations if durations is not None else array(_TYPE)
+        self.kcal = kcal if kcal is not None else array(_TYPE)
+        self.minutes = sum(self.durations)     # итоги держим готовыми — экран статистики их не считает
+        self.calories = sum(self.kcal)
+
+    def add(self, day: int, minutes: int, calories: int):
+        # пробежки почти всегда приходят по порядку — тогда это append
+        self.minutes += minutes
+        self.calories += calories
+        i = bisect_right(self.days, day)
+        if i == len(self.days):
+            self.days.append(day)
+            self.durations.append(minutes)
+            self.kcal.append(calories)
+        else:
+            self.days.insert(i, day)
+            self.durations.insert(i, minutes)
+            self.kcal.insert(i, calories)
+
+    @property
+    def runs(self) -> int:
+        return len(self.days)
+
+    @property
+    def last(self) -> list:
+        # последние пробежки в виде записей истории (старые -> новые)
+        n = len(self.days)
+        return [{"date": from_day(self.days[i]), "duration_min": self.durations[i], "calories": self.kcal[i]}
+                for i in range(max(0, n - LAST_RUNS), n)]
+
+    def minutes_between(self, start: int, end: int) -> int:
+        # минуты за дни [start, end)
+        return sum(self.durations[bisect_left(self.days, start):bisect_left(self.days, end)])
+
+    def streak(self, today: date = None) -> int:
+        # от сегодняшнего дня назад, пока дни идут подряд
+        cur = day_of(today or date.today())
+        i = bisect_right(self.days, cur) - 1
+        streak = 0
+        while i >= 0 and self.days[i] == cur:
+            streak += 1
+            cur -= 1
+            i = bisect_right(self.days, cur, 0, i) - 1
+        return streak
+
+
+class RunHistoryIndex:
+    def __init__(self):
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(s.days) for s in list(self._users.values()))
+
+    def clear(self):
+        with self._lock:
+            self._users = {}
+
+    def add(self, user_id: str, record: dict) -> UserRunStats:
+        return self.add_run(user_id, to_day(record.get("date", "")), int(record.get("duration_min", 0)),
+                            int(record.get("calories", 0)))
+
+    def add_run(self, user_id: str, day: int, minutes: int, calories: int) -> UserRunStats:
+        with self._lock:
+            stats = self._users.get(user_id)
+            if stats is None:
+                stats = self._users[user_id] = UserRunStats()
+            stats.add(day, minutes, calories)
+        return stats
+
+    def extend(self, rows):
+        # rows — (user_id, date, duration_min, calories) в порядке id; новые
+        # пользователи собираются списками и превращаются в массивы разом
+        fresh = {}
+        with self._lock:
+            known = self._users
+            for uid, d, m, c in rows:
+                cols = fresh.get(uid)
+                if cols is None:
+                    stats = known.get(uid)
+                    if stats is not None:
+                        stats.add(to_day(d), m, c)
+                        continue
+                    cols = fresh[uid] = ([], [], [])
+                cols[0].append(to_day(d))
+                cols[1].append(m)
+                cols[2].append(c)
+            for uid, (days, mins, kcal) in fresh.items():
+                if any(days[i] > days[i + 1] for i in range(len(days) - 1)):
+                    days, mins, kcal = map(list, zip(*sorted(zip(days, mins, kcal), key=lambda r: r[0])))
+                self._users[uid] = UserRunStats(array(_TYPE, days), array(_TYPE, mins), array(_TYPE, kcal))
+
+    def get(self, user_id: str):
+        return self._users.get(user_id)
+
+    def minutes_between(self, start: int, end: int) -> dict:
+        # {user_id: минуты за дни [start, end)} — для окон рейтинга
+        out = {}
+        for uid, stats in list(self._users.items()):
+            days = stats.days
+            if not days or days[-1] < start or days[0] >= end:
+                continue
+            mins = stats.minutes_between(start, end)
+            if mins:
+                out[uid] = mins
+        return out
+
+    def totals(self) -> dict:
+        return {uid: s.minutes for uid, s in list(self._users.items()) if s.days}
+
+    # --- бинарный снимок ---
+    def save_snapshot(self, path, last_id, meta=None):
+        # оглавление (JSON) + три колонки uint32 подряд; запись атомарная
+        with self._lock:
+            users = [(uid, s) for uid, s in self._users.items() if s.days]
+            toc = dict(meta or {}, byteorder=sys.byteorder, users=[[uid, len(s.days)] for uid, s in users])
+            count = sum(n for _, n in toc["users"])
+            head = json.dumps(toc, ensure_ascii=False).encode("utf-8")
+            head += b" " * (-len(head) % 4)      # колонки выровнены по 4 байта
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, last_id, count, len(head)))
+                f.write(head)
+                for col in ("days", "durations", "kcal"):
+                    for _, s in users:
+                        getattr(s, col).tofile(f)
+        os.replace(tmp, path)
+        return count
+
+    def read_snapshot(self, path):
+        # -> (last_id, count, meta, users) или None; сам индекс не меняется
+        try:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, last_id, count, head_len = _HEADER.unpack_from(mm, 0)
+                if magic != _MAGIC:
+                    return None
+                toc = json.loads(bytes(mm[_HEADER.size:_HEADER.size + head_len]))
+                if toc.get("byteorder") != sys.byteorder:
+                    return None
+                base = _HEADER.size + head_len
+                size = count * 4
+                if len(mm) != base + 3 * size:
+                    return None
+                view, cols = memoryview(mm), []
+                try:
+                    cols = [view[base + k * size:base + (k + 1) * size] for k in range(3)]
+                    users, pos = {}, 0
+                    for uid, n in toc["users"]:
+                        parts = []
+                        for col in cols:
+                            a = array(_TYPE)
+                            a.frombytes(col[pos * 4:(pos + n) * 4])
+                            parts.append(a)
+                        users[uid] = UserRunStats(*parts)
+                        pos += n
+                finally:
+                    for col in cols:
+                        col.release()
+                    view.release()
+        except (OSError, ValueError, struct.error) as e:
+            if not isinstance(e, FileNotFoundError):
+                logging.error(f"[RUNS_SNAPSHOT_ERROR] {path}: {e}")
+            return None
+        return last_id, count, toc, users
+
+    def replace(self, users: dict):
+        with self._lock:
+            self._users = users
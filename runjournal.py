@@ -0,0 +1,155 @@
+# runjournal.py
+import logging
+import os
+import struct
+import threading
+import zlib
+from datetime import datetime, timedelta
+
+# === Журнал активных пробежек ===
+# running_timers живёт в памяти, поэтому каждое изменение сессии сначала
+# дописывается в маленький журнал (write-ahead): старт, id сообщения
+# таймера, финиш. Запись — фиксированные 42 байта с crc32, так что при
+# старте журнал разбирается struct.iter_unpack за миллисекунды даже для
+# 10k сессий, а оборванная при падении последняя запись просто отбрасывается.
+# Когда мёртвых записей становится много, журнал переписывается заново.
+RUN_JOURNAL = os.getenv("RUN_JOURNAL", "runs.journal")
+RUN_JOURNAL_FSYNC = os.getenv("RUN_JOURNAL_FSYNC", "0") not in ("", "0")
+COMPACT_MIN = 1024
+
+START, MESSAGE, STOP = 1, 2, 3
+_BODY = struct.Struct("<BxHqqqq2s")      # вид, вес, user, chat, старт (мкс), message_id, язык
+_RECORD = struct.Struct("<38sI")         # тело + crc32
+_EPOCH = datetime(1970, 1, 1)
+
+
+def to_us(moment: datetime) -> int:
+    return (moment - _EPOCH) // timedelta(microseconds=1)
+
+
+def from_us(us: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=us)
+
+
+class RunSession:
+    __slots__ = ("user_id", "chat_id", "start_us", "weight", "lang", "message_id")
+
+    def __init__(self, user_id, chat_id, start_us, weight, lang, message_id=0):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.start_us = start_us
+        self.weight = weight
+        self.lang = lang
+        self.message_id = message_id
+
+    @property
+    def start_time(self) -> datetime:
+        return from_us(self.start_us)
+
+
+class RunJournal:
+    def __init__(self, path=RUN_JOURNAL, fsync=RUN_JOURNAL_FSYNC):
+        self.path = path
+        self.fsync = fsync
+        self._live = {}          # user_id -> RunSession
+        self._records = 0        # записей в файле (живые + отменённые)
+        self._fd = None
+        self._lock = threading.Lock()
+
+    def recover(self) -> list:
+        # разбор журнала; возвращает живые сессии
+        live, records = {}, 0
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        usable = len(data) - len(data) % _RECORD.size
+        for body, crc in _RECORD.iter_unpack(memoryview(data)[:usable]):
+            if zlib.crc32(body) != crc:
+                logging.error(f"[RUN_JOURNAL_CORRUPT] {self.path}: запись {records}, дальше не читаем")
+                break
+            records += 1
+            kind, weight, uid, chat, start_us, mid, lang = _BODY.unpack(body)
+            uid = str(uid)
+            if kind == START:
+                live[uid] = RunSession(uid, chat, start_us, weight, lang.decode("ascii", "replace"), mid)
+            elif kind == MESSAGE and uid in live:
+                live[uid].message_id = mid
+            elif kind == STOP:
+                live.pop(uid, None)
+        with self._lock:
+            self._live = live
+            self._records = records
+            # переписываем сразу: хвост после сбоя и мёртвые записи уходят
+            self._compact()
+        return list(live.values())
+
+    def start(self, user_id, chat_id, start_time: datetime, weight, lang):
+        session = RunSession(str(user_id), chat_id, to_us(start_time), int(weight or 0), (lang or "ua")[:2])
+        with self._lock:
+            self._live[session.user_id] = session
+            self._append(START, session)
+
+    def message(self, user_id, message_id):
+        with self._lock:
+            session = self._live.get(str(user_id))
+            if session is None or session.message_id == (message_id or 0):
+                return
+            session.message_id = message_id or 0
+            self._append(MESSAGE, session)
+
+    def stop(self, user_id, start_time: datetime = None):
+        # start_time задан — закрываем только эту пробежку, а не начатую после неё
+        with self._lock:
+            session = self._live.get(str(user_id))
+            if session is None or (start_time is not None and session.start_us != to_us(start_time)):
+                return
+            del self._live[session.user_id]
+            self._append(STOP, session)
+            if self._records > max(COMPACT_MIN, 4 * len(self._live)):
+                self._compact()
+
+    def __len__(self):
+        return len(self._live)
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+    # --- файл ---
+    @staticmethod
+    def _pack(kind, s):
+        body = _BODY.pack(kind, min(s.weight, 0xFFFF), int(s.user_id), int(s.chat_id), s.start_us,
+                          int(s.message_id or 0), s.lang.encode("ascii", "replace")[:2])
+        return _RECORD.pack(body, zlib.crc32(body))
+
+    def _append(self, kind, session):
+        try:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            os.write(self._fd, self._pack(kind, session))
+            if self.fsync:
+                os.fsync(self._fd)
+            self._records += 1
+        except OSError as e:
+            logging.error(f"[RUN_JOURNAL_ERROR] {self.path}: {e}")
+
+    def _compact(self):
+        # живые сессии одной записью START каждая; замена файла атомарная
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(b"".join(self._pack(START, s) for s in self._live.values()))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logging.error(f"[RUN_JOURNAL_ERROR] compact {self.path}: {e}")
+            return
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._records = len(self._live)
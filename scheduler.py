@@ -0,0 +1,124 @@
+# scheduler.py
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+# === Общий планировщик таймеров ===
+# Один поток и одна куча на все активные таймеры вместо отдельного потока на
+# каждую пробежку. Отмена — O(1): запись помечается и выбрасывается из кучи
+# лениво, когда до неё дойдёт очередь.
+
+
+class ScheduledTimer:
+    __slots__ = ("interval", "callback", "cancelled")
+
+    def __init__(self, interval, callback):
+        self.interval = interval
+        self.callback = callback
+        self.cancelled = False
+
+
+class TimerScheduler:
+    def __init__(self, name="sharkan-timers"):
+        self.name = name
+        self._heap = []
+        self._seq = itertools.count()
+        self._active = set()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def schedule(self, interval: float, callback, first_delay: float = None) -> ScheduledTimer:
+        # callback() вызывается каждые interval секунд, пока таймер не отменён
+        timer = ScheduledTimer(interval, callback)
+        due = time.monotonic() + (interval if first_delay is None else first_delay)
+        with self._cond:
+            self._active.add(timer)
+            heapq.heappush(self._heap, (due, next(self._seq), timer))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return timer
+
+    def cancel(self, timer: ScheduledTimer):
+        with self._cond:
+            timer.cancelled = True
+            self._active.discard(timer)
+
+    def active_count(self) -> int:
+        return len(self._active)
+
+    def stop(self):
+        # отменить все таймеры и завершить поток — планировщик больше не нужен
+        # (async_main переносит таймеры в цикл событий)
+        with self._cond:
+            for timer in self._active:
+                timer.cancelled = True
+            self._active.clear()
+            self._heap.clear()
+            self._stopped = True
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped and (not self._heap or self._heap[0][0] > time.monotonic()):
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    return
+                # забираем все таймеры, у которых подошёл срок, одной пачкой
+                now = time.monotonic()
+                batch = []
+                while self._heap and self._heap[0][0] <= now:
+                    _, _, timer = heapq.heappop(self._heap)
+                    if not timer.cancelled:
+                        batch.append(timer)
+            for timer in batch:
+                try:
+                    timer.callback()
+                except Exception as e:
+                    logging.error(f"[TIMER_ERROR] {e}")
+            with self._cond:
+                now = time.monotonic()
+                for timer in batch:
+                    if not timer.cancelled:
+                        heapq.heappush(self._heap, (now + timer.interval, next(self._seq), timer))
+
+
+class LoopScheduler:
+    # Тот же интерфейс, но таймеры живут в цикле asyncio (см. async_main.py):
+    # ни одного отдельного потока. schedule/cancel можно вызывать из любого потока.
+    def __init__(self, loop):
+        self.loop = loop
+        self._active = set()
+
+    def schedule(self, interval: float, callback, first_delay: float = None) -> ScheduledTimer:
+        timer = ScheduledTimer(interval, callback)
+        self._active.add(timer)
+        self.loop.call_soon_threadsafe(self._arm, timer, interval if first_delay is None else first_delay)
+        return timer
+
+    def cancel(self, timer: ScheduledTimer):
+        # отложенный вызов останется в цикле, но увидит флаг и ничего не сделает
+        timer.cancelled = True
+        self._active.discard(timer)
+
+    def active_count(self) -> int:
+        return len(self._active)
+
+    def _arm(self, timer, delay):
+        if not timer.cancelled:
+            self.loop.call_later(delay, self._fire, timer)
+
+    def _fire(self, timer):
+        if timer.cancelled:
+            return
+        try:
+            timer.callback()
+        except Exception as e:
+            logging.error(f"[TIMER_ERROR] {e}")
+        self._arm(timer, timer.interval)
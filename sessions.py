@@ -0,0 +1,105 @@
+# sessions.py
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+# === Сессии пользователей ===
+# Всё короткоживущее состояние (какая книга открыта, ждём ли номер страницы,
+# шаг анкеты, последнее «чистое» сообщение) живёт в одном LRU-кэше с TTL,
+# поэтому память ограничена числом активных пользователей, а не всех, кто
+# когда-либо заходил. Позиция чтения пишется в хранилище пачками в фоне
+# (write-behind) и подхватывается после рестарта.
+SESSION_TTL_SEC = 24 * 3600
+SESSION_MAX = 100_000
+FLUSH_EVERY_SEC = 5.0
+
+
+class Session:
+    __slots__ = ("user_id", "book_title", "page", "jump_title", "wizard", "last_msg_id", "touched")
+
+    def __init__(self, user_id, book_title=None, page=0):
+        self.user_id = user_id
+        self.book_title = book_title   # открытая книга
+        self.page = page               # текущая страница (с 0)
+        self.jump_title = None         # ждём номер страницы для этой книги
+        self.wizard = None             # анкета профиля: {"step": ..., "tmp": {...}}
+        self.last_msg_id = None        # последнее сообщение send_clean_message
+        self.touched = time.monotonic()
+
+
+class SessionStore:
+    def __init__(self, storage=None, ttl=SESSION_TTL_SEC, max_size=SESSION_MAX, flush_every=FLUSH_EVERY_SEC):
+        self.storage = storage
+        self.ttl = ttl
+        self.max_size = max_size
+        self.flush_every = flush_every
+        self._sessions = OrderedDict()   # от давно не трогавших к свежим
+        self._dirty = {}                 # user_id -> (book_title, page) к записи
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def peek(self, user_id):
+        # только память, без обращения к хранилищу и без продления жизни
+        return self._sessions.get(user_id)
+
+    def get(self, user_id, create=True):
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is not None:
+                self._sessions.move_to_end(user_id)
+                session.touched = now
+                return session
+        # промах: поднимаем позицию чтения из хранилища (после рестарта / вытеснения)
+        saved = self.storage.load_session(user_id) if self.storage else None
+        if saved is None and not create:
+            return None
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                session = Session(user_id, *(saved or (None, 0)))
+                self._sessions[user_id] = session
+            self._evict(now)
+            return session
+
+    def save_position(self, session):
+        # позиция чтения уйдёт в хранилище при ближайшем сбросе
+        if self.storage:
+            with self._lock:
+                self._dirty[session.user_id] = (session.book_title, session.page)
+
+    def _evict(self, now):
+        limit = now - self.ttl
+        while self._sessions:
+            uid, oldest = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_size and oldest.touched >= limit:
+                break
+            self._sessions.popitem(last=False)
+
+    def flush(self):
+        with self._lock:
+            batch, self._dirty = self._dirty, {}
+        if batch:
+            self.storage.save_sessions((uid, title, page) for uid, (title, page) in batch.items())
+        return len(batch)
+
+    def start_flusher(self):
+        if self.storage and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sharkan-sessions", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        stop = threading.Event()
+        while not stop.wait(self.flush_every):
+            try:
+                self.flush()
+                with self._lock:
+                    self._evict(time.monotonic())
+            except Exception as e:
+                logging.error(f"[SESSION_FLUSH_ERROR] {e}")
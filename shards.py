@@ -0,0 +1,188 @@
+# shards.py
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+import zlib
+
+# === Шардированный режим: несколько процессов-воркеров ===
+# Приёмник (polling или webhook) ничего не обрабатывает сам: по from_user.id
+# он выбирает воркер и кладёт апдейт в его очередь. Каждый воркер — обычный
+# main.py в режиме BOT_MODE=worker: держит в памяти только своих
+# пользователей (профили, сессии, таймеры), а общее — рейтинг и контент —
+# берёт из SQLite и файлов. Запуск:
+#   SHARKAN_SHARDS=4 python shards.py                  # приём из Telegram
+#   SHARKAN_SHARDS=4 python shards.py --replay x.jsonl # записанные апдейты
+SHARDS = int(os.getenv("SHARKAN_SHARDS", "1"))
+SHARD_INDEX = int(os.getenv("SHARKAN_SHARD", "0"))
+WORKER_THREADS = int(os.getenv("SHARKAN_WORKER_THREADS", "4"))
+MAX_PENDING = 1000
+
+INBOX = None   # очередь апдейтов этого воркера (ставится в _worker_main)
+
+# поля апдейта, в которых есть from / chat пользователя
+_UPDATE_KINDS = (
+    "message", "edited_message", "callback_query", "inline_query", "chosen_inline_result",
+    "shipping_query", "pre_checkout_query", "poll_answer", "my_chat_member", "chat_member",
+    "chat_join_request"
+)
+
+
+def shard_of(user_id, shards=SHARDS) -> int:
+    # crc32, а не hash(): номер шарда должен совпадать во всех процессах
+    return zlib.crc32(str(user_id).encode()) % shards if shards > 1 else 0
+
+
+def owns(user_id) -> bool:
+    return SHARDS <= 1 or shard_of(user_id) == SHARD_INDEX
+
+
+def update_user_id(data: dict):
+    for kind in _UPDATE_KINDS:
+        obj = data.get(kind)
+        if obj:
+            who = obj.get("from") or obj.get("user") or obj.get("chat") or {}
+            return who.get("id")
+    return None
+
+
+class ShardRouter:
+    def __init__(self, shards=SHARDS, max_pending=MAX_PENDING):
+        self.shards = shards
+        self._ctx = multiprocessing.get_context("spawn")
+        self._queues = [self._ctx.Queue(max_pending) for _ in range(shards)]
+        self._procs = [None] * shards
+        self.routed = [0] * shards
+        self._stopping = False
+
+    def start(self):
+        for i in range(self.shards):
+            self._spawn(i)
+        threading.Thread(target=self._watch, name="sharkan-shards", daemon=True).start()
+        return self
+
+    def _spawn(self, i):
+        p = self._ctx.Process(target=_worker_main, args=(i, self.shards, self._queues[i]),
+                              name=f"sharkan-shard-{i}", daemon=True)
+        p.start()
+        self._procs[i] = p
+        logging.info(f"[SHARDS] worker {i} started (pid {p.pid})")
+
+    def check(self):
+        # упавший воркер перезапускается; его очередь сохраняется
+        for i, p in enumerate(self._procs):
+            if p is not None and not p.is_alive() and not self._stopping:
+                logging.error(f"[SHARDS] worker {i} exited with {p.exitcode}, restarting")
+                self._spawn(i)
+
+    def _watch(self):
+        stop = threading.Event()
+        while not stop.wait(5):
+            self.check()
+
+    def put(self, data: dict, block=False) -> bool:
+        uid = update_user_id(data)
+        i = shard_of(uid, self.shards) if uid is not None else 0
+        try:
+            self._queues[i].put(data, block=block)
+        except queue.Full:
+            return False
+        self.routed[i] += 1
+        return True
+
+    def stop(self, timeout=30):
+        # пустое сообщение — сигнал воркеру дописать состояние и выйти
+        self._stopping = True
+        for q in self._queues:
+            q.put(None)
+        for p in self._procs:
+            p.join(timeout)
+
+
+def _worker_main(index, shards, inbox):
+    os.environ["SHARKAN_SHARD"] = str(index)
+    os.environ["SHARKAN_SHARDS"] = str(shards)
+    os.environ["BOT_MODE"] = "worker"
+    # в spawn-процессе этот файл может быть загружен как __mp_main__,
+    # поэтому очередь кладём именно в модуль shards, который импортирует main
+    import shards
+    shards.INBOX = inbox
+    import main   # noqa: F401 — main сам запускает serve_worker()
+
+
+def serve_worker(bot, on_stop=None):
+    # выполняется внутри main.py воркера
+    from webhook import UpdateWorkers
+    bot.threaded = False
+    pool = UpdateWorkers(bot, workers=WORKER_THREADS, max_pending=MAX_PENDING)
+    logging.info(f"[SHARDS] worker {SHARD_INDEX}/{SHARDS} ready")
+    while True:
+        data = INBOX.get()
+        if data is None:
+            break
+        try:
+            pool.put(data, block=True)
+        except Exception as e:
+            logging.error(f"[SHARDS_BAD_UPDATE] {e}")
+    pool.drain()
+    if on_stop:
+        on_stop()
+
+
+def _poll(router, token):
+    from telebot import apihelper
+    offset = None
+    while True:
+        try:
+            updates = apihelper.get_updates(token, offset=offset, limit=100, timeout=20)
+        except Exception as e:
+            logging.error(f"[SHARDS_POLL_ERROR] {e}")
+            time.sleep(3)
+            continue
+        for data in updates:
+            router.put(data, block=True)
+            offset = data["update_id"] + 1
+
+
+def _replay(router, path):
+    # записанные апдейты (по одному JSON на строку) — для локальной проверки
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                router.put(json.loads(line), block=True)
+
+
+def main(argv):
+    import logsetup
+    logsetup.setup(logsetup.per_process(logsetup.LOG_FILE, "router"))
+    router = ShardRouter().start()
+    try:
+        if len(argv) > 2 and argv[1] == "--replay":
+            _replay(router, argv[2])
+        elif os.getenv("BOT_MODE", "polling") == "webhook":
+            import webhook
+            from telebot import TeleBot
+            webhook.serve(
+                TeleBot(os.environ["BOT_TOKEN"]),
+                host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+                port=int(os.getenv("WEBHOOK_PORT", "8443")),
+                path=os.getenv("WEBHOOK_PATH", "/webhook"),
+                secret=os.getenv("WEBHOOK_SECRET"),
+                public_url=os.getenv("WEBHOOK_URL"),
+                sink=router
+            )
+        else:
+            _poll(router, os.environ["BOT_TOKEN"])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        router.stop()
+    print(f"routed per shard: {router.routed}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
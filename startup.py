@@ -0,0 +1,94 @@
+# startup.py
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+
+# === Поэтапный старт ===
+# Бот начинает принимать апдейты сразу, а большие наборы данных (контент,
+# баланс монет, история пробежек и рейтинг) грузятся по очереди в фоновом
+# потоке. Хендлер, которому нужен ещё не загруженный этап, помечен
+# @startup.needs(...) и ждёт его не дольше STARTUP_WAIT_SEC; /start, выбор
+# языка, меню и анкета работают без ожидания. LAZY_STARTUP=0 — старое
+# поведение: все этапы до начала приёма апдейтов.
+LAZY_STARTUP = os.getenv("LAZY_STARTUP", "1") not in ("", "0")
+STARTUP_WAIT_SEC = float(os.getenv("STARTUP_WAIT_SEC", "30"))
+
+
+class Startup:
+    def __init__(self, wait_sec=STARTUP_WAIT_SEC):
+        self.wait_sec = wait_sec
+        self.on_timeout = None        # fn(message | call) — ответ «ещё загружаюсь»
+        self.timings = {}             # этап -> секунды
+        self._stages = []
+        self._ready = {}
+        self._thread = None
+
+    def stage(self, name):
+        def decorator(fn):
+            self._stages.append((name, fn))
+            self._ready[name] = threading.Event()
+            return fn
+        return decorator
+
+    def run(self):
+        started = time.perf_counter()
+        for name, fn in self._stages:
+            t = time.perf_counter()
+            try:
+                fn()
+            except Exception as e:
+                # этап всё равно считается пройденным: бот работает с тем, что успел загрузить
+                logging.error(f"[STARTUP_ERROR] {name}: {e}")
+            self.timings[name] = time.perf_counter() - t
+            self._ready[name].set()
+        stages = ", ".join(f"{n}={s * 1000:.0f}ms" for n, s in self.timings.items())
+        logging.info(f"[STARTUP] ready in {(time.perf_counter() - started) * 1000:.0f}ms ({stages})")
+
+    def start(self, lazy=LAZY_STARTUP):
+        if not lazy:
+            self.run()
+        elif self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="sharkan-startup", daemon=True)
+            self._thread.start()
+        return self
+
+    def ready(self, *names) -> bool:
+        return all(self._ready[n].is_set() for n in (names or self._ready))
+
+    def wait(self, *names, timeout=None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for n in names or self._ready:
+            left = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not self._ready[n].wait(left):
+                return False
+        return True
+
+    def needs(self, *names):
+        # декоратор хендлера: дождаться этапов (пусто — всех)
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(obj, *args, **kwargs):
+                if not self.ready(*names) and not self.wait(*names, timeout=self.wait_sec):
+                    if self.on_timeout is not None:
+                        self.on_timeout(obj)
+                    return None
+                return fn(obj, *args, **kwargs)
+            return wrapper
+        return decorator
+
+    def needs_async(self, *names, on_timeout=None):
+        # то же для корутин (async_main.py): ожидание — в потоке, цикл не блокируется;
+        # on_timeout — корутина-ответ «ещё загружаюсь»
+        def decorator(fn):
+            @functools.wraps(fn)
+            async def wrapper(obj, *args, **kwargs):
+                if not self.ready(*names) and not await asyncio.to_thread(self.wait, *names, timeout=self.wait_sec):
+                    if on_timeout is not None:
+                        await on_timeout(obj)
+                    return None
+                return await fn(obj, *args, **kwargs)
+            return wrapper
+        return decorator
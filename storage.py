@@ -0,0 +1,340 @@
+# storage.py
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# === Хранилище SHARKAN: SQLite в режиме WAL ===
+# Профили хранятся построчно (одна строка на пользователя), пробежки — в
+# отдельной таблице, поэтому цена записи не зависит от числа пользователей.
+DB_FILE = os.getenv("SHARKAN_DB", "sharkan.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    user_id TEXT PRIMARY KEY,
+    data    TEXT NOT NULL,
+    rev     INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id      TEXT NOT NULL,
+    date         TEXT NOT NULL,
+    duration_min INTEGER NOT NULL,
+    calories     INTEGER NOT NULL,
+    started      TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_user ON runs(user_id, id);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS coin_tx (
+    id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id  TEXT NOT NULL,
+    kind     TEXT NOT NULL,
+    amount   INTEGER NOT NULL,
+    balance  INTEGER NOT NULL,
+    reason   TEXT,
+    idem_key TEXT UNIQUE,
+    created  TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS coin_tx_user ON coin_tx(user_id, id);
+CREATE TABLE IF NOT EXISTS sessions (
+    user_id    TEXT PRIMARY KEY,
+    book_title TEXT,
+    page       INTEGER NOT NULL DEFAULT 0
+);
+-- удалённые строки (tombstones) для инкрементальных бэкапов; INSERT OR REPLACE
+-- их не порождает: без recursive_triggers замена не вызывает DELETE-триггер
+CREATE TABLE IF NOT EXISTS deleted (
+    id  INTEGER PRIMARY KEY AUTOINCREMENT,
+    tbl TEXT NOT NULL,
+    key TEXT NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS profiles_deleted AFTER DELETE ON profiles
+BEGIN INSERT INTO deleted(tbl, key) VALUES ('profiles', OLD.user_id); END;
+CREATE TRIGGER IF NOT EXISTS runs_deleted AFTER DELETE ON runs
+BEGIN INSERT INTO deleted(tbl, key) VALUES ('runs', OLD.id); END;
+CREATE TRIGGER IF NOT EXISTS coin_tx_deleted AFTER DELETE ON coin_tx
+BEGIN INSERT INTO deleted(tbl, key) VALUES ('coin_tx', OLD.id); END;
+"""
+
+
+class Storage:
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        # isolation_level=None — транзакциями управляем сами (BEGIN/COMMIT)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._upgrade_schema()
+
+    def _upgrade_schema(self):
+        # rev — сквозной номер изменения профиля, нужен инкрементальным бэкапам
+        cols = {row[1] for row in self._conn.execute("PRAGMA table_info(profiles)")}
+        if "rev" not in cols:
+            self._conn.execute("ALTER TABLE profiles ADD COLUMN rev INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS profiles_rev ON profiles(rev)")
+        # started — начало пробежки: повторная запись той же пробежки (после падения) не дублирует её
+        cols = {row[1] for row in self._conn.execute("PRAGMA table_info(runs)")}
+        if "started" not in cols:
+            self._conn.execute("ALTER TABLE runs ADD COLUMN started TEXT")
+        self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS runs_started ON runs(user_id, started)")
+
+    # --- транзакции ---
+    @contextmanager
+    def batch(self):
+        # Все записи внутри блока уходят одним коммитом; вложенные batch()
+        # присоединяются к внешней транзакции.
+        with self._lock:
+            if self._depth == 0:
+                self._conn.execute("BEGIN IMMEDIATE")
+            self._depth += 1
+            try:
+                yield self._conn
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._conn.execute("ROLLBACK")
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self._conn.execute("COMMIT")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @contextmanager
+    def snapshot(self):
+        # Отдельное соединение только для чтения: в WAL оно видит
+        # согласованный срез обеих таблиц и не мешает записи.
+        conn = sqlite3.connect(self.path)
+        try:
+            conn.execute("BEGIN")
+            yield conn
+        finally:
+            conn.close()
+
+    # --- meta ---
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self.batch() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)", (key, value))
+
+    # --- профили ---
+    def load_profiles(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT user_id, data FROM profiles").fetchall()
+        return {uid: json.loads(data) for uid, data in rows}
+
+    def load_profile(self, user_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM profiles WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def load_profiles_with(self, key: str) -> dict:
+        # профили, где есть поле key (JSON1 — без разбора всех профилей в Python)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user_id, data FROM profiles WHERE json_type(data, '$.' || ?) IS NOT NULL", (key,)
+            ).fetchall()
+        return {uid: json.loads(data) for uid, data in rows}
+
+    def save_profile(self, user_id: str, profile: dict):
+        self.upsert_profiles([(user_id, profile)])
+
+    def upsert_profiles(self, rows):
+        # rows — итерируемое (user_id, profile); каждой записи — новый rev
+        with self.batch() as conn:
+            rev = conn.execute("SELECT COALESCE(MAX(rev), 0) FROM profiles").fetchone()[0]
+            for uid, profile in rows:
+                rev += 1
+                conn.execute(
+                    "INSERT OR REPLACE INTO profiles(user_id, data, rev) VALUES (?, ?, ?)",
+                    (uid, json.dumps(profile, ensure_ascii=False), rev)
+                )
+
+    def delete_profiles(self, user_ids):
+        with self.batch() as conn:
+            conn.executemany("DELETE FROM profiles WHERE user_id = ?", ((uid,) for uid in user_ids))
+
+    def replace_profiles(self, profiles):
+        # profiles — dict или итерируемое (user_id, profile)
+        rows = profiles.items() if isinstance(profiles, dict) else profiles
+        with self.batch() as conn:
+            conn.execute("DELETE FROM profiles")
+            self.upsert_profiles(rows)
+
+    # --- пробежки ---
+    def add_run(self, user_id: str, date: str, duration_min: int, calories: int, started: str = None):
+        # started задан и пробежка с ним уже записана — None, новой строки нет
+        with self.batch() as conn:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO runs(user_id, date, duration_min, calories, started) VALUES (?, ?, ?, ?, ?)",
+                (user_id, date, duration_min, calories, started)
+            )
+            return cur.lastrowid if cur.rowcount else None
+
+    def find_run(self, user_id: str, started: str):
+        # -> (id, duration_min) пробежки с этим началом или None
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, duration_min FROM runs WHERE user_id = ? AND started = ?", (user_id, started)
+            ).fetchone()
+
+    def runs_after(self, last_id: int, limit=1000) -> list:
+        # новые пробежки по возрастанию id — для процессов, дочитывающих общую таблицу
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, user_id, date, duration_min, calories FROM runs WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, limit)
+            ).fetchall()
+
+    def runs_for(self, user_id: str, limit=None) -> list:
+        sql = "SELECT date, duration_min, calories FROM runs WHERE user_id = ? ORDER BY id DESC"
+        args = (user_id,)
+        if limit:
+            sql += " LIMIT ?"
+            args += (limit,)
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        return [{"date": d, "duration_min": m, "calories": c} for d, m, c in reversed(rows)]
+
+    def load_runs(self) -> dict:
+        data = {}
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user_id, date, duration_min, calories FROM runs ORDER BY id"
+            ).fetchall()
+        for uid, d, m, c in rows:
+            data.setdefault(uid, []).append({"date": d, "duration_min": m, "calories": c})
+        return data
+
+    def insert_runs(self, rows):
+        # rows — итерируемое (user_id, date, duration_min, calories)
+        with self.batch() as conn:
+            conn.executemany(
+                "INSERT INTO runs(user_id, date, duration_min, calories) VALUES (?, ?, ?, ?)", rows
+            )
+
+    def replace_runs(self, history):
+        # history — dict {user_id: [записи]} или итерируемое строк как в insert_runs
+        rows = _iter_run_rows(history) if isinstance(history, dict) else history
+        with self.batch() as conn:
+            conn.execute("DELETE FROM runs")
+            self.insert_runs(rows)
+
+    # --- монеты: журнал операций ---
+    def add_coin_tx(self, user_id, kind, amount, balance, reason=None, idem_key=None, created=""):
+        # повтор idem_key -> sqlite3.IntegrityError, операция уже записана
+        with self.batch() as conn:
+            cur = conn.execute(
+                "INSERT INTO coin_tx(user_id, kind, amount, balance, reason, idem_key, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (user_id, kind, amount, balance, reason, idem_key, created)
+            )
+            return cur.lastrowid
+
+    def coin_tx_by_key(self, idem_key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT user_id, kind, amount, balance FROM coin_tx WHERE idem_key = ?", (idem_key,)).fetchone()
+        return tuple(row) if row else None
+
+    def coin_balances(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT user_id, SUM(amount) FROM coin_tx GROUP BY user_id").fetchall()
+        return {uid: total for uid, total in rows}
+
+    def coin_tx_for(self, user_id: str, limit=20) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT kind, amount, balance, reason, created FROM coin_tx WHERE user_id = ? "
+                "ORDER BY id DESC LIMIT ?", (user_id, limit)).fetchall()
+        return [{"kind": k, "amount": a, "balance": b, "reason": r, "created": c} for k, a, b, r, c in rows]
+
+    def insert_coin_txs(self, rows):
+        # rows — итерируемое (user_id, kind, amount, balance, reason, idem_key, created)
+        with self.batch() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO coin_tx(user_id, kind, amount, balance, reason, idem_key, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+
+    def replace_coin_txs(self, rows):
+        with self.batch() as conn:
+            conn.execute("DELETE FROM coin_tx")
+            self.insert_coin_txs(rows)
+
+    # --- сессии: позиция чтения ---
+    def load_session(self, user_id: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT book_title, page FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+        return tuple(row) if row else None
+
+    def save_sessions(self, rows):
+        # rows — итерируемое (user_id, book_title, page)
+        with self.batch() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO sessions(user_id, book_title, page) VALUES (?, ?, ?)", rows
+            )
+
+    def replace_sessions(self, rows):
+        with self.batch() as conn:
+            conn.execute("DELETE FROM sessions")
+            self.save_sessions(rows)
+
+    # --- удалённые строки (для бэкапов) ---
+    def prune_deleted(self, upto=None):
+        # upto=None — все; иначе те, что уже попали в цепочку бэкапов
+        with self.batch() as conn:
+            if upto is None:
+                conn.execute("DELETE FROM deleted")
+            else:
+                conn.execute("DELETE FROM deleted WHERE id <= ?", (upto,))
+
+    # --- одноразовая миграция со старых JSON-файлов ---
+    def migrate_from_json(self, profiles_file: str, runs_file: str):
+        if self.get_meta("json_migrated"):
+            return
+        profiles = _read_json(profiles_file)
+        history = _read_json(runs_file)
+        with self.batch() as conn:
+            # повторная проверка внутри транзакции: воркеры стартуют одновременно
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+                return
+            conn.executemany(
+                "INSERT OR REPLACE INTO profiles(user_id, data) VALUES (?, ?)",
+                ((uid, json.dumps(p, ensure_ascii=False)) for uid, p in profiles.items())
+            )
+            conn.executemany(
+                "INSERT INTO runs(user_id, date, duration_min, calories) VALUES (?, ?, ?, ?)",
+                _iter_run_rows(history)
+            )
+            conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('json_migrated', '1')")
+        logging.info(f"[STORAGE] migrated {len(profiles)} profiles, {len(history)} run histories from JSON")
+
+
+def _iter_run_rows(history: dict):
+    for uid, recs in history.items():
+        for r in recs:
+            yield uid, r.get("date", ""), int(r.get("duration_min", 0)), int(r.get("calories", 0))
+
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f) or {}
+    except FileNotFoundError:
+        return {}
@@ -0,0 +1,149 @@
+# track.py
+import math
+import os
+import threading
+from array import array
+
+# === Трек пробежки по live-локации ===
+# Пока идёт пробежка, Telegram присылает edited_message с новой точкой
+# live-локации. Точки копятся в маленьком кольцевом буфере и пачкой
+# превращаются в дистанцию (haversine), время в движении и сплиты по
+# километру; сами точки после этого не хранятся. Память на сессию
+# ограничена: буфер GPS_BATCH точек и не больше MAX_SPLITS сплитов, сколько
+# бы ни длилась пробежка.
+GPS_BATCH = int(os.getenv("GPS_BATCH", "32"))
+MAX_SPLITS = 100
+EARTH_RADIUS_M = 6_371_000.0
+SPLIT_M = 1000.0
+MIN_STEP_M = 5.0          # меньше — дрожание GPS на месте
+MAX_SPEED_MS = 12.0       # быстрее — скачок координат, точку отбрасываем
+MOVING_SPEED_MS = 0.5     # медленнее — стоим, время в движении не идёт
+DEFAULT_MET = 9.8
+
+# Compendium of Physical Activities: скорость (км/ч) -> MET; между точками — линейно
+_MET_TABLE = ((3.2, 2.8), (4.8, 3.5), (5.6, 4.3), (6.4, 5.0), (8.0, 8.3), (8.4, 9.0), (9.7, 9.8),
+              (10.8, 10.5), (11.3, 11.0), (12.1, 11.8), (12.9, 12.3), (13.8, 12.8), (14.5, 14.5),
+              (16.1, 16.0), (17.7, 19.0), (19.3, 19.8), (20.9, 23.0))
+
+
+def met_for_speed(kmh: float) -> float:
+    if kmh <= _MET_TABLE[0][0]:
+        return _MET_TABLE[0][1]
+    for (s0, m0), (s1, m1) in zip(_MET_TABLE, _MET_TABLE[1:]):
+        if kmh <= s1:
+            return m0 + (m1 - m0) * (kmh - s0) / (s1 - s0)
+    return _MET_TABLE[-1][1]
+
+
+def format_pace(sec_per_km: float) -> str:
+    if not sec_per_km or sec_per_km == math.inf:
+        return "—"
+    sec = int(round(sec_per_km))
+    return f"{sec // 60}:{sec % 60:02d}"
+
+
+class RunTrack:
+    __slots__ = ("_lat", "_lon", "_ts", "_acc", "_n", "_last", "_lock",
+                 "distance_m", "moving_s", "points", "dropped", "splits", "_split_mark", "_split_t")
+
+    def __init__(self, batch=GPS_BATCH):
+        # буфер: радианы и время точек, ожидающих обработки
+        self._lat = array("d", bytes(8 * batch))
+        self._lon = array("d", bytes(8 * batch))
+        self._ts = array("d", bytes(8 * batch))
+        self._acc = array("d", bytes(8 * batch))
+        self._n = 0
+        self._last = None            # (lat, lon, t) последней принятой точки
+        self._lock = threading.Lock()
+        self.distance_m = 0.0
+        self.moving_s = 0.0
+        self.points = 0
+        self.dropped = 0
+        self.splits = array("f")     # секунды на каждый полный километр
+        self._split_mark = SPLIT_M   # дистанция следующего сплита
+        self._split_t = None         # время начала текущего километра
+
+    def add(self, lat: float, lon: float, ts: float, accuracy: float = 0.0):
+        with self._lock:
+            i = self._n
+            self._lat[i] = math.radians(lat)
+            self._lon[i] = math.radians(lon)
+            self._ts[i] = ts
+            self._acc[i] = accuracy or 0.0
+            self._n = i + 1
+            self.points += 1
+            if self._n == len(self._lat):
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        # haversine по всей пачке за один проход
+        n, self._n = self._n, 0
+        if not n:
+            return
+        sin, cos, asin, sqrt = math.sin, math.cos, math.asin, math.sqrt
+        lats, lons, tss, accs = self._lat, self._lon, self._ts, self._acc
+        last = self._last
+        if last is None:
+            last = self._last = (lats[0], lons[0], tss[0])
+            self._split_t = tss[0]
+            start = 1
+        else:
+            start = 0
+        lat0, lon0, t0 = last
+        cos0 = cos(lat0)
+        for i in range(start, n):
+            lat1, lon1, t1 = lats[i], lons[i], tss[i]
+            if t1 <= t0:
+                continue
+            cos1 = cos(lat1)
+            h = sin((lat1 - lat0) / 2) ** 2 + cos0 * cos1 * sin((lon1 - lon0) / 2) ** 2
+            step = 2 * EARTH_RADIUS_M * asin(min(1.0, sqrt(h)))
+            dt = t1 - t0
+            if step < max(MIN_STEP_M, accs[i]):
+                continue                  # на месте — ждём, пока отойдём дальше
+            if step / dt > MAX_SPEED_MS:
+                self.dropped += 1
+                continue
+            if step / dt >= MOVING_SPEED_MS:
+                self.moving_s += dt
+            self._add_distance(step, t0, dt)
+            lat0, lon0, t0, cos0 = lat1, lon1, t1, cos1
+        self._last = (lat0, lon0, t0)
+
+    def _add_distance(self, step, t0, dt):
+        before = self.distance_m
+        self.distance_m = before + step
+        while self.distance_m >= self._split_mark:
+            # момент пересечения отметки — линейно внутри отрезка
+            t_cross = t0 + dt * (self._split_mark - before) / step
+            if len(self.splits) < MAX_SPLITS:
+                self.splits.append(t_cross - self._split_t)
+            self._split_t = t_cross
+            self._split_mark += SPLIT_M
+
+    def progress(self):
+        # (дистанция в метрах, темп в с/км) с учётом ещё не обработанных точек —
+        # одним снимком, чтобы дистанция и темп в сообщении совпадали
+        with self._lock:
+            self._flush()
+            if self.distance_m < 1:
+                return self.distance_m, math.inf
+            return self.distance_m, self.moving_s / (self.distance_m / 1000)
+
+    def pace(self) -> float:
+        # секунды на километр в движении
+        return self.progress()[1]
+
+    def speed_kmh(self) -> float:
+        with self._lock:
+            self._flush()
+            return self.distance_m / self.moving_s * 3.6 if self.moving_s else 0.0
+
+    def met(self) -> float:
+        # MET по средней скорости; без трека — прежнее фиксированное значение
+        kmh = self.speed_kmh()
+        return met_for_speed(kmh) if kmh else DEFAULT_MET
@@ -0,0 +1,101 @@
+# webhook.py
+import hmac
+import json
+import logging
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+# === Webhook-режим ===
+# Лёгкий HTTP-сервер: принимает апдейты от Telegram (или от балансировщика),
+# проверяет секретный токен и раздаёт апдейты в ограниченный пул воркеров,
+# которые вызывают те же хендлеры, что и при infinity_polling.
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class UpdateWorkers:
+    def __init__(self, bot, workers=8, max_pending=1000):
+        self.bot = bot
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._threads = [
+            threading.Thread(target=self._run, name=f"sharkan-webhook-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def put(self, data: dict, block=False) -> bool:
+        # data — апдейт как пришёл от Telegram (dict);
+        # False — очередь переполнена, Telegram повторит доставку позже
+        update = types.Update.de_json(data)
+        try:
+            self._queue.put(update, block=block)
+            return True
+        except queue.Full:
+            return False
+
+    def drain(self):
+        # дождаться обработки всего, что уже принято
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            update = self._queue.get()
+            try:
+                self.bot.process_new_updates([update])
+            except Exception as e:
+                logging.error(f"[WEBHOOK_HANDLER_ERROR] {e}")
+            finally:
+                self._queue.task_done()
+
+
+def make_handler(sink, path, secret):
+    # sink.put(dict) -> bool: пул воркеров этого процесса или маршрутизатор шардов
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != path:
+                self.send_error(404)
+                return
+            got = self.headers.get(SECRET_HEADER, "")
+            if secret and not hmac.compare_digest(got, secret):
+                self.send_error(403)
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                accepted = sink.put(json.loads(self.rfile.read(length).decode("utf-8")))
+            except Exception as e:
+                logging.error(f"[WEBHOOK_BAD_UPDATE] {e}")
+                self.send_error(400)
+                return
+            if not accepted:
+                self.send_error(503)
+                return
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, fmt, *args):
+            pass  # access-лог не нужен, ошибки пишем сами
+
+    return WebhookHandler
+
+
+def serve(bot, host="0.0.0.0", port=8443, path="/webhook", secret=None,
+          public_url=None, workers=8, max_pending=1000, sink=None):
+    # хендлеры выполняются в нашем пуле, второй пул TeleBot не нужен;
+    # с sink апдейты только принимаются и передаются дальше (см. shards.py)
+    if sink is None:
+        bot.threaded = False
+        sink = UpdateWorkers(bot, workers=workers, max_pending=max_pending)
+    server = ThreadingHTTPServer((host, port), make_handler(sink, path, secret))
+    server.daemon_threads = True
+    if public_url:
+        bot.remove_webhook()
+        bot.set_webhook(url=public_url.rstrip("/") + path, secret_token=secret, drop_pending_updates=True)
+    logging.info(f"[WEBHOOK] listening on {host}:{server.server_address[1]}{path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()